@@ -1,6 +1,21 @@
 import whisper
+import ffmpeg
 import os
+import re
+import json
+import hashlib
+import uuid
+import time
+import asyncio
+import threading
 import torch
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import stage, observe_stage
+from loop_guard import blocking
 
 # FFmpeg Path Configuration
 # Add potential FFmpeg paths for Windows users who might have it installed via other apps
@@ -20,44 +35,371 @@ for p in POTENTIAL_FFMPEG_PATHS:
             print(f"[AUDIO] Found and added FFmpeg to PATH: {p}")
         break
 
-# Lazy load model to save memory/startup time
-MODEL_CACHE = {}
+# ── Whisper model manager ────────────────────────────────────────────────────
+# Models are loaded lazily (or preloaded at startup via WHISPER_PRELOAD) and kept
+# in an LRU bounded by WHISPER_MEMORY_BUDGET_MB, so one request for `large` no
+# longer pins gigabytes next to `base` forever.
+#
+# Whisper's decoder installs kv-cache hooks on the model for the length of a
+# decode, so one model object can only run one decode at a time. Each size is
+# therefore kept as up to WHISPER_REPLICAS independent copies: lease() hands
+# out an idle replica, loads another one while the size is below its replica
+# limit and the memory budget has room, and otherwise waits for one to come
+# back. Decodes on different replicas run side by side (torch releases the
+# GIL inside its kernels).
+
+# Approximate fp32 footprint per model size, used to make room *before* loading.
+_ESTIMATED_MODEL_MB = {
+    "tiny": 150,
+    "base": 290,
+    "small": 970,
+    "medium": 3000,
+    "large": 6000,
+}
+
+WHISPER_REPLICAS = int(os.environ.get("WHISPER_REPLICAS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+
+class WhisperModelManager:
+    def __init__(self, memory_budget_mb: int = 4096, max_replicas: int = 1):
+        self.memory_budget_mb = memory_budget_mb
+        self.max_replicas = max(1, max_replicas)
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # model_size -> {replicas, idle, loading, size_mb, load_seconds, loaded_at}
+        self._models = OrderedDict()
+        self._cond = threading.Condition()  # Guards _models; notified when a replica frees up
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextmanager
+    def lease(self, model_size: str = "base"):
+        """Exclusive use of one replica of `model_size` for the length of the block."""
+        model = self._acquire(model_size)
+        try:
+            yield model
+        finally:
+            self._release(model_size, model)
+
+    def _acquire(self, model_size):
+        with self._cond:
+            while True:
+                entry = self._models.get(model_size)
+                if entry is None:
+                    self._evict_for(_ESTIMATED_MODEL_MB.get(model_size, 0))
+                    entry = self._models[model_size] = {
+                        "replicas": [], "idle": [], "loading": 0,
+                        "size_mb": _ESTIMATED_MODEL_MB.get(model_size, 0),
+                        "load_seconds": 0.0, "loaded_at": None,
+                    }
+                self._models.move_to_end(model_size)
+                if entry["idle"]:
+                    self.hits += 1
+                    return entry["idle"].pop()
+                if len(entry["replicas"]) + entry["loading"] < self._replica_limit(model_size, entry):
+                    entry["loading"] += 1
+                    self.misses += 1
+                    break
+                self._cond.wait()
+
+        try:
+            model, size_mb, load_seconds = self._load(model_size)
+        except Exception:
+            with self._cond:
+                entry["loading"] -= 1
+                if not entry["replicas"] and not entry["loading"] and self._models.get(model_size) is entry:
+                    del self._models[model_size]
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            entry["loading"] -= 1
+            entry["replicas"].append(model)
+            entry["size_mb"] = size_mb
+            entry["load_seconds"] = load_seconds
+            entry["loaded_at"] = time.time()
+            if self._models.get(model_size) is not entry:
+                # Evicted while loading; still usable for this lease
+                self._models[model_size] = entry
+            # Actual size may differ from the estimate; trim others if over budget
+            self._evict_for(0, keep=model_size)
+            self._cond.notify_all()
+        return model
+
+    def _release(self, model_size, model):
+        with self._cond:
+            entry = self._models.get(model_size)
+            if entry is not None and any(m is model for m in entry["replicas"]):
+                entry["idle"].append(model)
+            self._cond.notify_all()
+
+    def _load(self, model_size):
+        print(f"[WHISPER] Loading {model_size} model on {self.device}...")
+        started = time.perf_counter()
+        model = whisper.load_model(model_size, device=self.device)
+        load_seconds = time.perf_counter() - started
+        observe_stage("whisper_model_load", load_seconds)
+        size_mb = _model_size_mb(model)
+        print(f"[WHISPER] Loaded {model_size} in {load_seconds:.1f}s ({size_mb:.0f} MB resident)")
+        return model, size_mb, load_seconds
+
+    def _replica_limit(self, model_size, entry) -> int:
+        """How many replicas of `model_size` fit next to the other sizes. Caller holds _cond."""
+        others = sum(self._resident(e) for size, e in self._models.items() if size != model_size)
+        fits = int((self.memory_budget_mb - others) // max(entry["size_mb"], 1))
+        return max(1, min(self.max_replicas, fits))
+
+    @staticmethod
+    def _resident(entry) -> float:
+        return entry["size_mb"] * (len(entry["replicas"]) + entry["loading"])
+
+    def preload(self, model_sizes):
+        """Loads the given sizes up front so the first request doesn't pay for it."""
+        for size in model_sizes:
+            try:
+                with self.lease(size):
+                    pass
+            except Exception as e:
+                print(f"[WHISPER] Preload of {size} failed: {e}")
+
+    def decode_slots(self) -> dict:
+        """model_size -> how many decodes of that size can run at once right now."""
+        with self._cond:
+            return {size: self._replica_limit(size, e) for size, e in self._models.items()}
+
+    def resident_mb(self) -> float:
+        with self._cond:
+            return sum(self._resident(e) for e in self._models.values())
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "device": self.device,
+                "memory_budget_mb": self.memory_budget_mb,
+                "max_replicas": self.max_replicas,
+                "resident_mb": round(sum(self._resident(e) for e in self._models.values()), 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "models": [
+                    {
+                        "model_size": size,
+                        "size_mb": round(e["size_mb"], 1),
+                        "replicas": len(e["replicas"]),
+                        "busy": len(e["replicas"]) - len(e["idle"]),
+                        "load_seconds": round(e["load_seconds"], 2),
+                        "loaded_at": e["loaded_at"],
+                    }
+                    for size, e in self._models.items()
+                ],
+            }
+
+    def _evict_for(self, needed_mb: float, keep: str = None):
+        """
+        Drops least-recently-used sizes until `needed_mb` fits the budget. Sizes
+        with a replica in use or loading are skipped. Caller holds _cond.
+        """
+        used = sum(self._resident(e) for e in self._models.values())
+        evicted = False
+        for size in list(self._models.keys()):
+            if used + needed_mb <= self.memory_budget_mb:
+                break
+            entry = self._models[size]
+            if size == keep or entry["loading"] or len(entry["idle"]) < len(entry["replicas"]):
+                continue
+            del self._models[size]
+            used -= self._resident(entry)
+            self.evictions += 1
+            evicted = True
+            print(f"[WHISPER] Evicted {size} model ({len(entry['replicas'])} x {entry['size_mb']:.0f} MB)")
+        if evicted and self.device == "cuda":
+            torch.cuda.empty_cache()
+
+def _model_size_mb(model) -> float:
+    total = sum(t.numel() * t.element_size() for t in model.parameters())
+    total += sum(t.numel() * t.element_size() for t in model.buffers())
+    return total / (1024 * 1024)
+
+model_manager = WhisperModelManager(
+    memory_budget_mb=int(os.environ.get("WHISPER_MEMORY_BUDGET_MB", "4096")),
+    max_replicas=WHISPER_REPLICAS,
+)
+
+# Comma-separated sizes to load on startup, e.g. WHISPER_PRELOAD="base,small"
+PRELOAD_MODELS = [s.strip() for s in os.environ.get("WHISPER_PRELOAD", "").split(",") if s.strip()]
+
+def _decode(model_size: str, audio_path: str, options: dict) -> dict:
+    """Runs one transcribe() on a leased replica of `model_size`."""
+    with model_manager.lease(model_size) as model:
+        # fp16=False is safer for CPU to avoid warnings
+        return model.transcribe(audio_path, fp16=False, **options)
+
+# ── Transcript cache ─────────────────────────────────────────────────────────
+# Finished transcripts are persisted as JSON under TRANSCRIPT_CACHE_DIR, keyed by
+# (audio content hash, model size, language, prompt, decoding mode), so
+# re-submitting the same recording - or asking for it as SRT/VTT - never re-runs
+# Whisper. The mode is part of the key because whole-file, long-audio and
+# streaming decodes window the audio differently and give different transcripts. Least recently
+# used entries are evicted once the directory exceeds TRANSCRIPT_CACHE_MAX_ENTRIES.
+
+class TranscriptCache:
+    def __init__(self, cache_dir: str, max_entries: int = 500):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, audio_hash: str, model_size: str, language: str = None, mode: str = "auto") -> str:
+        """`mode` is "auto", "long" or "single" (see transcription_mode) or "stream"."""
+        options = _transcribe_options(language)
+        raw = "|".join([
+            audio_hash,
+            model_size,
+            options.get("language", "auto"),
+            options.get("initial_prompt", ""),
+            mode,
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-def get_model(model_size="base"):
-    if model_size not in MODEL_CACHE:
-        # Check for CUDA
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"[WHISPER] Loading {model_size} model on {device}...")
-        MODEL_CACHE[model_size] = whisper.load_model(model_size, device=device)
-    return MODEL_CACHE[model_size]
+    def key_for_file(self, file_path: str, model_size: str, language: str = None, mode: str = "auto") -> str:
+        return self.key_for(hash_audio_file(file_path), model_size, language, mode)
 
-def transcribe_audio(file_path: str, model_size: str = "base", language: str = None):
+    @blocking
+    def get(self, key: str):
+        path = self.cache_dir / f"{key}.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        os.utime(path)  # mtime doubles as last-access time for LRU eviction
+        with self._lock:
+            self.hits += 1
+        return result
+
+    @blocking
+    def put(self, key: str, result: dict):
+        path = self.cache_dir / f"{key}.json"
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(list(self.cache_dir.glob("*.json"))),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self.cache_dir.glob("*.json"), key=lambda p: p.stat().st_mtime)
+            for path in entries[:max(0, len(entries) - self.max_entries)]:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+def transcription_mode(long_audio: bool = None) -> str:
+    """The cache-key mode for transcribe_audio's `long_audio` argument."""
+    if long_audio is None:
+        return "auto"
+    return "long" if long_audio else "single"
+
+@blocking
+def hash_audio_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+transcript_cache = TranscriptCache(
+    cache_dir=os.environ.get("TRANSCRIPT_CACHE_DIR", "transcript_cache"),
+    max_entries=int(os.environ.get("TRANSCRIPT_CACHE_MAX_ENTRIES", "500")),
+)
+
+def _format_timestamp(seconds: float, separator: str) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+def render_srt(segments) -> str:
+    blocks = []
+    for i, seg in enumerate(segments, start=1):
+        blocks.append(
+            f"{i}\n"
+            f"{_format_timestamp(seg['start'], ',')} --> {_format_timestamp(seg['end'], ',')}\n"
+            f"{seg['text'].strip()}\n"
+        )
+    return "\n".join(blocks)
+
+def render_vtt(segments) -> str:
+    blocks = ["WEBVTT\n"]
+    for seg in segments:
+        blocks.append(
+            f"{_format_timestamp(seg['start'], '.')} --> {_format_timestamp(seg['end'], '.')}\n"
+            f"{seg['text'].strip()}\n"
+        )
+    return "\n".join(blocks)
+
+def render_transcript(result: dict, output_format: str = "json"):
+    """Renders a transcript result as json (dict), txt, srt or vtt (str)."""
+    if output_format == "srt":
+        return render_srt(result.get("segments", []))
+    if output_format == "vtt":
+        return render_vtt(result.get("segments", []))
+    if output_format == "txt":
+        return result.get("text", "")
+    return result
+
+@blocking
+def transcribe_audio(file_path: str, model_size: str = "base", language: str = None, long_audio: bool = None,
+                     cache_key: str = None):
     """
     Transcribes audio using OpenAI Whisper.
     file_path: Path to the audio file.
     model_size: 'tiny', 'base', 'small', 'medium', 'large'
     language: Optional ISO code (e.g. 'en', 'hi'). If None, auto-detects.
+    long_audio: Split on silence and transcribe chunk by chunk. None = auto
+                (enabled when the recording is longer than LONG_AUDIO_THRESHOLD seconds).
+    cache_key: Transcript cache key from a caller that already hashed the file
+               and missed the cache; skips hashing and the lookup here.
     """
     try:
-        model = get_model(model_size)
-        
-        # Options
-        options = {}
-        if language and language != "auto":
-            options["language"] = language
-            # Improve Hindi accuracy by prompting with Devanagari
-            if language == "hi":
-                options["initial_prompt"] = "नमस्ते, यह हिंदी ट्रांसक्रिप्शन है।"
-
-        # Transcribe
-        # fp16=False is safer for CPU to avoid warnings
-        result = model.transcribe(file_path, fp16=False, **options)
+        if cache_key is None:
+            cache_key = transcript_cache.key_for_file(file_path, model_size, language, transcription_mode(long_audio))
+            cached = transcript_cache.get(cache_key)
+            if cached:
+                return cached
+
+        duration = None
+        if long_audio is None:
+            duration = _probe_duration(file_path)
+            long_audio = duration > LONG_AUDIO_THRESHOLD
+
+        if long_audio:
+            result = _transcribe_long(model_size, file_path, language, duration)
+        else:
+            result = _decode(model_size, file_path, _transcribe_options(language))
         
-        return {
+        transcript = {
             "text": result["text"].strip(),
             "language": result.get("language", "unknown"),
-            "segments": result.get("segments", []) # For timestamps
+            "segments": result.get("segments", []), # For timestamps
+            "cache_key": cache_key
         }
+        transcript_cache.put(cache_key, transcript)
+        return transcript
         
     except Exception as e:
         print(f"Transcription Error: {e}")
@@ -69,3 +411,414 @@ def transcribe_audio(file_path: str, model_size: str = "base", language: str = N
                 os.remove(file_path)
             except Exception as cleanup_err:
                 print(f"[WARN] Could not delete temp file {file_path}: {cleanup_err}")
+
+def _transcribe_options(language: str = None) -> dict:
+    options = {}
+    if language and language != "auto":
+        options["language"] = language
+        # Improve Hindi accuracy by prompting with Devanagari
+        if language == "hi":
+            options["initial_prompt"] = "नमस्ते, यह हिंदी ट्रांसक्रिप्शन है।"
+    return options
+
+# ── Long-audio mode ──────────────────────────────────────────────────────────
+# Long recordings are cut at silence boundaries (ffmpeg silencedetect) into
+# chunks of roughly LONG_AUDIO_CHUNK_SECONDS and stitched back together with
+# timestamps shifted by the chunk offset. The first chunk is decoded alone to
+# detect the language; the rest are fanned out over the chunk pool, each on
+# its own model replica (see WhisperModelManager), so a long recording uses up
+# to WHISPER_REPLICAS decodes at once. Each decode only holds one chunk's audio
+# and mel, which keeps memory flat on multi-hour recordings.
+
+LONG_AUDIO_THRESHOLD = float(os.environ.get("LONG_AUDIO_THRESHOLD", "900"))        # seconds
+LONG_AUDIO_CHUNK_SECONDS = float(os.environ.get("LONG_AUDIO_CHUNK_SECONDS", "300"))
+SILENCE_NOISE_DB = "-30dB"
+SILENCE_MIN_SECONDS = 0.5
+
+_SILENCE_RE = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+_chunk_executor = None
+_chunk_executor_lock = threading.Lock()
+
+def _get_chunk_executor() -> ThreadPoolExecutor:
+    # Shared by all long-audio jobs; replica leases bound the actual decodes
+    global _chunk_executor
+    with _chunk_executor_lock:
+        if _chunk_executor is None:
+            _chunk_executor = ThreadPoolExecutor(max_workers=model_manager.max_replicas,
+                                                 thread_name_prefix="whisper-chunk")
+        return _chunk_executor
+
+def _probe_duration(file_path: str) -> float:
+    try:
+        return float(ffmpeg.probe(file_path)["format"]["duration"])
+    except Exception as e:
+        print(f"[AUDIO] Could not probe duration of {file_path}: {e}")
+        return 0.0
+
+def _detect_silences(file_path: str):
+    """Returns the midpoints (seconds) of silent stretches in the recording."""
+    _, err = (
+        ffmpeg
+        .input(file_path)
+        .filter("silencedetect", noise=SILENCE_NOISE_DB, d=SILENCE_MIN_SECONDS)
+        .output("-", format="null")
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    midpoints = []
+    start = None
+    for kind, value in _SILENCE_RE.findall(err.decode("utf-8", errors="ignore")):
+        if kind == "start":
+            start = float(value)
+        elif start is not None:
+            midpoints.append((start + float(value)) / 2)
+            start = None
+    return midpoints
+
+def _plan_chunks(duration: float, silences, target: float):
+    """
+    Picks cut points so chunks are about `target` seconds long, snapping each cut
+    to the nearest silence within half a chunk (hard cut otherwise).
+    Returns a list of (start, end) tuples.
+    """
+    bounds = [0.0]
+    while duration - bounds[-1] > target * 1.5:
+        ideal = bounds[-1] + target
+        window = [s for s in silences if abs(s - ideal) <= target / 2 and s > bounds[-1]]
+        bounds.append(min(window, key=lambda s: abs(s - ideal)) if window else ideal)
+    bounds.append(duration)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _transcribe_chunk(model_size: str, file_path: str, start: float, end: float, options: dict):
+    chunk_path = f"{file_path}.{uuid.uuid4().hex}.wav"
+    try:
+        (
+            ffmpeg
+            .input(file_path, ss=start, t=end - start)
+            .output(chunk_path, ac=1, ar=16000)
+            .overwrite_output()
+            .run(quiet=True)
+        )
+        return _decode(model_size, chunk_path, options)
+    finally:
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+
+def _transcribe_long(model_size: str, file_path: str, language: str = None, duration: float = None) -> dict:
+    if duration is None:
+        duration = _probe_duration(file_path)
+    if duration <= 0:
+        return _decode(model_size, file_path, _transcribe_options(language))
+    chunks = _plan_chunks(duration, _detect_silences(file_path), LONG_AUDIO_CHUNK_SECONDS)
+    print(f"[WHISPER] Long-audio mode: {duration:.0f}s in {len(chunks)} chunks, "
+          f"up to {model_manager.max_replicas} at a time")
+
+    options = _transcribe_options(language)
+    first_start, first_end = chunks[0]
+    first = _transcribe_chunk(model_size, file_path, first_start, first_end, options)
+    # Without a language, detect it on the first chunk and pin it for the rest
+    # so every chunk is decoded consistently.
+    if "language" not in options:
+        options = _transcribe_options(first.get("language"))
+
+    pool = _get_chunk_executor()
+    futures = [pool.submit(_transcribe_chunk, model_size, file_path, start, end, options)
+               for start, end in chunks[1:]]
+    try:
+        results = [first] + [f.result() for f in futures]
+    except Exception:
+        for f in futures:
+            f.cancel()
+        raise
+
+    return _stitch_results(results, [start for start, _ in chunks])
+
+def _stitch_results(results, offsets) -> dict:
+    """Merges per-chunk Whisper results, shifting segment timestamps by each chunk's offset."""
+    segments = []
+    texts = []
+    for result, offset in zip(results, offsets):
+        texts.append(result["text"].strip())
+        for seg in result.get("segments", []):
+            seg = dict(seg)
+            seg["id"] = len(segments)
+            seg["start"] = seg["start"] + offset
+            seg["end"] = seg["end"] + offset
+            segments.append(seg)
+    return {
+        "text": " ".join(t for t in texts if t),
+        "language": results[0].get("language", "unknown") if results else "unknown",
+        "segments": segments,
+    }
+
+# ── Streaming mode ───────────────────────────────────────────────────────────
+# Whisper's transcribe() only returns once the whole file is done, so streaming
+# transcribes the recording in short silence-aligned windows, in order, and
+# yields each window's segments as soon as they are ready.
+
+STREAM_CHUNK_SECONDS = float(os.environ.get("STREAM_CHUNK_SECONDS", "30"))
+
+@blocking
+def transcribe_audio_stream(file_path: str, model_size: str = "base", language: str = None, cancel=None):
+    """
+    Generator version of transcribe_audio. Yields events:
+    {"type": "segment", "segment": {...}, "progress": 0-100} per segment and a
+    final {"type": "done", "text", "language", "segments"}.
+    `cancel` is an optional threading.Event; once set, the generator stops
+    before the next window instead of transcribing the rest of the file.
+    """
+    try:
+        if cancel is not None and cancel.is_set():
+            return
+        cache_key = transcript_cache.key_for_file(file_path, model_size, language, "stream")
+        cached = transcript_cache.get(cache_key)
+        if cached:
+            for seg in cached.get("segments", []):
+                yield {"type": "segment", "segment": seg, "progress": 100.0}
+            yield {"type": "done", **cached}
+            return
+
+        duration = _probe_duration(file_path)
+        if duration <= 0:
+            raise ValueError("Could not determine audio duration")
+        chunks = _plan_chunks(duration, _detect_silences(file_path), STREAM_CHUNK_SECONDS)
+
+        options = _transcribe_options(language)
+        results = []
+        for start, end in chunks:
+            if cancel is not None and cancel.is_set():
+                print(f"[WHISPER] Stream cancelled after {len(results)}/{len(chunks)} windows")
+                return
+            if results:
+                # Carry context across windows, as Whisper does internally
+                options = dict(options, initial_prompt=results[-1]["text"][-200:])
+            result = _transcribe_chunk(model_size, file_path, start, end, options)
+            results.append(result)
+            if "language" not in options:
+                options = _transcribe_options(result.get("language"))
+
+            stitched_count = sum(len(r.get("segments", [])) for r in results[:-1])
+            for i, seg in enumerate(result.get("segments", [])):
+                yield {
+                    "type": "segment",
+                    "segment": {
+                        "id": stitched_count + i,
+                        "start": seg["start"] + start,
+                        "end": seg["end"] + start,
+                        "text": seg["text"],
+                    },
+                    "progress": round(min(100.0, (start + seg["end"]) / duration * 100), 1),
+                }
+            yield {"type": "progress", "progress": round(end / duration * 100, 1)}
+
+        final = _stitch_results(results, [start for start, _ in chunks])
+        final["text"] = final["text"].strip()
+        final["cache_key"] = cache_key
+        transcript_cache.put(cache_key, final)
+        yield {"type": "done", **final}
+
+    except Exception as e:
+        print(f"Transcription Error: {e}")
+        raise ValueError(f"Transcription failed: {str(e)}")
+    finally:
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except Exception as cleanup_err:
+                print(f"[WARN] Could not delete temp file {file_path}: {cleanup_err}")
+
+# ── Transcription scheduler ──────────────────────────────────────────────────
+# Whisper runs on a dedicated, bounded pool instead of the event loop's default
+# executor, so concurrent uploads queue up rather than all fighting for the same
+# cores. When the queue is full, submit() raises QueueFullError (HTTP 429).
+#
+# Each worker needs its own model replica to decode (see WhisperModelManager),
+# so the replica limit is raised to at least WHISPER_WORKERS. The memory budget
+# still caps replicas per size: stats() reports the effective decode slots for
+# each loaded size, which is the real concurrency for jobs on that size.
+# WHISPER_TORCH_THREADS defaults to the cores divided by the replica count, so
+# concurrent decodes split the CPU instead of each grabbing all of it (0 leaves
+# torch's own default).
+
+class QueueFullError(Exception):
+    def __init__(self, queued: int, capacity: int):
+        super().__init__(f"Transcription queue is full ({queued}/{capacity} waiting)")
+        self.queued = queued
+        self.capacity = capacity
+
+class TranscriptionScheduler:
+    def __init__(self, workers: int = 1, max_queue: int = 8, torch_threads: int = 0, job_ttl: int = 3600):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.job_ttl = job_ttl
+        # A worker without a replica of its own would just wait for another's
+        model_manager.max_replicas = max(model_manager.max_replicas, workers)
+        self.torch_threads = torch_threads
+        if torch_threads > 0:
+            torch.set_num_threads(torch_threads)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whisper")
+        self._lock = threading.Lock()
+        self._queued = OrderedDict()  # job_id -> None, in submission order
+        self._running = set()
+        self.jobs = {}
+
+    def submit(self, file_path: str, model_size: str = "base", language: str = None, long_audio: bool = None,
+               cache_key: str = None) -> str:
+        """Queues a transcription and returns its job id. Raises QueueFullError when saturated."""
+        return self._submit(transcribe_audio, file_path, model_size, language, long_audio, cache_key,
+                            model_size=model_size)
+
+    def completed(self, result: dict, model_size: str = "base") -> str:
+        """Records an already-finished job (e.g. a cache hit) so it can be polled like any other."""
+        now = time.time()
+        with self._lock:
+            self._prune()
+            job_id = str(uuid.uuid4())
+            self.jobs[job_id] = {
+                "id": job_id,
+                "status": "completed",
+                "model_size": model_size,
+                "submitted_at": now,
+                "started_at": now,
+                "finished_at": now,
+                "result": result,
+                "error": None,
+            }
+        return job_id
+
+    def _submit(self, fn, *args, model_size: str = "base") -> str:
+        with self._lock:
+            self._prune()
+            if len(self._queued) >= self.max_queue:
+                raise QueueFullError(len(self._queued), self.max_queue)
+
+            job_id = str(uuid.uuid4())
+            self.jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "model_size": model_size,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self._queued[job_id] = None
+            future = self._executor.submit(self._run, job_id, fn, *args)
+            self.jobs[job_id]["future"] = future
+        return job_id
+
+    async def stream(self, file_path: str, model_size: str = "base", language: str = None,
+                     keepalive: float = 15.0):
+        """
+        Queues a streaming transcription and yields its events as they arrive.
+        While the job waits or a window is decoding, yields {"type": "keepalive", ...}
+        every `keepalive` seconds so proxies don't time the request out.
+        Raises QueueFullError before yielding anything if the queue is saturated.
+        Closing the generator (e.g. the client disconnects) cancels the job: the
+        worker stops before its next window, or skips the job if still queued.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        done = object()
+        cancel = threading.Event()
+
+        def produce(path, size, lang):
+            try:
+                for event in transcribe_audio_stream(path, size, lang, cancel):
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+            except Exception as e:
+                loop.call_soon_threadsafe(events.put_nowait, {"type": "error", "detail": str(e)})
+                raise
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, done)
+
+        job_id = self._submit(produce, file_path, model_size, language, model_size=model_size)
+        try:
+            yield {"type": "queued", "job_id": job_id, "queue_position": self.queue_position(job_id)}
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield {"type": "keepalive", "job_id": job_id, "queue_position": self.queue_position(job_id)}
+                    continue
+                if event is done:
+                    break
+                yield event
+        finally:
+            cancel.set()
+
+    async def wait(self, job_id: str):
+        """Awaits a submitted job from async code and returns its result."""
+        return await asyncio.wrap_future(self.jobs[job_id]["future"])
+
+    def status(self, job_id: str):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return None
+            info = {k: v for k, v in job.items() if k != "future"}
+            info["queue_position"] = self._position(job_id)
+            return info
+
+    def queue_position(self, job_id: str):
+        with self._lock:
+            return self._position(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            info = {
+                "workers": self.workers,
+                "running": len(self._running),
+                "queued": len(self._queued),
+                "max_queue": self.max_queue,
+                "torch_threads": self.torch_threads,
+            }
+        info["decode_slots"] = model_manager.decode_slots()
+        return info
+
+    def _run(self, job_id, fn, *args):
+        with self._lock:
+            self._queued.pop(job_id, None)
+            self._running.add(job_id)
+            job = self.jobs[job_id]
+            job["status"] = "running"
+            job["started_at"] = time.time()
+        observe_stage("transcribe_queue_wait", job["started_at"] - job["submitted_at"])
+        try:
+            with stage("transcribe"):
+                result = fn(*args)
+            job["result"] = result
+            job["status"] = "completed"
+            return result
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = "failed"
+            raise
+        finally:
+            job["finished_at"] = time.time()
+            with self._lock:
+                self._running.discard(job_id)
+
+    def _position(self, job_id):
+        """1-based position among waiting jobs, 0 once running/finished. Caller holds _lock."""
+        for i, queued_id in enumerate(self._queued):
+            if queued_id == job_id:
+                return i + 1
+        return 0
+
+    def _prune(self):
+        """Forgets finished jobs older than job_ttl. Caller holds _lock."""
+        cutoff = time.time() - self.job_ttl
+        for job_id in [j for j, job in self.jobs.items()
+                       if job["finished_at"] and job["finished_at"] < cutoff]:
+            del self.jobs[job_id]
+
+WHISPER_WORKERS = int(os.environ.get("WHISPER_WORKERS", "1"))
+_default_torch_threads = max(1, (os.cpu_count() or 2) // max(WHISPER_REPLICAS, WHISPER_WORKERS))
+
+transcription_scheduler = TranscriptionScheduler(
+    workers=WHISPER_WORKERS,
+    max_queue=int(os.environ.get("WHISPER_MAX_QUEUE", "8")),
+    torch_threads=int(os.environ.get("WHISPER_TORCH_THREADS", str(_default_torch_threads))),
+)
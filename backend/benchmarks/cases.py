@@ -0,0 +1,234 @@
+import asyncio
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+# ── Benchmark cases ──────────────────────────────────────────────────────────
+# A case is a setup function that receives the run context and returns
+# (run, units): `run()` is timed once per iteration and does `units` of work
+# (pages, images, messages...), which gives throughput. Setup is not timed.
+# Backend modules are imported inside the setup functions, after the runner has
+# pointed their caches and stores at the scratch directory.
+
+@dataclass
+class Case:
+    name: str
+    setup: object
+    unit: str
+    iterations: int
+    requires: tuple
+
+@dataclass
+class Context:
+    fixtures: dict
+    workdir: Path
+    sizes: dict
+
+    def scratch(self, name: str) -> Path:
+        path = self.workdir / name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+CASES = {}
+
+def case(name: str, unit: str, iterations: int = 5, requires: tuple = ()):
+    """Registers a setup function; `requires` lists executables the case needs on PATH."""
+    def register(setup):
+        CASES[name] = Case(name, setup, unit, iterations, tuple(requires))
+        return setup
+    return register
+
+def _pdf_pages(path) -> int:
+    import fitz
+    with fitz.open(path) as doc:
+        return len(doc)
+
+# ── Document processing ──────────────────────────────────────────────────────
+
+def _process_case(ctx, fixture):
+    from processor import process_document
+    out_dir = ctx.scratch("process")
+    path = ctx.fixtures[fixture]
+
+    def run():
+        process_document(path, str(out_dir), uuid.uuid4().hex)
+    return run, _pdf_pages(path)
+
+@case("processor.native_pdf", unit="pages")
+def process_native_pdf(ctx):
+    return _process_case(ctx, "native_pdf")
+
+@case("processor.large_table", unit="pages", iterations=3)
+def process_large_table(ctx):
+    return _process_case(ctx, "large_table_pdf")
+
+@case("processor.scanned_pdf", unit="pages", iterations=3, requires=("tesseract", "pdftoppm"))
+def process_scanned_pdf(ctx):
+    return _process_case(ctx, "scanned_pdf")
+
+# ── PDF editor ───────────────────────────────────────────────────────────────
+
+@case("pdf_editor.merge", unit="pages")
+def pdf_merge(ctx):
+    from pdf_editor import pdf_editor
+    out = ctx.scratch("pdf_editor") / "merged.pdf"
+    paths = [ctx.fixtures["native_pdf"], ctx.fixtures["large_table_pdf"], ctx.fixtures["native_pdf"]]
+    return (lambda: pdf_editor.merge_pdfs(paths, str(out))), sum(_pdf_pages(p) for p in paths)
+
+@case("pdf_editor.split", unit="pages")
+def pdf_split(ctx):
+    from pdf_editor import pdf_editor
+    out_dir = ctx.scratch("pdf_editor_split")
+    path = ctx.fixtures["native_pdf"]
+    return (lambda: pdf_editor.split_pdf(path, str(out_dir), mode="all")), _pdf_pages(path)
+
+@case("pdf_editor.compress", unit="pages")
+def pdf_compress(ctx):
+    from pdf_editor import pdf_editor
+    out = ctx.scratch("pdf_editor") / "compressed.pdf"
+    path = ctx.fixtures["large_table_pdf"]
+    return (lambda: pdf_editor.compress_pdf(path, str(out))), _pdf_pages(path)
+
+@case("pdf_editor.watermark", unit="pages")
+def pdf_watermark(ctx):
+    from pdf_editor import pdf_editor
+    out = ctx.scratch("pdf_editor") / "watermarked.pdf"
+    path = ctx.fixtures["native_pdf"]
+    return (lambda: pdf_editor.add_watermark(path, str(out), "CONFIDENTIAL")), _pdf_pages(path)
+
+@case("pdf_editor.render", unit="pages", iterations=3)
+def pdf_render(ctx):
+    from pdf_editor import pdf_editor
+    out_dir = ctx.scratch("pdf_editor_render")
+    path = ctx.fixtures["native_pdf"]
+    return (lambda: pdf_editor.convert_to_images(path, str(out_dir))), _pdf_pages(path)
+
+# ── Image enhancement ────────────────────────────────────────────────────────
+
+def _enhance_case(ctx, **options):
+    from image_enhancer import enhance_image
+    with open(ctx.fixtures["photo"], "rb") as f:
+        image_bytes = f.read()
+    return (lambda: enhance_image(image_bytes, **options)), 1
+
+@case("image.enhance_auto", unit="images")
+def image_enhance_auto(ctx):
+    return _enhance_case(ctx, enhancement_type="auto", output_format="jpeg")
+
+@case("image.enhance_auto_png", unit="images")
+def image_enhance_auto_png(ctx):
+    return _enhance_case(ctx, enhancement_type="auto", output_format="png")
+
+@case("image.upscale_2x", unit="images", iterations=3)
+def image_upscale_2x(ctx):
+    return _enhance_case(ctx, enhancement_type="auto", upscale_factor=2, output_format="jpeg")
+
+@case("image.denoise", unit="images", iterations=3)
+def image_denoise(ctx):
+    return _enhance_case(ctx, enhancement_type="denoise", output_format="jpeg")
+
+# ── Signing ──────────────────────────────────────────────────────────────────
+
+_PLACEMENT = {"page_number": 1, "x": 100.0, "y": 100.0, "width": 200.0, "height": 80.0}
+
+@case("signature.rewrite", unit="documents")
+def signature_rewrite(ctx):
+    from signature_service import apply_signature_to_pdf, signer_store
+    with open(ctx.fixtures["native_pdf"], "rb") as f:
+        pdf_bytes = f.read()
+    with open(ctx.fixtures["signature"], "rb") as f:
+        signature_bytes = f.read()
+    signer_store.service_signer()  # identity creation is a one-off, not part of signing
+    return (lambda: apply_signature_to_pdf(pdf_bytes, signature_bytes, **_PLACEMENT)), 1
+
+@case("signature.incremental", unit="documents")
+def signature_incremental(ctx):
+    from signature_service import sign_pdf_file, load_signature_image, signer_store
+    with open(ctx.fixtures["signature"], "rb") as f:
+        signature_image = load_signature_image(f.read())
+    out = ctx.scratch("signature") / "signed.pdf"
+    signer_store.service_signer()
+    return (lambda: sign_pdf_file(ctx.fixtures["native_pdf"], str(out), signature_image, **_PLACEMENT)), 1
+
+# ── Notifications ────────────────────────────────────────────────────────────
+
+@case("notifications.render", unit="messages")
+def notifications_render(ctx):
+    from template_engine import MessageSkeleton
+    skeleton = MessageSkeleton(
+        "bench@example.com", "Hello {{name}}",
+        "Hi {{name}},\n\nYour {{plan|free}} plan renews soon. City: {{city}}.\n",
+        "<p>Hi <b>{{name}}</b>, your {{plan|free}} plan renews soon.</p>",
+    )
+    recipients = [
+        {"name": f"User {i}", "email": f"user{i}@example.com", "city": "Pune", "plan": "pro"}
+        for i in range(ctx.sizes["recipients"])
+    ]
+
+    def run():
+        for r in recipients:
+            skeleton.render(r["email"], r)
+    return run, len(recipients)
+
+@case("notifications.ingest_csv", unit="rows", iterations=3)
+def notifications_ingest(ctx):
+    from notification_service import notification_service
+    from job_store import job_store
+    path = ctx.fixtures["recipients_csv"]
+
+    def run():
+        recipient_set = notification_service._ingest_recipients_sync(path, Path(path).name)
+        job_store.delete_recipient_set(recipient_set["id"])
+    return run, ctx.sizes["recipients"]
+
+@case("notifications.bulk_email", unit="messages", iterations=3)
+def notifications_bulk_email(ctx):
+    from benchmarks.smtp_stub import SMTPStub
+    from notification_service import notification_service
+    from job_store import job_store
+
+    smtp = SMTPStub().start()
+    count = min(ctx.sizes["recipients"], 2000)
+    recipients = [{"name": f"User {i}", "email": f"user{i}@example.com"} for i in range(count)]
+    credentials = {"smtp_host": "127.0.0.1", "smtp_port": smtp.port, "smtp_use_tls": False,
+                   "smtp_user": "bench@example.com", "smtp_pass": "bench"}
+
+    async def send_all():
+        job_id = await notification_service.start_job(
+            recipients, "email", "Hi {{name}}, this is message for {{email}}.", "Benchmark",
+            credentials, concurrency=8, rate_per_second=1_000_000,
+        )
+        # Poll the persisted status, as a client of /bulk/status would
+        while True:
+            job = await asyncio.to_thread(job_store.get_job, job_id, logs_limit=1)
+            if job["status"] == "completed":
+                break
+            await asyncio.sleep(0.01)
+        if job["failed"]:
+            raise RuntimeError(f"{job['failed']} of {job['total']} messages failed")
+
+    return (lambda: asyncio.run(send_all())), count
+
+# ── Text to speech (offline backend) ─────────────────────────────────────────
+
+_TTS_TEXT = (
+    "Your document has been processed. The extracted tables are ready to download "
+    "as a spreadsheet, and the text is available as a Word document. "
+) * 20
+
+@case("tts.synthesize_cold", unit="requests", requires=("ffmpeg",))
+def tts_cold(ctx):
+    from tts_service import generate_speech
+    counter = iter(range(1_000_000))
+    # A unique suffix per run defeats the speech cache
+    return (lambda: asyncio.run(generate_speech(f"{_TTS_TEXT} Run {next(counter)}."))), 1
+
+@case("tts.synthesize_cached", unit="requests", requires=("ffmpeg",))
+def tts_cached(ctx):
+    from tts_service import stream_speech
+
+    async def read_all():
+        async for _ in stream_speech(_TTS_TEXT):
+            pass
+    asyncio.run(read_all())  # populate the cache
+    return (lambda: asyncio.run(read_all())), 1
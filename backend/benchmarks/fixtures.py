@@ -0,0 +1,158 @@
+import csv
+import random
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+# ── Synthetic fixtures ───────────────────────────────────────────────────────
+# Every generator is seeded, so the same scale always produces byte-for-byte
+# comparable inputs and results can be compared against a stored baseline.
+# Files are cached under the fixture directory and only built once.
+
+_WORDS = (
+    "invoice total amount payment account balance customer order date number "
+    "service period tax rate net gross shipping address contract terms notice "
+    "report quarter revenue expense summary district office reference signed"
+).split()
+
+SCALES = {
+    # name: fixture sizes
+    "quick": {"pages": 5, "table_rows": 200, "scanned_pages": 1, "photo_mp": 2, "recipients": 500},
+    "default": {"pages": 30, "table_rows": 2000, "scanned_pages": 3, "photo_mp": 12, "recipients": 5000},
+    "large": {"pages": 200, "table_rows": 20000, "scanned_pages": 10, "photo_mp": 24, "recipients": 50000},
+}
+
+def _sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+def _draw_grid_table(c, rng, top: float, rows: int, cols: int, row_height: float = 16, left: float = 50, width: float = 495):
+    """Draws a ruled table (pdfplumber detects tables from the ruling lines). Returns the y below it."""
+    col_width = width / cols
+    bottom = top - rows * row_height
+    for r in range(rows + 1):
+        c.line(left, top - r * row_height, left + width, top - r * row_height)
+    for k in range(cols + 1):
+        c.line(left + k * col_width, top, left + k * col_width, bottom)
+    c.setFont("Helvetica", 8)
+    for r in range(rows):
+        for k in range(cols):
+            text = f"{rng.choice(_WORDS)} {rng.randint(1, 9999)}" if k else f"Row {r + 1}"
+            c.drawString(left + k * col_width + 3, top - (r + 1) * row_height + 5, text)
+    return bottom
+
+def native_pdf(path: Path, pages: int, seed: int = 1) -> Path:
+    """Text PDF with a few paragraphs and one small ruled table per page."""
+    rng = random.Random(seed)
+    c = canvas.Canvas(str(path), pagesize=A4)
+    _, height = A4
+    for page in range(pages):
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(50, height - 60, f"Quarterly report, page {page + 1}")
+        c.setFont("Helvetica", 10)
+        y = height - 90
+        for _ in range(12):
+            c.drawString(50, y, _sentence(rng)[:95])
+            y -= 14
+        _draw_grid_table(c, rng, y - 20, rows=8, cols=5)
+        c.showPage()
+    c.save()
+    return path
+
+def large_table_pdf(path: Path, rows: int, seed: int = 2) -> Path:
+    """One long ruled table split across as many pages as it needs."""
+    rng = random.Random(seed)
+    c = canvas.Canvas(str(path), pagesize=A4)
+    _, height = A4
+    rows_per_page = 45
+    for start in range(0, rows, rows_per_page):
+        _draw_grid_table(c, rng, height - 50, rows=min(rows_per_page, rows - start), cols=8)
+        c.showPage()
+    c.save()
+    return path
+
+def scanned_pdf(path: Path, pages: int, seed: int = 3) -> Path:
+    """Image-only PDF (no text layer), so processing takes the OCR path."""
+    rng = random.Random(seed)
+    try:
+        font = ImageFont.load_default(size=22)
+    except TypeError:  # Pillow < 10.1 has only the small bitmap font
+        font = ImageFont.load_default()
+    images = []
+    for _ in range(pages):
+        img = Image.new("L", (1240, 1754), 255)  # A4 at 150 dpi
+        draw = ImageDraw.Draw(img)
+        y = 80
+        while y < 1650:
+            draw.text((80, y), _sentence(rng, 10), fill=0, font=font)
+            y += 28
+        images.append(img)
+    images[0].save(path, "PDF", resolution=150, save_all=True, append_images=images[1:])
+    return path
+
+def photo_jpeg(path: Path, megapixels: float, seed: int = 4) -> Path:
+    """Photo-like JPEG: smooth gradients, shapes and sensor-style noise."""
+    rng = np.random.default_rng(seed)
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        128 + 100 * np.sin(xx / width * 3.1 + 0.5),
+        128 + 100 * np.cos(yy / height * 2.3),
+        128 + 80 * np.sin((xx + yy) / (width + height) * 5.0),
+    ], axis=-1)
+    base += rng.standard_normal(base.shape, dtype=np.float32) * 12
+    img = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8), "RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(width // 80, width // 10))
+        draw.ellipse((x0, y0, x0 + r, y0 + r), fill=tuple(int(v) for v in rng.integers(0, 255, 3)))
+    img.save(path, "JPEG", quality=90)
+    return path
+
+def signature_png(path: Path, seed: int = 5) -> Path:
+    rng = random.Random(seed)
+    img = Image.new("RGBA", (600, 200), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    points = [(30 + i * 18, 100 + rng.randint(-60, 60)) for i in range(30)]
+    draw.line(points, fill=(20, 20, 120, 255), width=5, joint="curve")
+    img.save(path, "PNG")
+    return path
+
+def recipients_csv(path: Path, rows: int, seed: int = 6) -> Path:
+    """Recipient list with extra columns, ~2% invalid rows and ~2% duplicates."""
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Name", "Email", "Phone", "City", "Plan"])
+        for i in range(rows):
+            n = rng.randint(0, rows - 1) if rng.random() < 0.02 else i
+            email = f"user{n}@example.com" if rng.random() > 0.02 else "not-an-email"
+            writer.writerow([f"User {n}", email, f"98{n:08d}", rng.choice(_WORDS).title(), rng.choice(["free", "pro"])])
+    return path
+
+def build_fixtures(fixture_dir: Path, scale: str) -> dict:
+    """Builds (or reuses) every fixture for `scale`. Returns name -> path."""
+    sizes = SCALES[scale]
+    root = fixture_dir / scale
+    root.mkdir(parents=True, exist_ok=True)
+    plan = {
+        "native_pdf": (f"native_{sizes['pages']}p.pdf", lambda p: native_pdf(p, sizes["pages"])),
+        "large_table_pdf": (f"table_{sizes['table_rows']}r.pdf", lambda p: large_table_pdf(p, sizes["table_rows"])),
+        "scanned_pdf": (f"scanned_{sizes['scanned_pages']}p.pdf", lambda p: scanned_pdf(p, sizes["scanned_pages"])),
+        "photo": (f"photo_{sizes['photo_mp']}mp.jpg", lambda p: photo_jpeg(p, sizes["photo_mp"])),
+        "signature": ("signature.png", signature_png),
+        "recipients_csv": (f"recipients_{sizes['recipients']}.csv", lambda p: recipients_csv(p, sizes["recipients"])),
+    }
+    paths = {}
+    for name, (filename, build) in plan.items():
+        path = root / filename
+        if not path.exists():
+            tmp_path = path.with_name(f".{filename}.tmp")
+            build(tmp_path)
+            tmp_path.replace(path)
+        paths[name] = str(path)
+    return paths
@@ -0,0 +1,373 @@
+import os
+import sys
+import io
+import json
+import math
+import time
+import wave
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from benchmarks.fixtures import build_fixtures
+from benchmarks.runner import BACKEND_DIR, DEFAULT_FIXTURE_DIR, percentile, _scratch_env
+from benchmarks.smtp_stub import SMTPStub
+
+# ── Load test ────────────────────────────────────────────────────────────────
+# Drives main.app in-process through its ASGI interface (no sockets, no extra
+# client library) with N virtual users replaying a weighted mix of scenarios,
+# and reports per-endpoint throughput, tail latency and event-loop lag.
+#
+#   python -m benchmarks.load --mix documents --concurrency 1,4,16 --duration 30
+#
+# The load generator shares the app's event loop, exactly like requests
+# sharing a uvicorn worker: a handler that blocks the loop stalls every other
+# in-flight request, and shows up here as lag attributed to that endpoint.
+# "loop lag" per endpoint is the worst lag seen while it had a request in flight.
+
+MIXES = {
+    # scenario: weight
+    "polling": {"health": 6, "metrics": 1, "bulk_status": 3},
+    "documents": {"upload_process": 3, "pdf_edit": 3, "download": 1, "health": 3},
+    "mixed": {"upload_process": 2, "pdf_edit": 2, "image": 2, "download": 1, "bulk_status": 2, "health": 4},
+    "audio": {"audio": 1, "health": 4},
+}
+
+LAG_INTERVAL = 0.01
+STALL_SECONDS = 0.1
+
+# ── Minimal in-process ASGI client ───────────────────────────────────────────
+
+class Response:
+    def __init__(self, status: int, headers: dict, body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+def multipart(fields: dict = None, files: list = None):
+    """Encodes form fields and (field, filename, bytes, content type) files. Returns (body, content type)."""
+    boundary = f"loadtest{random.getrandbits(64):016x}"
+    out = io.BytesIO()
+    for name, value in (fields or {}).items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data, content_type in files or []:
+        out.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode()
+        )
+        out.write(data)
+        out.write(b"\r\n")
+    out.write(f"--{boundary}--\r\n".encode())
+    return out.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+class ASGIClient:
+    def __init__(self, app, recorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def request(self, label: str, method: str, path: str, body: bytes = b"",
+                      content_type: str = None, query: str = "") -> Response:
+        headers = [(b"host", b"loadtest")]
+        if content_type:
+            headers.append((b"content-type", content_type.encode()))
+        headers.append((b"content-length", str(len(body)).encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": query.encode(), "root_path": "", "headers": headers,
+            "client": ("127.0.0.1", 50000), "server": ("loadtest", 80),
+        }
+        done = asyncio.Event()
+        body_sent = False
+        status = 0
+        response_headers = {}
+        chunks = []
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Streaming responses listen for a disconnect; only report one when finished
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers.update((k.decode().lower(), v.decode()) for k, v in message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    done.set()
+
+        self.recorder.started(label)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            status = status or 599  # the app raised before (or after) responding
+        finally:
+            done.set()
+            self.recorder.finished(label, time.perf_counter() - started, status)
+        return Response(status, response_headers, b"".join(chunks))
+
+# ── Recording ────────────────────────────────────────────────────────────────
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.in_flight = Counter()
+        self.endpoint_lag = defaultdict(float)
+        self.loop_lag = []
+        self._active = set()  # endpoints in flight at any point since the last lag tick
+
+    def started(self, label):
+        self.in_flight[label] += 1
+        self._active.add(label)
+
+    def finished(self, label, seconds, status):
+        self.in_flight[label] -= 1
+        self.latencies[label].append(seconds)
+        if status >= 400:
+            self.errors[label] += 1
+
+    async def monitor_loop(self, stop: asyncio.Event):
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = max(0.0, loop.time() - started - LAG_INTERVAL)
+            self.loop_lag.append(lag)
+            # A handler that blocked the loop has usually finished by the time we
+            # wake up, so blame everything that was active during the tick
+            for label in self._active:
+                if lag > self.endpoint_lag[label]:
+                    self.endpoint_lag[label] = lag
+            self._active = {label for label, count in self.in_flight.items() if count > 0}
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for label, values in sorted(self.latencies.items()):
+            endpoints[label] = {
+                "requests": len(values),
+                "errors": self.errors[label],
+                "rps": round(len(values) / elapsed, 2),
+                "p50_s": round(percentile(values, 50), 4),
+                "p95_s": round(percentile(values, 95), 4),
+                "p99_s": round(percentile(values, 99), 4),
+                "max_s": round(max(values), 4),
+                "max_loop_lag_ms": round(self.endpoint_lag[label] * 1000, 1),
+            }
+        lag = self.loop_lag or [0.0]
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "total_rps": round(sum(len(v) for v in self.latencies.values()) / elapsed, 2),
+            "endpoints": endpoints,
+            "loop_lag_ms": {
+                "p50": round(percentile(lag, 50) * 1000, 1),
+                "p99": round(percentile(lag, 99) * 1000, 1),
+                "max": round(max(lag) * 1000, 1),
+                "stalls_over_100ms": sum(1 for v in lag if v > STALL_SECONDS),
+            },
+        }
+
+# ── Scenarios ────────────────────────────────────────────────────────────────
+# Each scenario is one user action and may issue several requests.
+
+_TONE_FRAMES = []
+
+def _tone_wav(rng: random.Random, seconds: float = 5.0, rate: int = 16000) -> bytes:
+    """
+    A short tone. The first samples are randomised so repeated uploads miss the
+    transcript cache; the tone itself is built once, to keep the generator cheap.
+    """
+    if not _TONE_FRAMES:
+        tone = bytearray()
+        for i in range(int(seconds * rate)):
+            tone += int(8000 * math.sin(2 * math.pi * 440 * i / rate)).to_bytes(2, "little", signed=True)
+        _TONE_FRAMES.append(bytes(tone))
+    frames = bytearray(_TONE_FRAMES[0])
+    frames[:16] = rng.getrandbits(128).to_bytes(16, "little")
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return out.getvalue()
+
+class Scenarios:
+    def __init__(self, client: ASGIClient, fixtures: dict, state: dict):
+        self.client = client
+        self.state = state
+        with open(fixtures["native_pdf"], "rb") as f:
+            self.pdf_bytes = f.read()
+        with open(fixtures["photo"], "rb") as f:
+            self.photo_bytes = f.read()
+
+    async def health(self, rng):
+        await self.client.request("GET /health", "GET", "/health")
+
+    async def metrics(self, rng):
+        await self.client.request("GET /metrics", "GET", "/metrics")
+
+    async def upload_process(self, rng):
+        body, ctype = multipart(files=[("file", "report.pdf", self.pdf_bytes, "application/pdf")])
+        uploaded = await self.client.request("POST /upload", "POST", "/upload", body, ctype)
+        if uploaded.status != 200:
+            return
+        file_id = uploaded.json()["file_id"]
+        processed = await self.client.request("POST /process/{file_id}", "POST", f"/process/{file_id}")
+        if processed.status == 200:
+            await self.client.request("GET /download/{file_id}/{format}", "GET", f"/download/{file_id}/xlsx")
+
+    async def pdf_edit(self, rng):
+        operation = rng.choice(["merge", "compress", "watermark", "rotate"])
+        copies = 2 if operation == "merge" else 1
+        body, ctype = multipart(
+            fields={"operation": operation, "options": json.dumps({"text": "DRAFT", "rotation": 90})},
+            files=[("files", f"doc{i}.pdf", self.pdf_bytes, "application/pdf") for i in range(copies)],
+        )
+        await self.client.request(f"POST /pdf/edit ({operation})", "POST", "/pdf/edit", body, ctype)
+
+    async def image(self, rng):
+        body, ctype = multipart(
+            fields={"enhancement_type": "auto", "output_format": "jpeg"},
+            files=[("image_file", "photo.jpg", self.photo_bytes, "image/jpeg")],
+        )
+        await self.client.request("POST /image-enhancer", "POST", "/image-enhancer", body, ctype)
+
+    async def download(self, rng):
+        await self.client.request("GET /outputs (large file)", "GET", f"/outputs/{self.state['large_file']}")
+
+    async def bulk_status(self, rng):
+        await self.client.request(
+            "GET /bulk/status/{job_id}", "GET", f"/bulk/status/{self.state['bulk_job_id']}", query="logs_limit=10"
+        )
+
+    async def audio(self, rng):
+        body, ctype = multipart(
+            fields={"model_size": "tiny", "language": "en"},
+            files=[("audio_file", "clip.wav", _tone_wav(rng), "audio/wav")],
+        )
+        await self.client.request("POST /audio-to-text", "POST", "/audio-to-text", body, ctype)
+
+async def _prepare(client: ASGIClient, mix: dict, state: dict, smtp: SMTPStub, download_mb: int):
+    if "download" in mix:
+        name = f"loadtest_{download_mb}mb.bin"
+        path = Path("outputs") / name
+        if not path.exists():
+            with open(path, "wb") as f:
+                for _ in range(download_mb):
+                    f.write(os.urandom(1024 * 1024))
+        state["large_file"] = name
+    if "bulk_status" in mix:
+        # A long-running campaign to poll (and to keep the sender busy in the background)
+        payload = {
+            "recipients": [{"name": f"User {i}", "email": f"user{i}@example.com"} for i in range(5000)],
+            "channel": "email", "template": "Hi {{name}}", "subject": "Load test",
+            "smtp_host": "127.0.0.1", "smtp_port": smtp.port, "smtp_use_tls": False,
+            "smtp_user": "load@example.com", "smtp_pass": "load",
+            "concurrency": 4, "rate_per_second": 50,
+        }
+        response = await client.request("setup", "POST", "/bulk/send", json.dumps(payload).encode(), "application/json")
+        if response.status != 200:
+            raise RuntimeError(f"Could not start bulk job: {response.status} {response.body[:200]!r}")
+        state["bulk_job_id"] = response.json()["job_id"]
+
+async def run_level(app, fixtures: dict, mix_name: str, state: dict, concurrency: int, duration: float,
+                    think_ms: float, seed: int) -> dict:
+    mix = MIXES[mix_name]
+    recorder = Recorder()
+    client = ASGIClient(app, recorder)
+    scenarios = Scenarios(client, fixtures, state)
+    names, weights = zip(*mix.items())
+
+    stop = asyncio.Event()
+    deadline = time.perf_counter() + duration
+
+    async def virtual_user(index: int):
+        rng = random.Random(seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            scenario = rng.choices(names, weights)[0]
+            await getattr(scenarios, scenario)(rng)
+            if think_ms:
+                await asyncio.sleep(rng.expovariate(1000 / think_ms))
+
+    monitor = asyncio.create_task(recorder.monitor_loop(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+    return dict(recorder.summary(elapsed), mix=mix_name, concurrency=concurrency)
+
+def _print_level(result: dict):
+    print(f"\n== mix {result['mix']}, concurrency {result['concurrency']}, {result['elapsed_s']}s, "
+          f"{result['total_rps']} req/s ==")
+    header = f"{'endpoint':<36} {'reqs':>6} {'err':>5} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'lag ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for label, e in result["endpoints"].items():
+        print(f"{label:<36} {e['requests']:>6} {e['errors']:>5} {e['rps']:>8} {e['p50_s']:>8.3f} "
+              f"{e['p95_s']:>8.3f} {e['p99_s']:>8.3f} {e['max_loop_lag_ms']:>8}")
+    lag = result["loop_lag_ms"]
+    print(f"event loop lag: p50 {lag['p50']} ms, p99 {lag['p99']} ms, max {lag['max']} ms, "
+          f"{lag['stalls_over_100ms']} stalls over {int(STALL_SECONDS * 1000)} ms")
+
+async def _main_async(args, fixtures):
+    from main import app
+
+    smtp = SMTPStub().start()
+    await app.router.startup()
+    results = []
+    try:
+        state = {}
+        await _prepare(ASGIClient(app, Recorder()), MIXES[args.mix], state, smtp, args.download_mb)
+        for level in args.concurrency:
+            result = await run_level(app, fixtures, args.mix, state, level, args.duration, args.think_ms, args.seed)
+            _print_level(result)
+            results.append(result)
+    finally:
+        await app.router.shutdown()
+        smtp.stop()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description="In-process load test for main.app")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--concurrency", default="1,4,16",
+                        type=lambda s: [int(v) for v in s.split(",")], help="Virtual users; comma-separated to sweep")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per concurrency level")
+    parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between a user's actions")
+    parser.add_argument("--download-mb", type=int, default=50, help="Size of the file the download scenario fetches")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.output:
+        args.output = args.output.resolve()
+    fixtures = build_fixtures(DEFAULT_FIXTURE_DIR, "quick")
+    # The app writes uploads/, outputs/ and its stores relative to the working directory
+    workdir = Path(tempfile.mkdtemp(prefix="loadtest_"))
+    os.environ.update(_scratch_env(workdir))
+    os.chdir(workdir)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    results = asyncio.run(_main_async(args, fixtures))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"\n[LOAD] Scratch files left in {workdir}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.cases import CASES, Context
+from benchmarks.fixtures import SCALES, build_fixtures
+
+# ── Benchmark runner ─────────────────────────────────────────────────────────
+# Usage, from backend/:
+#   python -m benchmarks                        run everything at the default scale
+#   python -m benchmarks --scale quick -k image run cases whose name contains "image"
+#   python -m benchmarks --save-baseline        store this run as the baseline
+#   python -m benchmarks --check                exit 1 if slower than the baseline,
+#                                               2 if there is no baseline to compare with
+#
+# Each case runs in a fresh child process, so its peak RSS is its own and one
+# case's caches or imports can't warm up the next. Everything runs offline:
+# TTS uses the local tone backend, email goes to an in-process SMTP stand-in,
+# and every store and cache lives in a scratch directory.
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent
+DEFAULT_FIXTURE_DIR = Path(tempfile.gettempdir()) / "backend-bench-fixtures"
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+
+def percentile(values, pct: float) -> float:
+    """Linear-interpolated percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _scratch_env(workdir: Path) -> dict:
+    """Points every cache, store and backend switch at the scratch directory."""
+    return {
+        "TTS_BACKEND": "local",
+        "TTS_CACHE_DIR": str(workdir / "tts_cache"),
+        "TRANSCRIPT_CACHE_DIR": str(workdir / "transcripts"),
+        "JOBS_DB_PATH": str(workdir / "jobs.sqlite3"),
+        "SIGNING_IDENTITY_DIR": str(workdir / "signing_identity"),
+        "PROFILE_DIR": str(workdir / "profiles"),
+        "WHISPER_PRELOAD": "",
+    }
+
+# ── Child: run one case ──────────────────────────────────────────────────────
+
+def run_case(name: str, fixtures: dict, scale: str, workdir: Path, iterations: int = None, warmup: int = 1) -> dict:
+    bench_case = CASES[name]
+    ctx = Context(fixtures=fixtures, workdir=workdir, sizes=SCALES[scale])
+    run, units = bench_case.setup(ctx)
+    rss_after_setup = _peak_rss_mb()
+
+    for _ in range(warmup):
+        run()
+    latencies = []
+    for _ in range(iterations or bench_case.iterations):
+        started = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - started)
+
+    total = sum(latencies)
+    return {
+        "case": name,
+        "status": "ok",
+        "unit": bench_case.unit,
+        "units_per_iteration": units,
+        "iterations": len(latencies),
+        "latency_s": {
+            "min": round(min(latencies), 4),
+            "p50": round(percentile(latencies, 50), 4),
+            "p95": round(percentile(latencies, 95), 4),
+            "p99": round(percentile(latencies, 99), 4),
+            "max": round(max(latencies), 4),
+            "mean": round(total / len(latencies), 4),
+        },
+        "throughput_per_s": round(units * len(latencies) / total, 2) if total else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "setup_rss_mb": rss_after_setup,
+    }
+
+def _child_main(args):
+    request = json.loads(Path(args.child).read_text(encoding="utf-8"))
+    workdir = Path(request["workdir"])
+    try:
+        result = run_case(request["case"], request["fixtures"], request["scale"], workdir,
+                          request["iterations"], request["warmup"])
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        result = {"case": request["case"], "status": "error", "error": f"{type(e).__name__}: {e}"}
+    Path(request["result_path"]).write_text(json.dumps(result), encoding="utf-8")
+
+# ── Parent: orchestrate, report, compare ─────────────────────────────────────
+
+def _spawn_case(name, fixtures, scale, iterations, warmup, timeout, verbose) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench_{name}_"))
+    request_path = workdir / "request.json"
+    result_path = workdir / "result.json"
+    request_path.write_text(json.dumps({
+        "case": name, "fixtures": fixtures, "scale": scale, "workdir": str(workdir),
+        "iterations": iterations, "warmup": warmup, "result_path": str(result_path),
+    }), encoding="utf-8")
+    env = dict(os.environ, **_scratch_env(workdir))
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks", "--child", str(request_path)],
+            cwd=BACKEND_DIR, env=env, timeout=timeout,
+            stdout=None if verbose else subprocess.PIPE, stderr=None if verbose else subprocess.PIPE,
+        )
+        if result_path.exists():
+            return json.loads(result_path.read_text(encoding="utf-8"))
+        detail = (proc.stderr or b"").decode("utf-8", "replace").strip().splitlines()[-1:] or [f"exit code {proc.returncode}"]
+        return {"case": name, "status": "error", "error": detail[0]}
+    except subprocess.TimeoutExpired:
+        return {"case": name, "status": "error", "error": f"timed out after {timeout}s"}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+    }
+
+def compare(results: list, baseline: dict, latency_tolerance: float, rss_tolerance: float) -> list:
+    """Annotates results with their change against the baseline. Returns regressed case names."""
+    previous = {r["case"]: r for r in baseline.get("results", []) if r.get("status") == "ok"}
+    regressions = []
+    for result in results:
+        before = previous.get(result["case"])
+        if result.get("status") != "ok" or not before:
+            continue
+        change = {"p50": result["latency_s"]["p50"] / max(before["latency_s"]["p50"], 1e-9) - 1}
+        if result.get("peak_rss_mb") and before.get("peak_rss_mb"):
+            change["peak_rss"] = result["peak_rss_mb"] / before["peak_rss_mb"] - 1
+        result["vs_baseline"] = {k: round(v, 3) for k, v in change.items()}
+        if change["p50"] > latency_tolerance or change.get("peak_rss", 0) > rss_tolerance:
+            regressions.append(result["case"])
+    return regressions
+
+def _print_table(results: list):
+    header = f"{'case':<30} {'p50 s':>9} {'p95 s':>9} {'p99 s':>9} {'throughput':>18} {'peak MB':>9} {'vs base':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if r["status"] != "ok":
+            print(f"{r['case']:<30} {r['status'].upper()}: {r.get('error', '')}")
+            continue
+        latency = r["latency_s"]
+        throughput = f"{r['throughput_per_s']} {r['unit']}/s"
+        versus = r.get("vs_baseline", {}).get("p50")
+        versus = f"{versus:+.1%}" if versus is not None else ""
+        print(f"{r['case']:<30} {latency['p50']:>9.4f} {latency['p95']:>9.4f} {latency['p99']:>9.4f} "
+              f"{throughput:>18} {r['peak_rss_mb'] or '-':>9} {versus:>9}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Backend hot-path benchmarks")
+    parser.add_argument("-k", "--filter", action="append", default=[], help="Run cases whose name contains this (repeatable)")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="default")
+    parser.add_argument("--iterations", type=int, help="Override each case's iteration count")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--timeout", type=int, default=1800, help="Seconds before a case is abandoned")
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run to --baseline")
+    parser.add_argument("--check", action="store_true", help="Exit 1 on a regression against --baseline")
+    parser.add_argument("--latency-tolerance", type=float, default=0.15, help="Allowed p50 slowdown (0.15 = 15%%)")
+    parser.add_argument("--rss-tolerance", type=float, default=0.20, help="Allowed peak RSS growth")
+    parser.add_argument("--output", type=Path, help="Also write the full results as JSON")
+    parser.add_argument("--list", action="store_true", help="List cases and exit")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show case output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return _child_main(args)
+    if args.list:
+        for name, bench_case in CASES.items():
+            needs = f"  (needs {', '.join(bench_case.requires)})" if bench_case.requires else ""
+            print(f"{name:<30} {bench_case.unit}{needs}")
+        return 0
+
+    names = [n for n in CASES if not args.filter or any(f in n for f in args.filter)]
+    print(f"[BENCH] Building {args.scale} fixtures in {args.fixtures}...")
+    fixtures = build_fixtures(args.fixtures, args.scale)
+
+    results = []
+    for name in names:
+        missing = [tool for tool in CASES[name].requires if not shutil.which(tool)]
+        if missing:
+            results.append({"case": name, "status": "skipped", "error": f"missing {', '.join(missing)}"})
+            continue
+        print(f"[BENCH] {name}...", flush=True)
+        results.append(_spawn_case(name, fixtures, args.scale, args.iterations, args.warmup,
+                                   args.timeout, args.verbose))
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "scale": args.scale,
+        "environment": _environment(),
+        "results": results,
+    }
+    regressions = []
+    compared = False
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("scale") != args.scale:
+            print(f"[BENCH] Baseline is for scale '{baseline.get('scale')}'; not comparing.")
+        else:
+            regressions = compare(results, baseline, args.latency_tolerance, args.rss_tolerance)
+            compared = True
+
+    print()
+    _print_table(results)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\n[BENCH] Baseline saved to {args.baseline}")
+    if regressions:
+        print(f"\n[BENCH] Regressions against baseline: {', '.join(regressions)}")
+        if args.check:
+            return 1
+    if args.check and not compared:
+        # A check that compared nothing must not look like a pass
+        print(f"\n[BENCH] --check: no usable baseline at {args.baseline} for scale '{args.scale}'; "
+              "run with --save-baseline first.")
+        return 2
+    return 0
@@ -0,0 +1,106 @@
+import socket
+import socketserver
+import threading
+
+# ── Local SMTP stand-in ──────────────────────────────────────────────────────
+# Just enough SMTP (EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT) for
+# smtplib to deliver to, so the notification sender can be benchmarked offline.
+# Messages and connections are counted, and messages discarded. No TLS: use
+# smtp_use_tls=False. Any username and password are accepted (the sender only
+# uses SMTP when smtp_user is set). drop_connections() hangs up on every client,
+# as a server timing out idle connections would.
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def setup(self):
+        super().setup()
+        self.server.opened(self.request)
+
+    def finish(self):
+        self.server.closed(self.request)
+        super().finish()
+
+    def handle(self):
+        self._reply("220 localhost benchmark SMTP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].decode("ascii", "replace").upper()
+            if command == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-8BITMIME\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 104857600\r\n")
+            elif command == "AUTH":
+                self._reply("235 Authentication successful")
+            elif command in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                self.server.record(size)
+                self._reply("250 OK queued")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _SMTPHandler)
+        self.messages = 0
+        self.bytes_received = 0
+        self.connections = 0
+        self._open = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def record(self, size: int):
+        with self._lock:
+            self.messages += 1
+            self.bytes_received += size
+
+    def opened(self, sock):
+        with self._lock:
+            self.connections += 1
+            self._open.add(sock)
+
+    def closed(self, sock):
+        with self._lock:
+            self._open.discard(sock)
+
+    @property
+    def open_connections(self) -> int:
+        with self._lock:
+            return len(self._open)
+
+    def drop_connections(self):
+        with self._lock:
+            sockets = list(self._open)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -1,15 +1,64 @@
 import cv2
 import numpy as np
 import io
+import os
+import math
+import json
+import asyncio
+from functools import partial, lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from PIL import Image
 
+from metrics import stage, pool_tasks_in_flight
+from loop_guard import blocking
+
+# ── Worker pool ──────────────────────────────────────────────────────────────
+# Decoding, filtering and encoding are CPU-bound and hold the GIL in places, so
+# requests run enhance_image in a process pool instead of on the event loop.
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(os.cpu_count() or 2)))
+
+_executor = None
+_active = 0  # enhance_image_async calls in flight (touched only on the event loop)
+
+class OutputTooLargeError(ValueError):
+    """The requested output exceeds MAX_OUTPUT_MEGAPIXELS (HTTP 413)."""
+
+def _init_worker():
+    # One process per core already; stop OpenCV from oversubscribing with its own threads
+    cv2.setNumThreads(1)
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, initializer=_init_worker)
+    return _executor
+
+async def enhance_image_async(image_bytes: bytes, **options) -> bytes:
+    """Runs enhance_image in the worker pool without blocking the event loop."""
+    global _active
+    loop = asyncio.get_running_loop()
+    _active += 1
+    try:
+        options.setdefault("tile_workers", tile_workers_for(_active))
+        with pool_tasks_in_flight.track(pool="image"), stage("enhance_image"):
+            return await loop.run_in_executor(get_executor(), partial(enhance_image, image_bytes, **options))
+    finally:
+        _active -= 1
+
+@blocking
 def enhance_image(
     image_bytes: bytes,
     enhancement_type: str = "auto",
-    upscale_factor: int = 1
+    upscale_factor: int = 1,
+    output_format: str = "png",
+    quality: int = None,
+    png_compression: int = None,
+    pipeline: list = None,
+    tile_workers: int = None
 ) -> bytes:
     """
-    Enhances an image based on the selected mode.
+    Enhances an image based on the selected mode, or a custom operator pipeline.
 
     Modes:
     - auto: Applies balanced contrast enhancement and mild sharpening.
@@ -22,9 +71,17 @@ def enhance_image(
         image_bytes (bytes): Input image data.
         enhancement_type (str): Type of enhancement to apply.
         upscale_factor (int): 1, 2, or 4.
+        output_format (str): 'png', 'jpeg' or 'webp' (see resolve_output_format).
+        quality (int): JPEG/WebP quality, 1-100.
+        png_compression (int): PNG zlib level, 0 (fastest) - 9 (smallest).
+        pipeline (list): Optional operator spec, e.g.
+            [{"op": "clahe", "clip_limit": 3.0}, {"op": "sharpen", "strength": 1.2}].
+            Replaces the `enhancement_type` preset; `upscale_factor` still applies.
+        tile_workers (int): Threads for tiled mode; defaults to an idle server's
+            share (see tile_workers_for).
 
     Returns:
-        bytes: Enhanced image encoded as PNG.
+        bytes: Enhanced image encoded in `output_format`.
     """
     # 1. Decode Image to OpenCV format
     nparr = np.frombuffer(image_bytes, np.uint8)
@@ -33,54 +90,345 @@ def enhance_image(
     if img is None:
         raise ValueError("Could not decode image bytes")
 
-    # 2. Upscaling (if requested)
-    if upscale_factor > 1:
-        h, w = img.shape[:2]
-        new_dim = (w * upscale_factor, h * upscale_factor)
-        # Lanczos4 is generally best for high-quality upscaling
-        img = cv2.resize(img, new_dim, interpolation=cv2.INTER_LANCZOS4)
+    compiled = compile_pipeline(json.dumps(build_spec(enhancement_type, upscale_factor, pipeline), sort_keys=True))
 
-    # 3. Apply Enhancements based on type
-    if enhancement_type == "contrast" or enhancement_type == "auto":
-        img = apply_clahe(img)
+    h, w = img.shape[:2]
+    scale = compiled.scale
+    output_mp = (w * scale) * (h * scale) / 1_000_000
+    if output_mp > MAX_OUTPUT_MEGAPIXELS:
+        raise OutputTooLargeError(
+            f"Output would be {output_mp:.0f} MP, above the {MAX_OUTPUT_MEGAPIXELS:.0f} MP limit. "
+            "Use a smaller upscale factor."
+        )
 
-    if enhancement_type == "sharpen" or enhancement_type == "auto" or enhancement_type == "deblur":
-        # Adjust strength based on mode
-        strength = 1.5 if enhancement_type == "sharpen" else 1.0 # default/auto
-        strength = 2.0 if enhancement_type == "deblur" else strength
-        img = apply_sharpening(img, strength=strength)
-        
-    if enhancement_type == "denoise":
-        img = cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 21)
+    # 2-3. Upscale and enhance, in tiles when the output is large
+    if output_mp > TILE_THRESHOLD_MEGAPIXELS:
+        img = _enhance_tiled(img, compiled, tile_workers or tile_workers_for(1))
+    else:
+        img = compiled.run(img)
 
     # 4. Encode back to bytes
-    success, encoded_img = cv2.imencode('.png', img)
+    return encode_image(img, output_format, quality, png_compression)
+
+# ── Output encoding ──────────────────────────────────────────────────────────
+# PNG is lossless but slow and huge for photographs; JPEG/WebP are the sensible
+# defaults for photo input. resolve_output_format picks one from the request.
+
+OUTPUT_FORMATS = {
+    # format: (extension, media type)
+    "png": (".png", "image/png"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+
+DEFAULT_JPEG_QUALITY = 90
+DEFAULT_WEBP_QUALITY = 85
+
+def resolve_output_format(requested: str, image_bytes: bytes, accept: str = "") -> str:
+    """
+    Returns a concrete format for `requested`, which may be 'auto': photos
+    (JPEG input) become WebP when the client accepts it, else JPEG; anything
+    else (screenshots, scans, transparency) stays PNG.
+    """
+    requested = (requested or "auto").lower()
+    if requested == "jpg":
+        requested = "jpeg"
+    if requested != "auto":
+        if requested not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {requested}")
+        return requested
+
+    if image_bytes[:3] == b"\xff\xd8\xff":
+        return "webp" if "image/webp" in (accept or "") else "jpeg"
+    return "png"
+
+def encode_image(img, output_format: str = "png", quality: int = None, png_compression: int = None) -> bytes:
+    if output_format == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality or DEFAULT_JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    elif output_format == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality or DEFAULT_WEBP_QUALITY]
+    elif output_format == "png":
+        params = [] if png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    else:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+    success, encoded_img = cv2.imencode(OUTPUT_FORMATS[output_format][0], img, params)
     if not success:
         raise ValueError("Failed to encode processed image")
         
     return encoded_img.tobytes()
 
-def apply_clahe(img):
+# ── Enhancement pipeline ─────────────────────────────────────────────────────
+# An enhancement is an ordered list of operators, e.g.
+#   [{"op": "resize", "factor": 2}, {"op": "clahe"}, {"op": "sharpen_luma"}]
+# Each operator declares the colour space it works in; the pipeline converts
+# only when that changes, so adjacent LAB steps share one BGR->LAB->BGR round
+# trip. Compiled pipelines and CLAHE instances are cached per worker process.
+# Parameters are bounded: pipelines come from clients, and kernel sizes drive
+# both CPU time and the overlap tiled mode needs.
+
+MAX_PIPELINE_OPS = 16
+MAX_PIPELINE_SCALE = 4  # product of all resize factors, including upscale_factor
+
+class Operator:
+    name = None
+    space = None        # 'bgr', 'lab' or None (works in any space)
+    tile_safe = True    # False if the result depends on the whole frame
+    params = {}         # name -> (type, default, min, max)
+
+    def __init__(self, **kwargs):
+        unknown = set(kwargs) - set(self.params)
+        if unknown:
+            raise ValueError(f"Unknown parameter(s) for '{self.name}': {', '.join(sorted(unknown))}")
+        for key, (cast, default, low, high) in self.params.items():
+            value = cast(kwargs.get(key, default))
+            if not low <= value <= high:
+                raise ValueError(f"'{self.name}' {key} must be between {low} and {high}")
+            setattr(self, key, value)
+
+    @property
+    def radius(self) -> int:
+        """Pixels of neighbourhood (at this step's resolution) that one output pixel depends on."""
+        return 0
+
+    def apply(self, img):
+        raise NotImplementedError
+
+class Resize(Operator):
+    name = "resize"
+    params = {"factor": (int, 2, 1, 4)}
+    radius = 4  # Lanczos4 taps, in input pixels
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.factor not in (1, 2, 4):
+            raise ValueError("resize factor must be 1, 2, or 4")
+
+    def apply(self, img):
+        if self.factor == 1:
+            return img
+        h, w = img.shape[:2]
+        # Lanczos4 is generally best for high-quality upscaling
+        return cv2.resize(img, (w * self.factor, h * self.factor), interpolation=cv2.INTER_LANCZOS4)
+
+class Clahe(Operator):
+    name = "clahe"
+    space = "lab"
+    tile_safe = False
+    params = {"clip_limit": (float, 2.0, 0.1, 40.0), "grid": (int, 8, 1, 64)}
+
+    def apply(self, lab):
+        clahe = _get_clahe(self.clip_limit, self.grid)
+        lab[:, :, 0] = clahe.apply(np.ascontiguousarray(lab[:, :, 0]))
+        return lab
+
+class Sharpen(Operator):
+    name = "sharpen"
+    space = "bgr"
+    params = {"strength": (float, 1.0, 0.0, 5.0), "sigma": (float, 3.0, 0.1, 20.0)}
+
+    @property
+    def radius(self) -> int:
+        # OpenCV sizes an 8-bit Gaussian kernel to about 3 sigma each side
+        return int(math.ceil(3 * self.sigma)) + 1
+
+    def apply(self, img):
+        return apply_sharpening(img, strength=self.strength, sigma=self.sigma)
+
+class SharpenLuma(Sharpen):
+    """Unsharp mask on the L channel only: a third of the work and no colour fringing."""
+    name = "sharpen_luma"
+    space = "lab"
+
+    def apply(self, lab):
+        lab[:, :, 0] = apply_sharpening(np.ascontiguousarray(lab[:, :, 0]), self.strength, self.sigma)
+        return lab
+
+class Denoise(Operator):
+    name = "denoise"
+    space = "bgr"
+    params = {
+        "h": (float, 10, 0, 50),
+        "h_color": (float, 10, 0, 50),
+        "template_window": (int, 7, 3, 15),
+        "search_window": (int, 21, 3, 35),
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.template_window % 2 == 0 or self.search_window % 2 == 0:
+            raise ValueError("'denoise' template_window and search_window must be odd")
+
+    @property
+    def radius(self) -> int:
+        return self.search_window // 2 + self.template_window // 2
+
+    def apply(self, img):
+        return cv2.fastNlMeansDenoisingColored(
+            img, None, self.h, self.h_color, self.template_window, self.search_window
+        )
+
+OPERATORS = {op.name: op for op in (Resize, Clahe, Sharpen, SharpenLuma, Denoise)}
+
+_TO_SPACE = {("bgr", "lab"): cv2.COLOR_BGR2LAB, ("lab", "bgr"): cv2.COLOR_LAB2BGR}
+
+class Pipeline:
+    def __init__(self, operators):
+        self.operators = operators
+
+    @property
+    def scale(self) -> int:
+        scale = 1
+        for op in self.operators:
+            if isinstance(op, Resize):
+                scale *= op.factor
+        return scale
+
+    @property
+    def halo(self) -> int:
+        """Input pixels of context a tile needs for its centre to match a whole-frame run."""
+        total, scale = 0.0, 1
+        for op in self.operators:
+            total += op.radius / scale
+            if isinstance(op, Resize):
+                scale *= op.factor
+        return int(math.ceil(total))
+
+    def stages(self):
+        """
+        Splits the pipeline, in order, into (tiled, Pipeline) stages: runs of
+        tile-safe operators are tiled together, anything else runs on the whole frame.
+        """
+        stages = []
+        for op in self.operators:
+            if stages and stages[-1][0] == op.tile_safe:
+                stages[-1][1].append(op)
+            else:
+                stages.append((op.tile_safe, [op]))
+        return [(tiled, Pipeline(ops)) for tiled, ops in stages]
+
+    def run(self, img):
+        space = "bgr"
+        for op in self.operators:
+            if op.space and op.space != space:
+                img = cv2.cvtColor(img, _TO_SPACE[(space, op.space)])
+                space = op.space
+            img = op.apply(img)
+        if space != "bgr":
+            img = cv2.cvtColor(img, _TO_SPACE[(space, "bgr")])
+        return img
+
+# Built-in modes, expressed as pipelines (upscaling is prepended separately)
+PRESETS = {
+    "auto": [{"op": "clahe"}, {"op": "sharpen", "strength": 1.0}],
+    "contrast": [{"op": "clahe"}],
+    "sharpen": [{"op": "sharpen", "strength": 1.5}],
+    "deblur": [{"op": "sharpen", "strength": 2.0}],
+    "denoise": [{"op": "denoise"}],
+    "super_resolution": [],
+}
+
+def build_spec(enhancement_type: str = "auto", upscale_factor: int = 1, pipeline: list = None) -> list:
     """
-    Applies Contrast Limited Adaptive Histogram Equalization (CLAHE).
-    This improves local contrast and details without blowing out noise.
-    We convert to LAB color space to apply it only to the Luminance (L) channel.
+    The operator spec enhance_image runs: `pipeline` after any upscale, or the
+    mode's preset with the upscale after its leading CLAHE steps.
     """
-    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    cl = clahe.apply(l)
-    
-    limg = cv2.merge((cl, a, b))
-    final = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
-    return final
+    if pipeline is not None:
+        lead, spec = 0, list(pipeline)
+    else:
+        # Presets equalise before upscaling: CLAHE looks much the same on the input
+        # frame, costs 1/factor² as much there, and the whole-frame LAB round trip
+        # never has to hold a copy of the full-size output.
+        spec = list(PRESETS.get(enhancement_type, []))
+        lead = 0
+        while lead < len(spec) and spec[lead]["op"] == "clahe":
+            lead += 1
+    if upscale_factor > 1:
+        spec = spec[:lead] + [{"op": "resize", "factor": upscale_factor}] + spec[lead:]
+    return spec
+
+@lru_cache(maxsize=64)
+def compile_pipeline(spec_json: str) -> Pipeline:
+    """Builds (and caches) a Pipeline from its JSON spec. Raises ValueError on bad specs."""
+    spec = json.loads(spec_json)
+    if not isinstance(spec, list):
+        raise ValueError("pipeline must be a list of operators")
+    if len(spec) > MAX_PIPELINE_OPS:
+        raise ValueError(f"pipeline is limited to {MAX_PIPELINE_OPS} operators")
+    operators = []
+    for step in spec:
+        if not isinstance(step, dict) or step.get("op") not in OPERATORS:
+            raise ValueError(f"Unknown operator: {step!r}. Available: {', '.join(OPERATORS)}")
+        params = {k: v for k, v in step.items() if k != "op"}
+        operators.append(OPERATORS[step["op"]](**params))
+    compiled = Pipeline(operators)
+    if compiled.scale > MAX_PIPELINE_SCALE:
+        raise ValueError(f"Resizing is limited to {MAX_PIPELINE_SCALE}x in total")
+    return compiled
+
+@lru_cache(maxsize=16)
+def _get_clahe(clip_limit: float, grid: int):
+    return cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(grid, grid))
+
+# ── Tiled mode ───────────────────────────────────────────────────────────────
+# Large outputs are produced tile by tile: each input tile is padded by the
+# pipeline's halo (the summed kernel radii, at least TILE_OVERLAP pixels),
+# upscaled and filtered, and only its centre is copied into the output, so
+# blur/denoise kernels never see a tile edge and there are no seams. CLAHE
+# equalises over the whole frame, so it (and any other operator that isn't
+# tile_safe) runs on the whole frame at its place in the pipeline; the steps
+# around it are tiled. Tiles run on threads (OpenCV releases the GIL); since
+# enhance_image already runs in one of IMAGE_WORKERS processes, each request
+# gets the cores left idle by the others when it is submitted: a lone request
+# tiles on every core, while a saturated pool tiles serially in each process
+# rather than every process starting a thread per core. IMAGE_TILE_WORKERS
+# caps the threads per request.
+
+MAX_OUTPUT_MEGAPIXELS = float(os.environ.get("IMAGE_MAX_OUTPUT_MEGAPIXELS", "200"))
+TILE_THRESHOLD_MEGAPIXELS = float(os.environ.get("IMAGE_TILE_THRESHOLD_MEGAPIXELS", "16"))
+TILE_SIZE = int(os.environ.get("IMAGE_TILE_SIZE", "512"))       # input pixels
+TILE_OVERLAP = int(os.environ.get("IMAGE_TILE_OVERLAP", "24"))  # minimum, input pixels
+TILE_WORKERS = int(os.environ.get("IMAGE_TILE_WORKERS", str(os.cpu_count() or 2)))
+
+def tile_workers_for(active: int) -> int:
+    """Tile threads for a request submitted while `active` requests (itself included) are in flight."""
+    busy = min(max(active, 1), IMAGE_WORKERS)
+    return max(1, min(TILE_WORKERS, (os.cpu_count() or 2) // busy))
+
+def _enhance_tiled(img, pipeline: Pipeline, workers: int = 1):
+    for tiled, stage_ops in pipeline.stages():
+        img = _run_tiles(img, stage_ops, workers) if tiled else stage_ops.run(img)
+    return img
+
+def _run_tiles(img, tile_ops: Pipeline, workers: int = 1):
+    h, w = img.shape[:2]
+    k = tile_ops.scale
+    overlap = max(TILE_OVERLAP, tile_ops.halo)
+    out = np.empty((h * k, w * k, img.shape[2]), dtype=img.dtype)
+
+    def process(y0, x0):
+        y1, x1 = min(y0 + TILE_SIZE, h), min(x0 + TILE_SIZE, w)
+        py0, px0 = max(y0 - overlap, 0), max(x0 - overlap, 0)
+        py1, px1 = min(y1 + overlap, h), min(x1 + overlap, w)
+        tile = tile_ops.run(img[py0:py1, px0:px1])
+        oy, ox = (y0 - py0) * k, (x0 - px0) * k
+        out[y0 * k:y1 * k, x0 * k:x1 * k] = tile[oy:oy + (y1 - y0) * k, ox:ox + (x1 - x0) * k]
+
+    origins = [(y, x) for y in range(0, h, TILE_SIZE) for x in range(0, w, TILE_SIZE)]
+    if workers <= 1:
+        for y0, x0 in origins:
+            process(y0, x0)
+        return out
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first tile failure, if any
+        list(pool.map(lambda yx: process(*yx), origins))
+    return out
 
-def apply_sharpening(img, strength=1.0):
+def apply_sharpening(img, strength=1.0, sigma=3.0):
     """
     Applies Unsharp Masking to sharpen the image.
     Formula: Sharpened = Original + (Original - Blurred) * amount
     """
-    gaussian_blur = cv2.GaussianBlur(img, (0, 0), 3.0)
+    gaussian_blur = cv2.GaussianBlur(img, (0, 0), sigma)
     sharpened = cv2.addWeighted(img, 1.0 + strength, gaussian_blur, -strength, 0)
     return sharpened
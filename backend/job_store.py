@@ -0,0 +1,292 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+# ── Durable bulk-notification job store ──────────────────────────────────────
+# Jobs, one row per recipient and the delivery log live in SQLite, so campaigns
+# survive restarts (pending recipients are picked up again), memory no longer
+# grows with every send, and status polls read a single page of the log.
+#
+# SMTP passwords are never written to disk: a job interrupted by a restart that
+# needs one waits in status 'interrupted' until it is resumed with the password.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    channel TEXT,
+    template TEXT,
+    html_template TEXT,
+    subject TEXT,
+    credentials TEXT,
+    concurrency INTEGER,
+    rate_per_second REAL,
+    summary TEXT,
+    logs_total INTEGER NOT NULL DEFAULT 0,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS recipients (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS recipients_pending ON recipients (job_id, status);
+CREATE TABLE IF NOT EXISTS logs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_job ON logs (job_id, seq);
+CREATE TABLE IF NOT EXISTS recipient_sets (
+    id TEXT PRIMARY KEY,
+    filename TEXT,
+    columns TEXT,
+    total INTEGER NOT NULL DEFAULT 0,
+    invalid INTEGER NOT NULL DEFAULT 0,
+    duplicates INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recipient_set_rows (
+    set_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (set_id, idx)
+);
+"""
+
+RECIPIENT_SET_TTL_DAYS = int(os.environ.get("RECIPIENT_SET_TTL_DAYS", "7"))
+
+class JobStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Adds columns introduced after a database was first created."""
+        existing = {r[1] for r in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "html_template" not in existing:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN html_template TEXT")
+        if "logs_total" not in existing:
+            with self._conn:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN logs_total INTEGER NOT NULL DEFAULT 0")
+                self._conn.execute(
+                    "UPDATE jobs SET logs_total = (SELECT COUNT(*) FROM logs WHERE logs.job_id = jobs.id)"
+                )
+
+    def create_job(self, job_id, recipients, channel, template, subject, credentials,
+                   concurrency=None, rate_per_second=None, html_template=None):
+        # Keep everything needed to resume except the secret
+        public_creds = {k: v for k, v in (credentials or {}).items() if k != 'smtp_pass'}
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, total, channel, template, html_template, subject, credentials,"
+                " concurrency, rate_per_second, started_at) VALUES (?, 'processing', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, len(recipients), channel, template, html_template, subject, json.dumps(public_creds),
+                 concurrency, rate_per_second, now)
+            )
+            self._conn.executemany(
+                "INSERT INTO recipients (job_id, idx, data) VALUES (?, ?, ?)",
+                ((job_id, i, json.dumps(r, default=str)) for i, r in enumerate(recipients))
+            )
+
+    def create_job_from_set(self, job_id, set_id, channel, template, subject, credentials,
+                            concurrency=None, rate_per_second=None, html_template=None):
+        """Like create_job, but copies recipients from a stored set inside SQLite."""
+        public_creds = {k: v for k, v in (credentials or {}).items() if k != 'smtp_pass'}
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT total FROM recipient_sets WHERE id = ?", (set_id,)).fetchone()
+            if not row:
+                raise ValueError("Recipient set not found")
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, total, channel, template, html_template, subject, credentials,"
+                " concurrency, rate_per_second, started_at) VALUES (?, 'processing', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, row['total'], channel, template, html_template, subject, json.dumps(public_creds),
+                 concurrency, rate_per_second, now)
+            )
+            self._conn.execute(
+                "INSERT INTO recipients (job_id, idx, data)"
+                " SELECT ?, idx, data FROM recipient_set_rows WHERE set_id = ?",
+                (job_id, set_id)
+            )
+
+    # ── Recipient sets ───────────────────────────────────────────────────────
+    # Uploaded recipient lists are stored server-side and referenced by id, so
+    # they never travel back to the client and are posted again.
+
+    def create_recipient_set(self, set_id, filename):
+        self._prune_recipient_sets()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO recipient_sets (id, filename, created_at) VALUES (?, ?, ?)",
+                (set_id, filename, datetime.now().isoformat())
+            )
+
+    def add_recipient_rows(self, set_id, start_idx, rows):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO recipient_set_rows (set_id, idx, data) VALUES (?, ?, ?)",
+                ((set_id, start_idx + i, json.dumps(r, default=str)) for i, r in enumerate(rows))
+            )
+
+    def finish_recipient_set(self, set_id, columns, total, invalid, duplicates):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE recipient_sets SET columns = ?, total = ?, invalid = ?, duplicates = ? WHERE id = ?",
+                (json.dumps(columns), total, invalid, duplicates, set_id)
+            )
+
+    def get_recipient_set(self, set_id, preview: int = 5):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM recipient_sets WHERE id = ?", (set_id,)).fetchone()
+            if not row:
+                return None
+            rows = self._conn.execute(
+                "SELECT data FROM recipient_set_rows WHERE set_id = ? ORDER BY idx LIMIT ?",
+                (set_id, preview)
+            ).fetchall()
+        info = dict(row)
+        info['columns'] = json.loads(info['columns'] or '[]')
+        info['preview'] = [json.loads(r['data']) for r in rows]
+        return info
+
+    def delete_recipient_set(self, set_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM recipient_set_rows WHERE set_id = ?", (set_id,))
+            self._conn.execute("DELETE FROM recipient_sets WHERE id = ?", (set_id,))
+
+    def _prune_recipient_sets(self):
+        cutoff = (datetime.now() - timedelta(days=RECIPIENT_SET_TTL_DAYS)).isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM recipient_set_rows WHERE set_id IN"
+                " (SELECT id FROM recipient_sets WHERE created_at < ?)", (cutoff,)
+            )
+            self._conn.execute("DELETE FROM recipient_sets WHERE created_at < ?", (cutoff,))
+
+    def get_job(self, job_id, logs_offset: int = None, logs_limit: int = 50):
+        """
+        Job summary plus one page of logs. Without `logs_offset` the most recent
+        `logs_limit` entries are returned (oldest first); that default poll reads
+        only those rows, however long the log has grown.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if not row:
+                return None
+            logs_total = row['logs_total']
+            if logs_offset is None:
+                logs_offset = max(0, logs_total - logs_limit)
+                logs = [r[0] for r in self._conn.execute(
+                    "SELECT message FROM logs WHERE job_id = ? ORDER BY seq DESC LIMIT ?",
+                    (job_id, logs_limit)
+                )][::-1]
+            else:
+                logs = [r[0] for r in self._conn.execute(
+                    "SELECT message FROM logs WHERE job_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                    (job_id, logs_limit, logs_offset)
+                )]
+
+        done = row['sent'] + row['failed']
+        return {
+            'id': row['id'],
+            'status': row['status'],
+            'progress': 100 if row['status'] == 'completed' else int(done / max(row['total'], 1) * 100),
+            'total': row['total'],
+            'sent': row['sent'],
+            'failed': row['failed'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'summary': row['summary'],
+            'logs': logs,
+            'logs_offset': logs_offset,
+            'logs_total': logs_total,
+        }
+
+    def job_config(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        config = dict(row)
+        config['credentials'] = json.loads(config['credentials'] or '{}')
+        return config
+
+    def pending_recipients(self, job_id, after_idx: int = -1, limit: int = -1):
+        """
+        (idx, recipient) pairs not yet delivered, in original order. Pages with
+        `after_idx` (the last idx already seen) and `limit` (-1: no limit).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, data FROM recipients WHERE job_id = ? AND status = 'pending' AND idx > ?"
+                " ORDER BY idx LIMIT ?",
+                (job_id, after_idx, limit)
+            ).fetchall()
+        return [(r['idx'], json.loads(r['data'])) for r in rows]
+
+    def record_result(self, job_id, idx, success: bool, messages, error: str = None):
+        """Marks one recipient done and appends its log lines, atomically."""
+        self.record_results(job_id, [(idx, success, messages, error)])
+
+    def record_results(self, job_id, results):
+        """
+        Marks a batch of recipients done and appends their log lines in a single
+        transaction. results: (idx, success, messages, error) tuples.
+        """
+        now = datetime.now().isoformat()
+        sent = sum(1 for _, success, _, _ in results if success)
+        logged = sum(len(messages) for _, _, messages, _ in results)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE recipients SET status = ?, error = ?, updated_at = ? WHERE job_id = ? AND idx = ?",
+                (('sent' if success else 'failed', error, now, job_id, idx)
+                 for idx, success, _, error in results)
+            )
+            self._conn.execute(
+                "UPDATE jobs SET sent = sent + ?, failed = failed + ?, logs_total = logs_total + ? WHERE id = ?",
+                (sent, len(results) - sent, logged, job_id)
+            )
+            self._conn.executemany(
+                "INSERT INTO logs (job_id, message, created_at) VALUES (?, ?, ?)",
+                ((job_id, m, now) for _, _, messages, _ in results for m in messages)
+            )
+
+    def set_status(self, job_id, status: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+
+    def finish_job(self, job_id):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT sent, failed FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            self._conn.execute(
+                "UPDATE jobs SET status = 'completed', summary = ?, finished_at = ? WHERE id = ?",
+                (f"Sent: {row['sent']}, Failed: {row['failed']}", datetime.now().isoformat(), job_id)
+            )
+
+    def unfinished_jobs(self):
+        """Ids of jobs that were processing or interrupted (e.g. when the server stopped)."""
+        with self._lock:
+            return [r[0] for r in self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('processing', 'interrupted') ORDER BY started_at"
+            )]
+
+job_store = JobStore(os.environ.get("JOBS_DB_PATH", "jobs.sqlite3"))
@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+from functools import wraps
+
+from metrics import registry
+
+# ── Event-loop guard ─────────────────────────────────────────────────────────
+# Every request shares one event loop, so a handler that runs CPU- or IO-heavy
+# code directly stalls every other request. Two layers catch that:
+#
+# - `@blocking` marks functions that must never run on the loop (document
+#   processing, PDF editing, signing, image enhancement...). Calling one from
+#   the loop thread is counted and logged, and raises BlockingCallError in
+#   strict mode. Offload them with asyncio.to_thread or an executor.
+# - LoopWatchdog catches everything else: the loop stamps a heartbeat every
+#   LOOP_LAG_INTERVAL_MS, and a watchdog thread that sees it go stale for
+#   LOOP_BLOCK_THRESHOLD_MS grabs the loop thread's stack, names the route whose
+#   handler is on it, and logs where it is stuck.
+#
+# LOOP_GUARD_STRICT=1 (development) also fails the offending request with a 500
+# and turns on asyncio debug mode, so regressions surface before production.
+
+LOOP_GUARD_ENABLED = os.environ.get("LOOP_GUARD", "1") == "1"
+LOOP_GUARD_STRICT = os.environ.get("LOOP_GUARD_STRICT", "0") == "1"
+LOOP_LAG_INTERVAL_MS = float(os.environ.get("LOOP_LAG_INTERVAL_MS", "50"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", "100"))
+
+loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop ran its heartbeat.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+loop_blocks = registry.counter(
+    "event_loop_blocks_total", "Times the event loop was blocked past the threshold, by route.", ("route",)
+)
+blocking_calls = registry.counter(
+    "blocking_calls_on_loop_total", "Calls to @blocking functions made on the event loop thread.", ("function",)
+)
+
+class BlockingCallError(RuntimeError):
+    pass
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+_warned = set()
+
+def blocking(fn):
+    """Marks `fn` as blocking: it must run in a worker thread or process, never on the event loop."""
+    name = fn.__qualname__
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if LOOP_GUARD_ENABLED and _on_event_loop():
+            blocking_calls.inc(function=name)
+            message = f"{name} blocks the event loop; run it with asyncio.to_thread or an executor"
+            if LOOP_GUARD_STRICT:
+                raise BlockingCallError(message)
+            if name not in _warned:
+                _warned.add(name)
+                print(f"[LOOP] Warning: {message}")
+        return fn(*args, **kwargs)
+    return wrapper
+
+def route_label(route) -> str:
+    """'GET /process/{file_id}' for a Starlette route, the label blocks are attributed to."""
+    methods = ",".join(sorted(getattr(route, "methods", None) or []))
+    return f"{methods} {getattr(route, 'path', '')}".strip()
+
+class LoopWatchdog:
+    def __init__(self, interval: float, threshold: float, strict: bool = False):
+        self.interval = interval
+        self.threshold = threshold
+        self.strict = strict
+        self.events = deque(maxlen=200)  # recent blocks, newest last
+        self._loop = None
+        self._loop_thread = None
+        self._route_codes = {}
+        self._last_beat = 0.0
+        self._pending = None  # block seen by the watchdog, not yet over
+        self._lock = threading.Lock()
+
+    def start(self, loop, routes):
+        """Call from the event loop thread (e.g. a startup hook)."""
+        if self._loop is not None:
+            return
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        for route in routes:
+            endpoint = getattr(route, "endpoint", None)
+            code = getattr(endpoint, "__code__", None)
+            if code is not None:
+                self._route_codes[code] = route_label(route)
+        if self.strict:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+        self._last_beat = time.monotonic()
+        loop.call_later(self.interval, self._beat, self._last_beat + self.interval)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def recent(self, limit: int = 50):
+        with self._lock:
+            return [dict(e) for e in list(self.events)[-limit:]][::-1]
+
+    def blocks_since(self, started: float, route: str):
+        """Blocks attributed to `route` that began after `started` (time.monotonic)."""
+        with self._lock:
+            return [e for e in self.events if e["route"] == route and e["started"] >= started]
+
+    def _beat(self, expected: float):
+        now = time.monotonic()
+        lag = max(0.0, now - expected)
+        loop_lag.observe(lag)
+        with self._lock:
+            self._last_beat = now
+            event, self._pending = self._pending, None
+        if event:
+            event["duration_ms"] = round((now - event["started"]) * 1000, 1)
+            print(f"[LOOP] Event loop blocked {event['duration_ms']} ms by {event['route']} at {event['where']}")
+        self._loop.call_later(self.interval, self._beat, now + self.interval)
+
+    def _watch(self):
+        poll = min(self.interval, self.threshold) / 2
+        while True:
+            time.sleep(poll)
+            with self._lock:
+                stalled = time.monotonic() - self._last_beat - self.interval
+                if stalled < self.threshold or self._pending is not None:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            route, stack = self._attribute(frame)
+            started = self._last_beat + self.interval
+            event = {
+                "started": started,
+                "at": round(time.time() - (time.monotonic() - started), 3),
+                "route": route,
+                "where": stack[-1] if stack else "unknown",
+                "stack": stack,
+                "duration_ms": None,
+            }
+            with self._lock:
+                self._pending = event
+                self.events.append(event)
+            loop_blocks.inc(route=route)
+
+    def _attribute(self, frame):
+        """(route label or 'background', innermost frames as 'file:line in func')."""
+        route = "background"
+        walker = frame
+        while walker is not None:
+            label = self._route_codes.get(walker.f_code)
+            if label:
+                route = label
+                break
+            walker = walker.f_back
+        stack = [
+            f"{os.path.basename(f.filename)}:{f.lineno} in {f.name}"
+            for f in traceback.extract_stack(frame)[-8:]
+        ]
+        return route, stack
+
+loop_watchdog = LoopWatchdog(
+    interval=LOOP_LAG_INTERVAL_MS / 1000,
+    threshold=LOOP_BLOCK_THRESHOLD_MS / 1000,
+    strict=LOOP_GUARD_STRICT,
+)
@@ -1,23 +1,40 @@
 import os
+import json
+import math
+import time
 import asyncio
+import hashlib
 import shutil
 import uuid
+import zipfile
 from pathlib import Path
+from urllib.parse import quote
 from typing import List, Optional
 from pydantic import BaseModel
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 
 from processor import process_document
-from signature_service import apply_signature_to_pdf
-from image_enhancer import enhance_image
-from tts_service import generate_speech
-from notification_service import notification_service, JOBS_STORE
-from audio_transcriber import transcribe_audio
+from signature_service import apply_signature_to_pdf, sign_pdf_file, load_signature_image, sign_pdf_batch, signer_store
+from image_enhancer import (
+    build_spec, compile_pipeline, enhance_image_async, resolve_output_format, OutputTooLargeError,
+    OUTPUT_FORMATS, IMAGE_WORKERS
+)
+from tts_service import stream_speech, read_file_chunks, speech_cache, tts_batch_service, TTS_JOBS_STORE
+from notification_service import notification_service
+from job_store import job_store
+from audio_transcriber import (
+    model_manager, PRELOAD_MODELS, transcription_scheduler, QueueFullError,
+    transcript_cache, transcription_mode, render_transcript
+)
 from pdf_editor import pdf_editor
+from metrics import registry, request_latency, requests_in_progress, stage
+from profiling import request_profiler, request_id_from
+from loop_guard import loop_watchdog, route_label, LOOP_GUARD_ENABLED, LOOP_GUARD_STRICT
 
 app = FastAPI(title="Document Intelligence API")
 
@@ -38,6 +55,204 @@ OUTPUT_DIR.mkdir(exist_ok=True)
 
 app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
 
+# ── Metrics ──────────────────────────────────────────────────────────────────
+# Request latency is labelled with the route template (/process/{file_id}), not
+# the raw path, to keep the series count bounded. Streaming responses are timed
+# to their first byte.
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    requests_in_progress.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        requests_in_progress.dec()
+        route = request.scope.get("route")
+        request_latency.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+
+# ── Slow-request profiling ───────────────────────────────────────────────────
+# Every response carries an X-Request-ID; slow (or X-Profile: 1) requests also
+# carry the X-Profile-ID their stack profile is stored under. See profiling.py
+# for the switches.
+
+@app.middleware("http")
+async def profile_slow_requests(request: Request, call_next):
+    request_id = request_id_from(request.headers.get("x-request-id"))
+    forced = request_profiler.header_enabled and request.headers.get("x-profile") == "1"
+    if not request_profiler.wants(request.headers.get("x-profile")):
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+
+    capture = request_profiler.begin(forced)
+    status = 500
+    summary = None
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # Only requests whose profile is kept pay for a trip to a worker thread
+        if request_profiler.end(capture):
+            meta = {"method": request.method, "path": request.url.path, "status": status}
+            summary = await asyncio.to_thread(request_profiler.save, capture, request_id, meta)
+    response.headers["X-Request-ID"] = request_id
+    if summary:
+        response.headers["X-Profile-ID"] = summary["profile_id"]
+    return response
+
+def _check_profile_access(request: Request):
+    # Profiles expose stacks, paths and timings: off unless PROFILING_ENABLED=1 (plus token, if set)
+    if not request_profiler.allows(request.headers.get("x-debug-token")):
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+
+# ── Event-loop guard ─────────────────────────────────────────────────────────
+# The watchdog (loop_guard.py) notices when the loop stops turning and names the
+# route whose handler is holding it. Responses from such a handler carry
+# X-Loop-Blocked-Ms; with LOOP_GUARD_STRICT=1 they fail with a 500 instead, so a
+# blocking call slipped into an async handler is caught in development.
+
+@app.middleware("http")
+async def guard_event_loop(request: Request, call_next):
+    if not loop_watchdog.running:
+        return await call_next(request)
+    started = time.monotonic()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    blocks = loop_watchdog.blocks_since(started, route_label(route)) if route else []
+    if not blocks:
+        return response
+    blocked_ms = sum(e["duration_ms"] or (time.monotonic() - e["started"]) * 1000 for e in blocks)
+    if LOOP_GUARD_STRICT:
+        return JSONResponse(status_code=500, content={
+            "detail": f"Handler blocked the event loop for {blocked_ms:.0f} ms at {blocks[0]['where']}",
+            "stack": blocks[0]["stack"],
+        })
+    response.headers["X-Loop-Blocked-Ms"] = f"{blocked_ms:.0f}"
+    return response
+
+@app.get("/debug/loop-blocks")
+async def list_loop_blocks(limit: int = 50):
+    """Most recent event-loop blocks, newest first."""
+    if not loop_watchdog.running:
+        raise HTTPException(404, "Event-loop guard is disabled")
+    return {"blocks": [
+        {k: v for k, v in e.items() if k != "started"} for e in loop_watchdog.recent(limit)
+    ]}
+
+@app.get("/debug/profiles")
+async def list_profiles(request: Request):
+    _check_profile_access(request)
+    return {"profiles": await asyncio.to_thread(request_profiler.list_profiles)}
+
+@app.get("/debug/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: str):
+    _check_profile_access(request)
+    summary = await asyncio.to_thread(request_profiler.get_summary, profile_id)
+    if not summary:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return summary
+
+@app.get("/debug/profiles/{profile_id}/folded")
+async def get_profile_folded(request: Request, profile_id: str):
+    """Folded stacks for flamegraph.pl / speedscope."""
+    _check_profile_access(request)
+    path = request_profiler.folded_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
+
+@registry.add_collector
+def collect_service_metrics():
+    scheduler = transcription_scheduler.stats()
+    yield "queue_depth", "gauge", "Jobs waiting for a worker.", [
+        ({"queue": "transcription"}, scheduler["queued"]),
+    ]
+    yield "workers_busy", "gauge", "Workers currently running a job.", [
+        ({"pool": "transcription"}, scheduler["running"]),
+    ]
+    yield "workers", "gauge", "Configured worker count per pool.", [
+        ({"pool": "transcription"}, scheduler["workers"]),
+        ({"pool": "image"}, IMAGE_WORKERS),
+    ]
+
+    models = model_manager.stats()
+    transcripts = transcript_cache.stats()
+    speech = speech_cache.stats()
+    caches = [
+        ("whisper_model", models["hits"], models["misses"]),
+        ("transcript", transcripts["hits"], transcripts["misses"]),
+        ("speech", speech["hits"], speech["misses"]),
+        ("p12_signer", signer_store.p12_hits, signer_store.p12_misses),
+    ]
+    yield "cache_hits_total", "counter", "Cache lookups served from the cache.", [
+        ({"cache": name}, hits) for name, hits, _ in caches
+    ]
+    yield "cache_misses_total", "counter", "Cache lookups that had to do the work.", [
+        ({"cache": name}, misses) for name, _, misses in caches
+    ]
+    yield "cache_entries", "gauge", "Entries currently held by a cache.", [
+        ({"cache": "whisper_model"}, len(models["models"])),
+        ({"cache": "transcript"}, transcripts["entries"]),
+        ({"cache": "speech"}, speech["entries"]),
+    ]
+    yield "whisper_resident_megabytes", "gauge", "Memory held by loaded Whisper models.", [
+        ({}, models["resident_mb"]),
+    ]
+
+    tts_statuses = {}
+    for job in list(TTS_JOBS_STORE.values()):
+        tts_statuses[job["status"]] = tts_statuses.get(job["status"], 0) + 1
+    yield "background_jobs", "gauge", "Background jobs held by this process, by status.", [
+        ({"kind": "tts_batch", "status": status}, count) for status, count in tts_statuses.items()
+    ] + [
+        ({"kind": "bulk_notification", "status": "running"}, notification_service.stats()["running_jobs"]),
+    ]
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of request, stage, queue and cache metrics."""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.on_event("startup")
+async def start_loop_watchdog():
+    if LOOP_GUARD_ENABLED:
+        loop_watchdog.start(asyncio.get_running_loop(), app.routes)
+
+@app.on_event("startup")
+async def resume_bulk_jobs():
+    # Pick up bulk notification jobs cut off by the last shutdown
+    await notification_service.resume_unfinished()
+
+@app.on_event("startup")
+async def preload_models():
+    # Warm Whisper models listed in WHISPER_PRELOAD without delaying startup
+    if PRELOAD_MODELS:
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(None, model_manager.preload, PRELOAD_MODELS)
+
+def _spool_upload(upload: UploadFile, path):
+    with stage("upload"), open(path, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+
+def _spool_upload_hashed(upload: UploadFile, path) -> str:
+    # Like _spool_upload, but returns the SHA-256 of what was written so the
+    # upload never has to be held in memory (or re-read) just to hash it.
+    digest = hashlib.sha256()
+    with stage("upload"), open(path, "wb") as buffer:
+        for block in iter(lambda: upload.file.read(1024 * 1024), b""):
+            digest.update(block)
+            buffer.write(block)
+    return digest.hexdigest()
+
 @app.get("/")
 async def root():
     return {"message": "Document Intelligence API is running"}
@@ -67,8 +282,7 @@ async def upload_file(file: UploadFile = File(...)):
         safe_filename = f"{file_id}{file_ext}"
         file_path = UPLOAD_DIR / safe_filename
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await asyncio.to_thread(_spool_upload, file, file_path)
 
         return {
             "file_id": file_id,
@@ -90,7 +304,7 @@ async def process_file(file_id: str, background_tasks: BackgroundTasks):
     
     try:
         # Run processing
-        result = process_document(str(file_path), str(OUTPUT_DIR), file_id)
+        result = await asyncio.to_thread(process_document, str(file_path), str(OUTPUT_DIR), file_id)
         return result
     except Exception as e:
         import traceback
@@ -126,37 +340,56 @@ async def sign_pdf(
     x: float = 100.0,
     y: float = 100.0,
     width: float = 200.0,
-    height: float = 100.0
+    height: float = 100.0,
+    signing_mode: str = Form("incremental") # incremental, rewrite
 ):
+    if signing_mode not in ("incremental", "rewrite"):
+        raise HTTPException(400, "signing_mode must be 'incremental' or 'rewrite'")
+
+    output_filename = f"signed_{uuid.uuid4()}.pdf"
+    output_path = OUTPUT_DIR / output_filename
+    input_path = OUTPUT_DIR / f"upload_{uuid.uuid4()}.pdf"
+
     try:
-        # Read files into memory
-        pdf_bytes = await pdf_file.read()
         sig_bytes = await signature_image.read()
         
         p12_bytes = None
         if p12_file:
             p12_bytes = await p12_file.read()
 
-        # Apply signature
-        signed_pdf_bytes = apply_signature_to_pdf(
-            pdf_bytes=pdf_bytes,
-            signature_bytes=sig_bytes,
-            page_number=page_number,
-            x=x,
-            y=y,
-            width=width,
-            height=height,
-            p12_bytes=p12_bytes,
-            p12_password=password
-        )
-        
-        # Create a temporary file to serve the response
-        # Using a proper temp file or in-memory response is cleaner, but to match existing pattern:
-        output_filename = f"signed_{uuid.uuid4()}.pdf"
-        output_path = OUTPUT_DIR / output_filename
-        
-        with open(output_path, "wb") as f:
-            f.write(signed_pdf_bytes)
+        if signing_mode == "incremental":
+            # Spool the upload to disk and sign file-to-file; the PDF is never fully in memory
+            await asyncio.to_thread(_spool_upload, pdf_file, input_path)
+
+            await asyncio.to_thread(
+                sign_pdf_file,
+                input_path=str(input_path),
+                output_path=str(output_path),
+                signature_image=load_signature_image(sig_bytes),
+                page_number=page_number,
+                x=x,
+                y=y,
+                width=width,
+                height=height,
+                p12_bytes=p12_bytes,
+                p12_password=password
+            )
+        else:
+            # Legacy path: flatten the image into the page, rewrite, then sign
+            pdf_bytes = await pdf_file.read()
+            signed_pdf_bytes = await asyncio.to_thread(
+                apply_signature_to_pdf,
+                pdf_bytes=pdf_bytes,
+                signature_bytes=sig_bytes,
+                page_number=page_number,
+                x=x,
+                y=y,
+                width=width,
+                height=height,
+                p12_bytes=p12_bytes,
+                p12_password=password
+            )
+            await asyncio.to_thread(output_path.write_bytes, signed_pdf_bytes)
             
         return FileResponse(
             path=output_path,
@@ -167,45 +400,254 @@ async def sign_pdf(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    finally:
+        if os.path.exists(input_path):
+            os.remove(input_path)
+
+@app.post("/signature/batch")
+async def sign_pdf_batch_endpoint(
+    pdf_files: List[UploadFile] = File(...),
+    signature_image: UploadFile = File(...),
+    p12_file: Optional[UploadFile] = File(None),
+    password: Optional[str] = Form(None),
+    placements: str = Form("[]"), # JSON list, one {page_number, x, y, width, height} per PDF
+    page_number: int = Form(1),   # Defaults for PDFs without their own placement
+    x: float = Form(100.0),
+    y: float = Form(100.0),
+    width: float = Form(200.0),
+    height: float = Form(100.0)
+):
+    default_placement = {"page_number": page_number, "x": x, "y": y, "width": width, "height": height}
+    placement_list = _parse_placements(placements, default_placement)
+
+    batch_id = str(uuid.uuid4())
+    zip_path = OUTPUT_DIR / f"signed_batch_{batch_id}.zip"
+    items = []
+    try:
+        for i, f in enumerate(pdf_files):
+            placement = dict(default_placement)
+            if i < len(placement_list) and placement_list[i]:
+                placement.update(placement_list[i])
+            items.append({
+                "input_path": str(OUTPUT_DIR / f"upload_{batch_id}_{i}.pdf"),
+                "output_path": str(OUTPUT_DIR / f"signed_{batch_id}_{i}.pdf"),
+                "name": Path(f.filename).name,
+                "placement": placement,
+            })
+            await asyncio.to_thread(_spool_upload, f, items[-1]["input_path"])
+
+        sig_bytes = await signature_image.read()
+        p12_bytes = await p12_file.read() if p12_file else None
+
+        # The process pool is driven from a thread so the event loop stays free
+        loop = asyncio.get_event_loop()
+        report = await loop.run_in_executor(
+            None,
+            lambda: sign_pdf_batch(items, sig_bytes, str(zip_path), p12_bytes, password)
+        )
+        if not any(r["status"] == "signed" for r in report):
+            raise HTTPException(400, f"No documents could be signed: {report[0].get('error') if report else ''}")
+
+        # The archive is removed once it has been sent
+        return FileResponse(zip_path, filename="signed_documents.zip", media_type="application/zip",
+                            background=BackgroundTask(_remove_quietly, zip_path))
+
+    except HTTPException:
+        _remove_quietly(zip_path)
+        raise
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        _remove_quietly(zip_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    finally:
+        for item in items:
+            for p in (item["input_path"], item["output_path"]):
+                _remove_quietly(p)
+
+def _parse_placements(placements: str, default_placement: dict) -> list:
+    """Decodes the per-PDF placements form field: a JSON list of objects (or nulls). 400 if malformed."""
+    try:
+        placement_list = json.loads(placements)
+    except ValueError:
+        raise HTTPException(400, "placements must be a JSON list")
+    if not isinstance(placement_list, list):
+        raise HTTPException(400, "placements must be a JSON list")
+    parsed = []
+    for i, entry in enumerate(placement_list):
+        if entry is None:
+            parsed.append(None)
+            continue
+        if not isinstance(entry, dict):
+            raise HTTPException(400, f"placements[{i}] must be an object")
+        placement = {}
+        for key, default in default_placement.items():
+            if key not in entry:
+                continue
+            value = entry[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise HTTPException(400, f"placements[{i}].{key} must be a number")
+            placement[key] = type(default)(value)
+        parsed.append(placement)
+    return parsed
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _parse_pipeline(pipeline: Optional[str], enhancement_type: str, upscale_factor: int):
+    """
+    Decodes a JSON operator pipeline form field (None if not given) and checks
+    the full pipeline the request will run, operator bounds included. 400 if invalid.
+    """
+    try:
+        spec = json.loads(pipeline) if pipeline else None
+        compile_pipeline(json.dumps(build_spec(enhancement_type, upscale_factor, spec), sort_keys=True))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid pipeline: {e}")
+    return spec
+
+def _check_encode_options(quality: Optional[int], png_compression: Optional[int]):
+    if quality is not None and not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="Quality must be between 1 and 100")
+    if png_compression is not None and not 0 <= png_compression <= 9:
+        raise HTTPException(status_code=400, detail="PNG compression must be between 0 and 9")
+
+def _attachment_disposition(filename: str) -> str:
+    # Plain `filename=` must be latin-1 and can't carry quotes, so it gets an ASCII
+    # fallback; clients that understand RFC 5987 use the UTF-8 `filename*` instead.
+    fallback = "".join(c if " " <= c <= "~" and c not in '"\\' else "_" for c in filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=utf-8''{quote(filename, safe='')}"
+
 @app.post("/image-enhancer")
 async def enhance_image_endpoint(
+    request: Request,
     image_file: UploadFile = File(...),
     enhancement_type: str = Form("auto"),
-    upscale_factor: int = Form(1)
+    upscale_factor: int = Form(1),
+    output_format: str = Form("auto"), # auto, png, jpeg, webp
+    quality: Optional[int] = Form(None), # JPEG/WebP quality 1-100
+    png_compression: Optional[int] = Form(None), # PNG level 0-9
+    pipeline: Optional[str] = Form(None) # JSON list of operators, overrides enhancement_type
 ):
+    # Validate input
+    if upscale_factor not in [1, 2, 4]:
+        raise HTTPException(status_code=400, detail="Upscale factor must be 1, 2, or 4")
+    _check_encode_options(quality, png_compression)
+    spec = _parse_pipeline(pipeline, enhancement_type, upscale_factor)
+
     try:
-        # Validate input
-        if upscale_factor not in [1, 2, 4]:
-            raise HTTPException(status_code=400, detail="Upscale factor must be 1, 2, or 4")
-            
         # Read file
         img_bytes = await image_file.read()
-        
-        # Process
-        enhanced_bytes = enhance_image(
-            image_bytes=img_bytes,
+        fmt = resolve_output_format(output_format, img_bytes, request.headers.get("accept", ""))
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    try:
+        # Process (in the image worker pool, off the event loop)
+        enhanced_bytes = await enhance_image_async(
+            img_bytes,
             enhancement_type=enhancement_type,
-            upscale_factor=upscale_factor
+            upscale_factor=upscale_factor,
+            output_format=fmt,
+            quality=quality,
+            png_compression=png_compression,
+            pipeline=spec
         )
         
-        # Save to temp file
-        output_filename = f"enhanced_{uuid.uuid4()}.png"
-        output_path = OUTPUT_DIR / output_filename
-        
-        with open(output_path, "wb") as f:
-            f.write(enhanced_bytes)
-            
-        return FileResponse(
-            path=output_path,
-            filename=f"enhanced_{image_file.filename}.png",
-            media_type='image/png'
+        # Served straight from memory; nothing is written to OUTPUT_DIR
+        ext, media_type = OUTPUT_FORMATS[fmt]
+        return Response(
+            content=enhanced_bytes,
+            media_type=media_type,
+            headers={
+                "Content-Disposition": _attachment_disposition(f"enhanced_{Path(image_file.filename).stem}{ext}"),
+                "Vary": "Accept"
+            }
         )
-        
+
+    except OutputTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as ve:
+        # Undecodable image or invalid options
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/image-enhancer/batch")
+async def enhance_image_batch_endpoint(
+    request: Request,
+    image_files: List[UploadFile] = File(...),
+    enhancement_type: str = Form("auto"),
+    upscale_factor: int = Form(1),
+    output_format: str = Form("auto"),
+    quality: Optional[int] = Form(None),
+    png_compression: Optional[int] = Form(None),
+    pipeline: Optional[str] = Form(None)
+):
+    """Runs one enhancement pipeline over many images and returns a zip of the results."""
+    if upscale_factor not in [1, 2, 4]:
+        raise HTTPException(status_code=400, detail="Upscale factor must be 1, 2, or 4")
+    _check_encode_options(quality, png_compression)
+    spec = _parse_pipeline(pipeline, enhancement_type, upscale_factor)
+    accept = request.headers.get("accept", "")
+
+    # Keep at most a couple of images per worker in flight, so memory stays bounded
+    semaphore = asyncio.Semaphore(IMAGE_WORKERS * 2)
+    zip_path = OUTPUT_DIR / f"enhanced_batch_{uuid.uuid4()}.zip"
+    # Encoded images are already compressed; store them as-is
+    zf = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED)
+    zip_lock = asyncio.Lock()
+
+    async def run(index: int, upload: UploadFile):
+        # Each output goes into the zip on disk as soon as it is ready, so only
+        # the images in flight are ever held in memory
+        async with semaphore:
+            img_bytes = await upload.read()
+            try:
+                fmt = resolve_output_format(output_format, img_bytes, accept)
+                result = await enhance_image_async(
+                    img_bytes,
+                    enhancement_type=enhancement_type,
+                    upscale_factor=upscale_factor,
+                    output_format=fmt,
+                    quality=quality,
+                    png_compression=png_compression,
+                    pipeline=spec
+                )
+                del img_bytes
+                name = f"{index + 1:04d}_enhanced_{Path(upload.filename).stem}{OUTPUT_FORMATS[fmt][0]}"
+                async with zip_lock:
+                    await asyncio.to_thread(zf.writestr, name, result)
+                return {"file": upload.filename, "status": "enhanced", "output": name}
+            except Exception as e:
+                return {"file": upload.filename, "status": "failed", "error": str(e)}
+            finally:
+                await upload.close()
+
+    try:
+        report = await asyncio.gather(*(run(i, f) for i, f in enumerate(image_files)))
+        await asyncio.to_thread(zf.writestr, "report.json", json.dumps(report, indent=2))
+    except BaseException:
+        zf.close()
+        _remove_quietly(zip_path)
+        raise
+    await asyncio.to_thread(zf.close)
+
+    if not any(r["status"] == "enhanced" for r in report):
+        _remove_quietly(zip_path)
+        raise HTTPException(status_code=400, detail=f"No images could be enhanced: {report[0]['error'] if report else ''}")
+
+    return FileResponse(
+        zip_path, filename="enhanced_images.zip", media_type="application/zip",
+        background=BackgroundTask(_remove_quietly, zip_path)
+    )
+
 class TTSRequest(BaseModel):
     text: str
     language: str = "en"
@@ -214,30 +656,34 @@ class TTSRequest(BaseModel):
     pitch: float = 1.0
 
 @app.post("/text-to-speech")
-async def text_to_speech_endpoint(
-    request: TTSRequest,
-    background_tasks: BackgroundTasks
-):
+async def text_to_speech_endpoint(request: TTSRequest):
     try:
-        # Generate Audio
-        output_file = await generate_speech(
+        # Stream audio as it is synthesized (or straight from the speech cache)
+        audio = stream_speech(
             text=request.text,
             language=request.language,
             voice=request.voice,
             speed=request.speed,
             pitch=request.pitch
         )
-        
-        # Ensure path is absolute for FileResponse if needed, or relative is fine
-        file_path = Path(output_file)
-        
-        # Schedule cleanup
-        background_tasks.add_task(os.remove, file_path)
-        
-        return FileResponse(
-            path=file_path,
-            filename="speech.mp3",
-            media_type="audio/mpeg"
+
+        # Pull the first chunk before committing to a 200 so synthesis errors still surface as 500s
+        first_chunk = await audio.__anext__()
+
+        async def body():
+            try:
+                yield first_chunk
+                async for chunk in audio:
+                    yield chunk
+            finally:
+                # Close the generator now, not at garbage collection, so an abandoned
+                # stream releases its synthesis slot and temp file right away
+                await audio.aclose()
+
+        return StreamingResponse(
+            body(),
+            media_type="audio/mpeg",
+            headers={"Content-Disposition": 'attachment; filename="speech.mp3"'}
         )
 
     except Exception as e:
@@ -245,6 +691,69 @@ async def text_to_speech_endpoint(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+class TTSBatchRequest(BaseModel):
+    items: List[TTSRequest]
+    delivery: str = "zip" # "zip" or "manifest"
+
+@app.post("/text-to-speech/batch")
+async def text_to_speech_batch(req: TTSBatchRequest):
+    if req.delivery not in ("zip", "manifest"):
+        raise HTTPException(400, "delivery must be 'zip' or 'manifest'")
+    if not req.items:
+        raise HTTPException(400, "No items to synthesize")
+
+    job_id = await tts_batch_service.start_job(
+        items=[item.dict() for item in req.items],
+        delivery=req.delivery,
+        output_dir=str(OUTPUT_DIR)
+    )
+    return {"job_id": job_id, "status": "processing", "total": len(req.items)}
+
+@app.get("/text-to-speech/batch/{job_id}")
+async def text_to_speech_batch_status(job_id: str):
+    job = TTS_JOBS_STORE.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+
+    status = {k: v for k, v in job.items() if k not in ("items", "item_dir", "zip_path", "finished_ts")}
+    if job["status"] == "completed":
+        if job["delivery"] == "zip" and job["zip_path"]:
+            status["download_url"] = f"/text-to-speech/batch/{job_id}/download"
+        elif job["delivery"] == "manifest":
+            status["manifest"] = [
+                {**item, "url": f"/text-to-speech/batch/{job_id}/items/{item['index']}"}
+                if item["status"] == "completed" else item
+                for item in job["items"]
+            ]
+    return status
+
+@app.get("/text-to-speech/batch/{job_id}/download")
+async def text_to_speech_batch_download(job_id: str):
+    job = TTS_JOBS_STORE.get(job_id)
+    if not job or not job.get("zip_path"):
+        raise HTTPException(404, "Archive not found. Job might still be processing.")
+    return FileResponse(job["zip_path"], filename="speech_batch.zip", media_type="application/zip")
+
+@app.get("/text-to-speech/batch/{job_id}/items/{index}")
+async def text_to_speech_batch_item(job_id: str, index: int):
+    path = tts_batch_service.item_path(job_id, index)
+    if not path:
+        raise HTTPException(404, "Item not found, failed, or job expired")
+    return FileResponse(path, filename=path.name, media_type="audio/mpeg")
+
+@app.get("/text-to-speech/audio/{key}")
+async def text_to_speech_cached_audio(key: str):
+    if not key.isalnum():
+        raise HTTPException(400, "Invalid key")
+    cached = speech_cache.open(key)
+    if not cached:
+        raise HTTPException(404, "Audio not found or evicted")
+    return StreamingResponse(
+        read_file_chunks(cached),
+        media_type="audio/mpeg",
+        headers={"Content-Disposition": f'attachment; filename="{key}.mp3"'}
+    )
+
 # --- Bulk Notification Endpoints ---
 
 @app.post("/bulk/upload")
@@ -252,28 +761,40 @@ async def bulk_upload_csv(file: UploadFile = File(...)):
     if not file.filename.endswith(('.csv', '.xlsx')):
         raise HTTPException(400, "Invalid format. Use CSV or Excel.")
     
-    content = await file.read()
+    # Spool to disk and parse in chunks; the list stays server-side as a recipient set
+    upload_path = UPLOAD_DIR / f"recipients_{uuid.uuid4()}{Path(file.filename).suffix}"
     try:
-        data = await notification_service.parse_csv(content)
-        # Return a preview (first 5) and total count
+        await asyncio.to_thread(_spool_upload, file, upload_path)
+        recipient_set = await notification_service.ingest_recipients(str(upload_path), file.filename)
         return {
-            "total": len(data),
-            "preview": data[:5],
-            "file_id": str(uuid.uuid4()), # Placeholder
-            "recipients": data 
+            "total": recipient_set["total"],
+            "invalid": recipient_set["invalid"],
+            "duplicates": recipient_set["duplicates"],
+            "columns": recipient_set["columns"],
+            "preview": recipient_set["preview"],
+            "recipient_set_id": recipient_set["id"],
+            "file_id": recipient_set["id"]
         }
     except ValueError as Ve:
         raise HTTPException(400, str(Ve))
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
 
 class BulkSendRequest(BaseModel):
-    recipients: List[dict]
+    recipients: Optional[List[dict]] = None
+    recipient_set_id: Optional[str] = None # From /bulk/upload; preferred over inline recipients
     channel: str # "email", "whatsapp", "both"
-    template: str
+    template: str # Plain text; any recipient column as {{column}} or {{column|fallback}}
+    html_template: Optional[str] = None # Optional HTML alternative, same placeholders
     subject: Optional[str] = None
     smtp_host: Optional[str] = None
     smtp_port: Optional[int] = 587
     smtp_user: Optional[str] = None
     smtp_pass: Optional[str] = None
+    smtp_use_tls: bool = True
+    concurrency: Optional[int] = None        # Parallel SMTP connections (default SMTP_CONCURRENCY)
+    rate_per_second: Optional[float] = None  # Overall send rate (default SEND_RATE_PER_SECOND)
 
 @app.post("/bulk/send")
 async def bulk_send_notifications(req: BulkSendRequest):
@@ -281,55 +802,113 @@ async def bulk_send_notifications(req: BulkSendRequest):
         'smtp_host': req.smtp_host,
         'smtp_port': req.smtp_port,
         'smtp_user': req.smtp_user,
-        'smtp_pass': req.smtp_pass
+        'smtp_pass': req.smtp_pass,
+        'smtp_use_tls': req.smtp_use_tls
     }
     
-    job_id = await notification_service.start_job(
-        recipients=req.recipients,
-        channel=req.channel,
-        template=req.template,
-        subject=req.subject,
-        credentials=credentials
-    )
+    if not req.recipient_set_id and not req.recipients:
+        raise HTTPException(400, "Provide recipient_set_id or recipients")
+
+    try:
+        job_id = await notification_service.start_job(
+            recipients=req.recipients,
+            recipient_set_id=req.recipient_set_id,
+            channel=req.channel,
+            template=req.template,
+            subject=req.subject,
+            credentials=credentials,
+            concurrency=req.concurrency,
+            rate_per_second=req.rate_per_second,
+            html_template=req.html_template
+        )
+    except ValueError as ve:
+        # An unknown recipient set is a 404; unusable inline recipients are a bad request
+        raise HTTPException(404 if req.recipient_set_id else 400, str(ve))
     return {"job_id": job_id, "status": "processing"}
 
 @app.get("/bulk/status/{job_id}")
-async def get_bulk_status(job_id: str):
-    job = JOBS_STORE.get(job_id)
+async def get_bulk_status(job_id: str, logs_offset: Optional[int] = None, logs_limit: int = 50):
+    # Without logs_offset, the latest `logs_limit` log lines are returned
+    job = await asyncio.to_thread(
+        job_store.get_job, job_id, logs_offset=logs_offset, logs_limit=min(max(logs_limit, 1), 1000)
+    )
     if not job:
         raise HTTPException(404, "Job not found")
     return job
 
+class BulkResumeRequest(BaseModel):
+    smtp_pass: Optional[str] = None
+
+@app.post("/bulk/resume/{job_id}")
+async def resume_bulk_job(job_id: str, req: BulkResumeRequest):
+    try:
+        await notification_service.resume_job(job_id, smtp_pass=req.smtp_pass)
+    except ValueError as ve:
+        raise HTTPException(400, str(ve))
+    return {"job_id": job_id, "status": "processing"}
+
 # --- Audio to Text Endpoint ---
 
 @app.post("/audio-to-text")
 async def audio_to_text_endpoint(
     audio_file: UploadFile = File(...),
     model_size: str = Form("base"), # tiny, base, small, medium, large
-    language: Optional[str] = Form(None)
+    language: Optional[str] = Form(None),
+    wait: bool = Form(True), # False -> return a job id and poll /audio-to-text/jobs/{job_id}
+    long_audio: Optional[bool] = Form(None), # None -> auto by duration
+    output_format: str = Form("json") # json, txt, srt, vtt
 ):
     valid_exts = ('.mp3', '.wav', '.m4a', '.ogg', '.webm')
     if not audio_file.filename.lower().endswith(valid_exts):
         raise HTTPException(400, f"Invalid format. Supported: {valid_exts}")
+    if output_format not in TRANSCRIPT_FORMATS:
+        raise HTTPException(400, f"Invalid output format. Supported: {list(TRANSCRIPT_FORMATS)}")
     
     # Save temp file
     temp_filename = f"audio_{uuid.uuid4()}_{audio_file.filename}"
     temp_path = OUTPUT_DIR / temp_filename
     
     try:
-        with open(temp_path, "wb") as f:
-            content = await audio_file.read()
-            f.write(content)
-            
-        # Process (Run in thread pool to avoid blocking async loop)
-        # Whisper is CPU/GPU intensive blocking code
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None, 
-            lambda: transcribe_audio(str(temp_path), model_size, language)
-        )
-        
-        return result
+        # Identical recordings are answered from the transcript cache without queueing.
+        # The key is computed once here and handed to the job, which then skips its own lookup.
+        audio_hash = await asyncio.to_thread(_spool_upload_hashed, audio_file, temp_path)
+        cache_key = transcript_cache.key_for(audio_hash, model_size, language, transcription_mode(long_audio))
+        cached = await asyncio.to_thread(transcript_cache.get, cache_key)
+        if cached:
+            await asyncio.to_thread(_remove_quietly, temp_path)
+            if not wait:
+                job_id = transcription_scheduler.completed(cached, model_size)
+                return JSONResponse(
+                    status_code=202,
+                    content={"job_id": job_id, "status": "completed", "queue_position": 0}
+                )
+            return _transcript_response(cached, output_format)
+
+        # Whisper is CPU/GPU intensive blocking code; it runs on the dedicated,
+        # bounded transcription pool rather than the default executor.
+        try:
+            job_id = transcription_scheduler.submit(str(temp_path), model_size, language, long_audio, cache_key)
+        except QueueFullError as qe:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return JSONResponse(
+                status_code=429,
+                content={"detail": str(qe), "queued": qe.queued, "max_queue": qe.capacity},
+                headers={"Retry-After": "30"}
+            )
+
+        if not wait:
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "job_id": job_id,
+                    "status": "queued",
+                    "queue_position": transcription_scheduler.queue_position(job_id)
+                }
+            )
+
+        result = await transcription_scheduler.wait(job_id)
+        return _transcript_response(result, output_format)
 
     except Exception as e:
         import traceback
@@ -339,6 +918,99 @@ async def audio_to_text_endpoint(
             os.remove(temp_path)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/audio-to-text/stream")
+async def audio_to_text_stream_endpoint(
+    audio_file: UploadFile = File(...),
+    model_size: str = Form("base"),
+    language: Optional[str] = Form(None)
+):
+    """
+    Server-Sent Events variant of /audio-to-text: emits `segment` events with
+    progress as each window is transcribed, then a final `done` event.
+    """
+    valid_exts = ('.mp3', '.wav', '.m4a', '.ogg', '.webm')
+    if not audio_file.filename.lower().endswith(valid_exts):
+        raise HTTPException(400, f"Invalid format. Supported: {valid_exts}")
+
+    temp_path = OUTPUT_DIR / f"audio_{uuid.uuid4()}_{audio_file.filename}"
+    await asyncio.to_thread(_spool_upload, audio_file, temp_path)
+
+    events = transcription_scheduler.stream(str(temp_path), model_size, language)
+    try:
+        # Pull the first event here so a full queue still maps to a real 429
+        first = await events.__anext__()
+    except QueueFullError as qe:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return JSONResponse(
+            status_code=429,
+            content={"detail": str(qe), "queued": qe.queued, "max_queue": qe.capacity},
+            headers={"Retry-After": "30"}
+        )
+    except StopAsyncIteration:
+        first = None
+
+    async def event_source():
+        try:
+            if first is not None:
+                yield f"event: {first['type']}\ndata: {json.dumps(first, ensure_ascii=False)}\n\n"
+            async for event in events:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            # Closing the scheduler stream cancels the job when the client goes away
+            await events.aclose()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/audio-to-text/jobs/{job_id}")
+async def audio_job_status(job_id: str):
+    job = transcription_scheduler.status(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@app.get("/audio-to-text/transcripts/{cache_key}/{output_format}")
+async def cached_transcript(cache_key: str, output_format: str):
+    """Re-renders a cached transcript (see `cache_key` in results) as json, txt, srt or vtt."""
+    if output_format not in TRANSCRIPT_FORMATS:
+        raise HTTPException(400, f"Invalid output format. Supported: {list(TRANSCRIPT_FORMATS)}")
+    if not cache_key.isalnum():
+        raise HTTPException(400, "Invalid cache key")
+    result = await asyncio.to_thread(transcript_cache.get, cache_key)
+    if not result:
+        raise HTTPException(404, "Transcript not found or evicted")
+    return _transcript_response(result, output_format)
+
+TRANSCRIPT_FORMATS = {
+    "json": "application/json",
+    "txt": "text/plain; charset=utf-8",
+    "srt": "application/x-subrip",
+    "vtt": "text/vtt; charset=utf-8",
+}
+
+def _transcript_response(result: dict, output_format: str):
+    rendered = render_transcript(result, output_format)
+    if output_format == "json":
+        return rendered
+    return Response(
+        content=rendered,
+        media_type=TRANSCRIPT_FORMATS[output_format],
+        headers={"Content-Disposition": f'attachment; filename="transcript.{output_format}"'}
+    )
+
+@app.get("/audio-to-text/models")
+async def audio_models_status():
+    """Loaded Whisper models with load time and resident size, plus queue depth."""
+    return {
+        **model_manager.stats(),
+        "scheduler": transcription_scheduler.stats(),
+        "transcript_cache": transcript_cache.stats(),
+    }
+
 # --- PDF to Image Endpoint ---
 
 @app.post("/pdf-to-image")
@@ -346,12 +1018,11 @@ async def pdf_to_image_endpoint(file: UploadFile = File(...)):
     # Save Upload
     file_id = str(uuid.uuid4())
     upload_path = OUTPUT_DIR / f"upload_{file_id}_{file.filename}"
-    with open(upload_path, "wb") as buffer:
-        buffer.write(await file.read())
+    await asyncio.to_thread(_spool_upload, file, upload_path)
         
     try:
         # Convert
-        images = pdf_editor.convert_to_images(str(upload_path), str(OUTPUT_DIR))
+        images = await asyncio.to_thread(pdf_editor.convert_to_images, str(upload_path), str(OUTPUT_DIR))
         
         # Return list of image filenames
         return {"images": images}
@@ -380,14 +1051,13 @@ async def advanced_pdf_edit(
     saved_paths = []
     for f in files:
         path = OUTPUT_DIR / f"upload_{uuid.uuid4()}_{f.filename}"
-        with open(path, "wb") as buffer:
-            buffer.write(await f.read())
+        await asyncio.to_thread(_spool_upload, f, path)
         saved_paths.append(str(path))
         
-    output_filename = f"edited_{uuid.uuid4()}.pdf"
-    output_path = str(OUTPUT_DIR / output_filename)
-    
-    try:
+    def run_operation():
+        output_filename = f"edited_{uuid.uuid4()}.pdf"
+        output_path = str(OUTPUT_DIR / output_filename)
+
         # Route Operation
         if operation == "merge":
             pdf_editor.merge_pdfs(saved_paths, output_path)
@@ -438,6 +1108,11 @@ async def advanced_pdf_edit(
         else:
             raise HTTPException(400, "Unknown Operation")
 
+        return output_path, output_filename
+
+    try:
+        # PDF work runs in a thread so the event loop stays free
+        output_path, output_filename = await asyncio.to_thread(run_operation)
         return FileResponse(output_path, filename=output_filename)
 
     except Exception as e:
@@ -1,140 +1,466 @@
+import os
+import re
+import time
 import asyncio
 import pandas as pd
 import uuid
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from collections import deque
+from openpyxl import load_workbook
 from datetime import datetime
 
-# In-memory store for jobs
-# Structure: { job_id: { status: 'processing', progress: 0, total: 0, logs: [], report: [] } }
-JOBS_STORE = {}
+from job_store import job_store
+from template_engine import MessageSkeleton, encode_address
+from metrics import stage
+
+SMTP_CONCURRENCY = int(os.environ.get("SMTP_CONCURRENCY", "5"))
+SEND_RATE_PER_SECOND = float(os.environ.get("SEND_RATE_PER_SECOND", "5"))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+# WhatsApp Web automation is rate-limited separately and much more gently than email
+WHATSAPP_SEND_INTERVAL_SECONDS = float(os.environ.get("WHATSAPP_SEND_INTERVAL_SECONDS", "5"))
+# Restarting a WhatsApp job on boot opens browser tabs on the server unattended,
+# so by default such jobs wait as 'interrupted' for /bulk/resume
+RESUME_WHATSAPP_ON_STARTUP = os.environ.get("RESUME_WHATSAPP_ON_STARTUP", "0") == "1"
+# Delivery results are written to the job store in batches, off the event loop.
+# A crash loses at most one unflushed batch; those recipients are re-sent on resume.
+RESULT_BATCH_ROWS = int(os.environ.get("RESULT_BATCH_ROWS", "100"))
+RESULT_BATCH_SECONDS = float(os.environ.get("RESULT_BATCH_SECONDS", "1"))
+
+
+def _has_smtp(creds) -> bool:
+    # Without an SMTP user the job runs in simulation mode (the frontend always
+    # sends a default smtp_host, so the host alone doesn't mean "really send")
+    return bool(creds and creds.get('smtp_user'))
+
+def _needs_password(channel, creds) -> bool:
+    return bool('email' in (channel or '') and creds and creds.get('smtp_user'))
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class SMTPConnectionPool:
+    """
+    Up to `size` persistent, authenticated smtplib connections. smtplib is
+    blocking, so connecting and sending run in worker threads; a connection is
+    only ever used by one send at a time and is recycled after
+    SMTP_MAX_MESSAGES_PER_CONNECTION messages or on disconnect.
+    """
+
+    def __init__(self, host, port, user=None, password=None, size=5, use_tls=True, timeout=30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._idle = asyncio.Queue()
+        self._slots = asyncio.Semaphore(size)
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.user:
+            server.login(self.user, self.password)
+        server.sent_count = 0
+        return server
+
+    async def send(self, from_addr, to_addr, message):
+        async with self._slots:
+            server = self._idle.get_nowait() if not self._idle.empty() else None
+            try:
+                if server is None:
+                    server = await asyncio.to_thread(self._connect)
+                try:
+                    await asyncio.to_thread(server.sendmail, from_addr, [to_addr], message)
+                except smtplib.SMTPServerDisconnected:
+                    # Idle connections get dropped by servers; reconnect once
+                    server = await asyncio.to_thread(self._connect)
+                    await asyncio.to_thread(server.sendmail, from_addr, [to_addr], message)
+                server.sent_count += 1
+            except Exception:
+                if server is not None:
+                    await asyncio.to_thread(_quit_quietly, server)
+                raise
+
+            if server.sent_count >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+                await asyncio.to_thread(_quit_quietly, server)
+            else:
+                self._idle.put_nowait(server)
+
+    async def close(self):
+        while not self._idle.empty():
+            await asyncio.to_thread(_quit_quietly, self._idle.get_nowait())
+
+def _quit_quietly(server):
+    try:
+        server.quit()
+    except Exception:
+        pass
+
+# ── Recipient ingestion ──────────────────────────────────────────────────────
+
+RECIPIENT_CHUNK_ROWS = int(os.environ.get("RECIPIENT_CHUNK_ROWS", "10000"))
+# Pending recipients are read back from the job store this many at a time while sending
+RECIPIENT_PAGE_ROWS = int(os.environ.get("RECIPIENT_PAGE_ROWS", "500"))
+
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+def _iter_recipient_chunks(file_path, filename):
+    """Yields (columns, rows) in chunks of RECIPIENT_CHUNK_ROWS without loading the whole file."""
+    if filename.lower().endswith('.xlsx'):
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows_iter = wb.active.iter_rows(values_only=True)
+            header = next(rows_iter, None)
+            if header is None:
+                return
+            columns = [str(c).lower().strip() if c is not None else f"column_{i}" for i, c in enumerate(header)]
+            chunk = []
+            for values in rows_iter:
+                chunk.append({col: _cell_to_str(v) for col, v in zip(columns, values)})
+                if len(chunk) >= RECIPIENT_CHUNK_ROWS:
+                    yield columns, chunk
+                    chunk = []
+            if chunk:
+                yield columns, chunk
+        finally:
+            wb.close()
+    else:
+        # dtype=str keeps phone numbers from turning into floats
+        for df in pd.read_csv(file_path, chunksize=RECIPIENT_CHUNK_ROWS, dtype=str, keep_default_na=False):
+            # Normalize column names
+            df.columns = [c.lower().strip() for c in df.columns]
+            yield list(df.columns), df.to_dict(orient='records')
+
+def _cell_to_str(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _clean_recipient(row):
+    """Trims fields and checks the row has a usable email or phone. Returns None if invalid."""
+    row = {k: (v.strip() if isinstance(v, str) else v) for k, v in row.items()}
+    email = row.get('email', '')
+    phone = row.get('phone', '')
+    if email and not _EMAIL_RE.match(email):
+        if not phone:
+            return None
+        row['email'] = ''
+    if not row.get('email') and not phone:
+        return None
+    return row
+
+def _clean_recipients(rows, seen):
+    """
+    Validates and de-duplicates rows against `seen` (updated in place).
+    Returns (valid rows, invalid count, duplicate count).
+    """
+    valid = []
+    invalid = duplicates = 0
+    for row in rows:
+        row = _clean_recipient(row)
+        if row is None:
+            invalid += 1
+            continue
+        key = (row.get('email', '').lower(), row.get('phone', ''))
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        valid.append(row)
+    return valid, invalid, duplicates
+
+class RecipientPager:
+    """
+    Hands out a job's pending (idx, recipient) pairs in order, reading them
+    from the job store RECIPIENT_PAGE_ROWS at a time, so a large campaign
+    never sits in memory as a whole.
+    """
+
+    def __init__(self, job_id, page_rows=RECIPIENT_PAGE_ROWS):
+        self.job_id = job_id
+        self.page_rows = page_rows
+        self._page = deque()
+        self._after = -1
+        self._exhausted = False
+        self._lock = asyncio.Lock()
+
+    async def next(self):
+        """The next pending recipient, or None once all have been handed out."""
+        async with self._lock:
+            if not self._page and not self._exhausted:
+                rows = await asyncio.to_thread(
+                    job_store.pending_recipients, self.job_id, self._after, self.page_rows
+                )
+                self._exhausted = len(rows) < self.page_rows
+                if rows:
+                    self._after = rows[-1][0]
+                self._page.extend(rows)
+            return self._page.popleft() if self._page else None
+
+class ResultBatcher:
+    """
+    Collects per-recipient results and records them with one job-store
+    transaction per RESULT_BATCH_ROWS results (or RESULT_BATCH_SECONDS),
+    in a worker thread rather than a synchronous commit per send on the loop.
+    """
+
+    def __init__(self, job_id, max_rows=RESULT_BATCH_ROWS, max_delay=RESULT_BATCH_SECONDS):
+        self.job_id = job_id
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._pending = []
+        self._oldest = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, idx, success: bool, messages, error: str = None):
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending.append((idx, success, messages, error))
+        if len(self._pending) >= self.max_rows or time.monotonic() - self._oldest >= self.max_delay:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            if batch:
+                await asyncio.to_thread(job_store.record_results, self.job_id, batch)
 
 class NotificationService:
     def __init__(self):
-        self.email_queue = asyncio.Queue()
-        self.is_worker_running = False
+        self._running = set()  # job ids with a live worker task in this process
+        self._tasks = set()
 
-    async def parse_csv(self, file_bytes: bytes):
+    def stats(self) -> dict:
+        return {"running_jobs": len(self._running)}
+
+    async def ingest_recipients(self, file_path: str, filename: str) -> dict:
         """
-        Parses CSV/Excel bytes and returns a list of recipient dicts.
-        Expected columns: name, email, phone, (any other custom vars)
+        Streams a CSV/Excel file from disk into a server-side recipient set,
+        validating and de-duplicating rows on the way. Returns the set summary.
         """
+        return await asyncio.to_thread(self._ingest_recipients_sync, file_path, filename)
+
+    def _ingest_recipients_sync(self, file_path, filename):
+        set_id = str(uuid.uuid4())
+        job_store.create_recipient_set(set_id, filename)
+        seen = set()
+        total = invalid = duplicates = 0
+        columns = []
         try:
-            # Try reading as CSV first, if fail, try Excel
-            try:
-                df = pd.read_csv(pd.io.common.BytesIO(file_bytes))
-            except:
-                df = pd.read_excel(pd.io.common.BytesIO(file_bytes))
-            
-            # Normalize column names
-            df.columns = [c.lower().strip() for c in df.columns]
-            return df.to_dict(orient='records')
+            for chunk_columns, rows in _iter_recipient_chunks(file_path, filename):
+                columns = chunk_columns
+                batch, chunk_invalid, chunk_duplicates = _clean_recipients(rows, seen)
+                invalid += chunk_invalid
+                duplicates += chunk_duplicates
+                job_store.add_recipient_rows(set_id, total, batch)
+                total += len(batch)
         except Exception as e:
+            job_store.delete_recipient_set(set_id)
             raise ValueError(f"Failed to parse file: {str(e)}")
 
-    async def start_job(self, recipients, channel, template, subject, credentials):
+        job_store.finish_recipient_set(set_id, columns, total, invalid, duplicates)
+        return job_store.get_recipient_set(set_id)
+
+    async def start_job(self, recipients, channel, template, subject, credentials, concurrency=None,
+                        rate_per_second=None, recipient_set_id=None, html_template=None):
         """
-        Starts a background job to process the list sequentially.
+        Starts a background job that delivers to all recipients (or a stored
+        recipient set) with bounded concurrency and a token-bucket rate limit.
+        Progress is persisted in the job store so the job can resume after a restart.
+        Inline recipients are validated and de-duplicated like uploaded rows.
         """
         job_id = str(uuid.uuid4())
-        JOBS_STORE[job_id] = {
-            'id': job_id,
-            'status': 'processing',
-            'progress': 0,
-            'total': len(recipients),
-            'started_at': datetime.now().isoformat(),
-            'logs': [],
-        }
-
-        # Start the worker task
-        asyncio.create_task(self._process_queue_sequentially(job_id, recipients, channel, template, subject, credentials))
+        if recipients and not recipient_set_id:
+            # Template placeholders match lower-cased column names, as uploaded sets do
+            rows = [{str(k).lower().strip(): _cell_to_str(v) for k, v in r.items()} for r in recipients]
+            recipients, invalid, duplicates = _clean_recipients(rows, set())
+            if not recipients:
+                raise ValueError(f"No valid recipients ({invalid} invalid, {duplicates} duplicates)")
+        # Copying a large set (or inserting many inline rows) is a long SQLite
+        # transaction; keep it off the event loop
+        if recipient_set_id:
+            await asyncio.to_thread(
+                job_store.create_job_from_set,
+                job_id, recipient_set_id, channel, template, subject, credentials,
+                concurrency=concurrency, rate_per_second=rate_per_second, html_template=html_template
+            )
+        else:
+            await asyncio.to_thread(
+                job_store.create_job,
+                job_id, recipients, channel, template, subject, credentials,
+                concurrency=concurrency, rate_per_second=rate_per_second, html_template=html_template
+            )
+        await self._launch(job_id, credentials)
         return job_id
 
-    async def _process_queue_sequentially(self, job_id, recipients, channel, template, subject, credentials):
+    async def resume_job(self, job_id, smtp_pass=None):
+        """Continues a job from its first undelivered recipient."""
+        config = await asyncio.to_thread(job_store.job_config, job_id)
+        if not config:
+            raise ValueError("Job not found")
+        if config['status'] == 'completed':
+            raise ValueError("Job already completed")
+        if job_id in self._running:
+            raise ValueError("Job is already running")
+
+        credentials = dict(config['credentials'])
+        if _needs_password(config['channel'], credentials) and not smtp_pass:
+            raise ValueError("SMTP password required to resume this job")
+        credentials['smtp_pass'] = smtp_pass
+        # Claimed before the next await, so a second resume can't start it twice
+        self._running.add(job_id)
+        try:
+            await asyncio.to_thread(job_store.set_status, job_id, 'processing')
+            await self._launch(job_id, credentials)
+        except Exception:
+            self._running.discard(job_id)
+            raise
+
+    async def resume_unfinished(self):
         """
-        Worker that sends notifications one by one with delays.
+        Called on startup: restarts jobs cut off by a shutdown. Jobs that need an
+        SMTP password (never persisted), and WhatsApp jobs unless
+        RESUME_WHATSAPP_ON_STARTUP=1, wait as 'interrupted' for /bulk/resume.
         """
-        job = JOBS_STORE[job_id]
-        success_count = 0
-        fail_count = 0
-
-        for index, recipient in enumerate(recipients):
-            # 1. Update Progress
-            job['progress'] = int(((index) / job['total']) * 100)
-            
-            # 2. Extract Data
-            name = recipient.get('name', 'Friend')
-            email = recipient.get('email', '')
-            phone = recipient.get('phone', '')
-
-            # 3. Process Logic
-            try:
-                if 'email' in channel and email:
-                    await self._send_email_single(email, name, template, subject, credentials)
-                    job['logs'].append(f"✅ Email sent to {email}")
-                
-                if 'whatsapp' in channel and phone:
-                    await self._send_whatsapp_smart(phone, name, template)
-                    job['logs'].append(f"✅ WhatsApp queued for {phone}")
-
-                success_count += 1
-            except Exception as e:
-                fail_count += 1
-                job['logs'].append(f"❌ Failed for {name}: {str(e)}")
+        for job_id in await asyncio.to_thread(job_store.unfinished_jobs):
+            config = await asyncio.to_thread(job_store.job_config, job_id)
+            if _needs_password(config['channel'], config['credentials']):
+                await asyncio.to_thread(job_store.set_status, job_id, 'interrupted')
+            elif 'whatsapp' in (config['channel'] or '') and not RESUME_WHATSAPP_ON_STARTUP:
+                await asyncio.to_thread(job_store.set_status, job_id, 'interrupted')
+            else:
+                await self._launch(job_id, config['credentials'])
 
-            # 4. Smart Delay (Rate Limiting)
-            # Sleep 5 seconds as requested for safety
-            await asyncio.sleep(5) 
-        
-        job['status'] = 'completed'
-        job['progress'] = 100
-        job['summary'] = f"Sent: {success_count}, Failed: {fail_count}"
+    async def _launch(self, job_id, credentials):
+        self._running.add(job_id)
+        try:
+            config = await asyncio.to_thread(job_store.job_config, job_id)
+        except Exception:
+            self._running.discard(job_id)
+            raise
+        # Start the worker task; keep a reference so it isn't garbage-collected mid-run
+        task = asyncio.create_task(self._process_job(
+            job_id, RecipientPager(job_id), config['channel'], config['template'],
+            config['subject'], credentials,
+            config['concurrency'] or SMTP_CONCURRENCY, config['rate_per_second'] or SEND_RATE_PER_SECOND,
+            config['html_template']
+        ))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
-    async def _send_email_single(self, to_email, name, template_body, subject, creds):
+    async def _process_job(self, job_id, recipients, channel, template, subject, credentials, concurrency,
+                           rate_per_second, html_template=None):
         """
-        Real SMTP sender.
+        Delivers notifications with `concurrency` workers sharing a pool of
+        persistent SMTP connections. A token bucket caps the overall send rate.
+        recipients: RecipientPager over the recipients still pending for this job.
+        """
+        bucket = TokenBucket(rate_per_second, capacity=max(1, concurrency))
+        pool = None
+        if 'email' in channel and _has_smtp(credentials):
+            pool = SMTPConnectionPool(
+                host=credentials.get('smtp_host') or 'smtp.gmail.com',
+                port=int(credentials.get('smtp_port') or 587),
+                user=credentials.get('smtp_user'),
+                password=credentials.get('smtp_pass'),
+                size=concurrency,
+                use_tls=credentials.get('smtp_use_tls', True),
+            )
+        # Templates are compiled once per job, not re-parsed per recipient
+        from_addr = credentials.get('smtp_user') or credentials.get('smtp_from') or 'noreply@localhost'
+        skeleton = MessageSkeleton(from_addr, subject, template, html_template)
+        # WhatsApp automation drives one browser tab; never run two at once, and
+        # leave WHATSAPP_SEND_INTERVAL_SECONDS between sends
+        whatsapp_lock = asyncio.Lock()
+        whatsapp_bucket = TokenBucket(1 / max(WHATSAPP_SEND_INTERVAL_SECONDS, 0.001))
+        results = ResultBatcher(job_id)
+
+        async def worker():
+            while True:
+                item = await recipients.next()
+                if item is None:
+                    return
+                idx, recipient = item
+
+                # Extract Data
+                name = recipient.get('name', 'Friend')
+                email = recipient.get('email', '')
+                phone = recipient.get('phone', '')
+
+                await bucket.acquire()
+                logs = []
+                try:
+                    if 'email' in channel and email:
+                        await self._send_email(pool, skeleton, email, recipient)
+                        logs.append(f"✅ Email sent to {email}")
+
+                    if 'whatsapp' in channel and phone:
+                        async with whatsapp_lock:
+                            await whatsapp_bucket.acquire()
+                            await self._send_whatsapp_smart(phone, skeleton.text.render(recipient))
+                        logs.append(f"✅ WhatsApp queued for {phone}")
+
+                    success, error = True, None
+                except Exception as e:
+                    logs.append(f"❌ Failed for {name}: {str(e)}")
+                    success, error = False, str(e)
+                await results.add(idx, success, logs, error)
+
+        try:
+            try:
+                await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+            finally:
+                # Whatever was delivered is recorded, even if the job dies midway
+                await results.flush()
+            await asyncio.to_thread(job_store.finish_job, job_id)
+        finally:
+            self._running.discard(job_id)
+            if pool:
+                await pool.close()
+
+    async def _send_email(self, pool, skeleton, to_email, recipient):
+        """
+        Renders the per-recipient fields into the job's message skeleton and
+        sends it over a pooled SMTP connection.
         """
         # If no credentials provided, simulate success
-        if not creds or not creds.get('smtp_user'):
+        if pool is None:
             print(f"[SIMULATION MODE] No SMTP credentials provided. Would send email to {to_email}")
             return
 
-        smtp_server = creds.get('smtp_host', 'smtp.gmail.com')
-        smtp_port = int(creds.get('smtp_port', 587))
-        smtp_user = creds.get('smtp_user')
-        smtp_pass = creds.get('smtp_pass')
-
-        # Create msg
-        msg = MIMEMultipart()
-        msg['From'] = smtp_user
-        msg['To'] = to_email
-        msg['Subject'] = subject or "Notification"
-
-        # Personalize
-        body = template_body.replace('{{name}}', str(name))
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Send
-        # Note: synchronus smtplib calls in an async loop block the loop strictly speaking,
-        # but for this heavy "one-by-one" logical task, it serves the "queue" purpose well.
-        # Ideally run_in_executor, but simple is fine here.
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_pass)
-        server.send_message(msg)
-        server.quit()
+        message = skeleton.render(to_email, recipient)
+        with stage("smtp_send"):
+            await pool.send(skeleton.from_addr, encode_address(to_email), message)
 
-    async def _send_whatsapp_smart(self, phone, name, template):
+    async def _send_whatsapp_smart(self, phone, msg):
         """
         Smart Automation for WhatsApp using pywhatkit.
-        Opens web.whatsapp.com and types the message.
+        Opens web.whatsapp.com and types the (already personalized) message.
         """
         import pywhatkit
         
-        # Personalize
-        msg = template.replace('{{name}}', str(name))
-        
         # Format phone: ensure it has country code (e.g., +91)
         if not phone.startswith('+'):
             if len(phone) == 10:
@@ -6,8 +6,13 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from typing import List, Union
 
+from metrics import stage
+from loop_guard import blocking
+
 class PDFEditor:
     
+    @stage("pdf_merge")
+    @blocking
     def merge_pdfs(self, file_paths: List[str], output_path: str):
         """Merges multiple PDFs into one."""
         doc = fitz.open()
@@ -17,6 +22,8 @@ class PDFEditor:
         doc.save(output_path)
         doc.close()
 
+    @stage("pdf_split")
+    @blocking
     def split_pdf(self, file_path: str, output_dir: str, mode: str = "all", ranges: str = None):
         """
         Splits PDF.
@@ -58,6 +65,8 @@ class PDFEditor:
         doc.close()
         return result_paths
 
+    @stage("pdf_rotate")
+    @blocking
     def rotate_pdf(self, file_path: str, output_path: str, rotation: int, page_indices: List[int] = None):
         """Rotates pages by 90, 180, 270 degrees."""
         doc = fitz.open(file_path)
@@ -67,12 +76,16 @@ class PDFEditor:
         doc.save(output_path)
         doc.close()
 
+    @stage("pdf_compress")
+    @blocking
     def compress_pdf(self, file_path: str, output_path: str):
         """Compresses PDF by garbage collection and deflating streams."""
         doc = fitz.open(file_path)
         doc.save(output_path, garbage=4, deflate=True)
         doc.close()
 
+    @stage("pdf_protect")
+    @blocking
     def protect_pdf(self, file_path: str, output_path: str, password: str):
         """Encrypts PDF with a password using pikepdf."""
         with pikepdf.Pdf.open(file_path) as pdf:
@@ -83,6 +96,8 @@ class PDFEditor:
                 )
             )
 
+    @stage("pdf_unlock")
+    @blocking
     def unlock_pdf(self, file_path: str, output_path: str, password: str):
         """Removes password from a PDF."""
         try:
@@ -92,6 +107,8 @@ class PDFEditor:
         except pikepdf.PasswordError:
             return False
 
+    @stage("pdf_watermark")
+    @blocking
     def add_watermark(self, file_path: str, output_path: str, text: str):
         """Adds a simple text watermark to all pages."""
         # Create watermark canvas
@@ -114,6 +131,8 @@ class PDFEditor:
         doc.save(output_path)
         doc.close()
 
+    @stage("render")
+    @blocking
     def convert_to_images(self, file_path: str, output_dir: str) -> List[str]:
         """Converts PDF pages to images (PNG)."""
         doc = fitz.open(file_path)
@@ -1,5 +1,7 @@
 import os
+import re
 import json
+import time
 import logging
 from pathlib import Path
 import pandas as pd
@@ -8,8 +10,15 @@ import pytesseract
 import cv2
 import numpy as np
 from docx import Document
+from docx.enum.text import WD_BREAK
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from xml.sax.saxutils import escape
 from pdf2image import convert_from_path
 
+from metrics import stage, observe_stage
+from loop_guard import blocking
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -72,6 +81,7 @@ if _poppler_path_arg is None:
             "Install from https://github.com/oschwartz10612/poppler-windows/releases/"
         )
 
+@blocking
 def process_document(file_path: str, output_dir: str, file_id: str):
     """
     Main processing pipeline.
@@ -115,24 +125,32 @@ def process_document(file_path: str, output_dir: str, file_id: str):
 def _process_pdf(file_path):
     text_content = []
     tables_content = []
+    # Text and tables are extracted page by page; time each across the document
+    text_seconds = table_seconds = 0.0
     
     # Text Extraction
     with pdfplumber.open(file_path) as pdf:
         for page in pdf.pages:
             # Extract Text
+            started = time.perf_counter()
             text = page.extract_text()
+            text_seconds += time.perf_counter() - started
             if text:
                 text_content.append(text)
             
             # Simple Table Extraction (pdfplumber)
             # For more advanced tables, we'd use Camelot, but it creates dependency hell on Windows often.
             # Using pdfplumber's native table extraction for stability.
+            started = time.perf_counter()
             tables = page.extract_tables()
+            table_seconds += time.perf_counter() - started
             for table in tables:
                 # Clean table: remove Nones
                 clean_table = [[cell if cell is not None else "" for cell in row] for row in table]
                 tables_content.append(clean_table)
 
+    observe_stage("text_extraction", text_seconds)
+    observe_stage("table_extraction", table_seconds)
     full_text = "\n".join(text_content)
     
     # If text is empty, it might be a scanned PDF -> OCR
@@ -154,15 +172,17 @@ def _ocr_pdf_images(file_path):
         if _poppler_path_arg:
             convert_kwargs["poppler_path"] = _poppler_path_arg
 
-        images = convert_from_path(file_path, **convert_kwargs)
+        with stage("rasterize"):
+            images = convert_from_path(file_path, **convert_kwargs)
         text_content = []
         
-        for img in images:
-            # Convert PIL to CV2
-            open_cv_image = np.array(img) 
-            # OCR
-            text = pytesseract.image_to_string(open_cv_image, lang='eng+hin')
-            text_content.append(text)
+        with stage("ocr"):
+            for img in images:
+                # Convert PIL to CV2
+                open_cv_image = np.array(img) 
+                # OCR
+                text = pytesseract.image_to_string(open_cv_image, lang='eng+hin')
+                text_content.append(text)
             
         return "\n".join(text_content), []
     except Exception as e:
@@ -194,7 +214,8 @@ def _process_image(file_path):
             )
 
         # OCR
-        text = pytesseract.image_to_string(gray, lang='eng+hin')
+        with stage("ocr"):
+            text = pytesseract.image_to_string(gray, lang='eng+hin')
         logger.info(f"OCR extracted {len(text)} characters.")
         
     except Exception as e:
@@ -212,10 +233,18 @@ def _save_outputs(data, output_dir, file_id):
     
     # 1. JSON
     json_path = out_path / f"{file_id}_result.json"
-    with open(json_path, "w", encoding="utf-8") as f:
+    with stage("export_json"), open(json_path, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
         
     # 2. Excel (Tables)
+    with stage("export_xlsx"):
+        _save_xlsx(data, out_path, file_id)
+
+    # 3. Word (Text)
+    with stage("export_docx"):
+        _save_docx(data, out_path, file_id)
+
+def _save_xlsx(data, out_path, file_id):
     if data["tables"]:
         xlsx_path = out_path / f"{file_id}_result.xlsx"
         with pd.ExcelWriter(xlsx_path, engine='openpyxl') as writer:
@@ -229,22 +258,129 @@ def _save_outputs(data, output_dir, file_id):
         df = pd.DataFrame({"Content": [data["text"]]})
         df.to_excel(xlsx_path, index=False)
 
-    # 3. Word (Text)
+def _save_docx(data, out_path, file_id):
     docx_path = out_path / f"{file_id}_result.docx"
     doc = Document()
     doc.add_heading('Extracted Content', 0)
-    doc.add_paragraph(data["text"])
+    _add_text_chunks(doc, data["text"])
     
     if data["tables"]:
         doc.add_heading('Extracted Tables', level=1)
-        for table_data in data["tables"]:
-            table = doc.add_table(rows=len(table_data), cols=len(table_data[0]) if table_data else 0)
-            table.style = 'Table Grid'
-            for i, row in enumerate(table_data):
-                row_cells = table.rows[i].cells
-                for j, cell_content in enumerate(row):
-                    if j < len(row_cells):
-                        row_cells[j].text = str(cell_content)
-            doc.add_paragraph("\n")
+        cell_budget = DOCX_MAX_TABLE_CELLS
+        for i, table_data in enumerate(data["tables"]):
+            if cell_budget <= 0:
+                doc.add_paragraph(
+                    f"{len(data['tables']) - i} more table(s) omitted — see the XLSX export for the full data."
+                )
+                break
+            written = _add_bulk_table(doc, table_data, cell_budget)
+            if written:
+                # Spacer between tables; empty or omitted tables don't get one
+                doc.add_paragraph("\n")
+            cell_budget -= written
             
     doc.save(docx_path)
+
+# ── Fast DOCX helpers ─────────────────────────────────────────────────────────
+# python-docx cell access (table.rows[i].cells) re-walks the table XML on every
+# call, so filling a table cell by cell is quadratic. Instead the row XML is
+# generated as one string and parsed once, keeping export time linear in cells.
+
+DOCX_MAX_TABLE_CELLS = 200_000    # Hard cap across all tables; the rest goes to XLSX only
+DOCX_TEXT_CHUNK_CHARS = 20_000    # Split extracted text into paragraphs of at most this size
+# Put each text chunk on its own page
+DOCX_TEXT_PAGE_BREAKS = os.environ.get("DOCX_TEXT_PAGE_BREAKS", "0") == "1"
+
+_XML_INVALID_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _xml_text(value) -> str:
+    """Escapes a cell value for a <w:t> run, mapping newlines and tabs to Word breaks."""
+    text = _XML_INVALID_CHARS.sub("", "" if value is None else str(value))
+    text = escape(text)
+    text = text.replace("\t", '</w:t><w:tab/><w:t xml:space="preserve">')
+    return text.replace("\n", '</w:t><w:br/><w:t xml:space="preserve">')
+
+def _add_bulk_table(doc, table_data, max_cells: int) -> int:
+    """
+    Appends `table_data` to `doc` as a 'Table Grid' table built in one pass.
+    Rows beyond `max_cells` are dropped with a pointer to the XLSX export.
+    Returns the number of cells written (never more than `max_cells`).
+    """
+    if not table_data:
+        return 0
+
+    cols = max(len(row) for row in table_data)
+    if cols == 0:
+        return 0
+
+    max_rows = max_cells // cols
+    if max_rows == 0:
+        # Not even one row of this table fits in what is left of the budget
+        doc.add_paragraph(
+            f"Table with {len(table_data)} rows × {cols} columns omitted — "
+            "see the XLSX export for the full data."
+        )
+        return 0
+    rows = table_data[:max_rows]
+
+    table = doc.add_table(rows=0, cols=cols)
+    table.style = 'Table Grid'
+    tbl = table._tbl
+    widths = [grid_col.w.twips for grid_col in tbl.tblGrid.gridCol_lst]
+
+    cell_prefix = [
+        f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{w}"/></w:tcPr>'
+        f'<w:p><w:r><w:t xml:space="preserve">'
+        for w in widths
+    ]
+    cell_suffix = '</w:t></w:r></w:p></w:tc>'
+
+    parts = [f'<w:tbl {nsdecls("w")}>']
+    for row in rows:
+        parts.append('<w:tr>')
+        for j in range(cols):
+            value = row[j] if j < len(row) else ""
+            parts.append(cell_prefix[j])
+            parts.append(_xml_text(value))
+            parts.append(cell_suffix)
+        parts.append('</w:tr>')
+    parts.append('</w:tbl>')
+
+    for tr in list(parse_xml("".join(parts))):
+        tbl.append(tr)
+
+    if len(rows) < len(table_data):
+        doc.add_paragraph(
+            f"Table truncated after {len(rows)} of {len(table_data)} rows — "
+            "see the XLSX export for the full data."
+        )
+
+    return len(rows) * cols
+
+def _add_text_chunks(doc, text: str):
+    """
+    Adds `text` as paragraphs of at most DOCX_TEXT_CHUNK_CHARS, split on line
+    boundaries; a single line longer than that is cut into pieces.
+    """
+    text = _XML_INVALID_CHARS.sub("", text or "")
+    if len(text) <= DOCX_TEXT_CHUNK_CHARS:
+        doc.add_paragraph(text)
+        return
+
+    chunk, size = [], 0
+    chunks = []
+    for line in text.split("\n"):
+        pieces = [line[i:i + DOCX_TEXT_CHUNK_CHARS] for i in range(0, len(line), DOCX_TEXT_CHUNK_CHARS)] or [""]
+        for piece in pieces:
+            if chunk and size + len(piece) > DOCX_TEXT_CHUNK_CHARS:
+                chunks.append("\n".join(chunk))
+                chunk, size = [], 0
+            chunk.append(piece)
+            size += len(piece) + 1
+    if chunk:
+        chunks.append("\n".join(chunk))
+
+    for i, chunk_text in enumerate(chunks):
+        paragraph = doc.add_paragraph(chunk_text)
+        if DOCX_TEXT_PAGE_BREAKS and i < len(chunks) - 1:
+            paragraph.add_run().add_break(WD_BREAK.PAGE)
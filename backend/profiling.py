@@ -0,0 +1,251 @@
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import uuid
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+# ── Slow-request profiling ───────────────────────────────────────────────────
+# A sampling profiler that can stay on in production. While a profiled request
+# is in flight, one background thread snapshots every thread's Python stack
+# (sys._current_frames) each PROFILE_SAMPLE_INTERVAL_MS and folds the samples
+# straight into that request's stack counts, so memory tracks the number of
+# distinct stacks rather than the request's length. When the request ends, its
+# profile is saved if it was slower than PROFILE_SLOW_SECONDS, or if the client
+# asked for it with `X-Profile: 1` (only honoured when PROFILING_ENABLED=1).
+#
+# In threshold mode a request is only sampled once it has been running for
+# PROFILE_START_DELAY_SECONDS (default: half the threshold), so the sampler
+# stays idle while requests are fast; a slow request's profile covers
+# everything after that delay. Forced requests are sampled from the start.
+#
+# Profiles are written as folded stacks ("thread;outer;...;inner count"),
+# which flamegraph.pl and speedscope read directly, plus a JSON summary, under
+# a profile id (request id plus a random suffix, so a client-chosen
+# X-Request-ID can't overwrite another profile). Samples cover all threads
+# during the request, so work from concurrent requests shows up too; the
+# summary lists how many requests overlapped.
+#
+# /debug/profiles is only served with PROFILING_ENABLED=1, and additionally
+# requires an `X-Debug-Token` header when PROFILE_ACCESS_TOKEN is set.
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PROFILE_SLOW_SECONDS = float(os.environ.get("PROFILE_SLOW_SECONDS", "0"))  # 0 disables
+PROFILE_START_DELAY_SECONDS = float(os.environ.get("PROFILE_START_DELAY_SECONDS", str(PROFILE_SLOW_SECONDS / 2)))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", "profiles"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "200"))
+PROFILE_ACCESS_TOKEN = os.environ.get("PROFILE_ACCESS_TOKEN", "")
+
+# Leaf frames where a thread is parked rather than working; left out of the summary
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py", "thread.py")
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9_.\-]{1,64}$")
+_PROFILE_ID_RE = re.compile(r"^[A-Za-z0-9_.\-]{1,80}$")
+
+def request_id_from(header_value: str = None) -> str:
+    """Uses the client's X-Request-ID when it's a plain token, else a new one."""
+    if header_value and _REQUEST_ID_RE.match(header_value):
+        return header_value
+    return uuid.uuid4().hex
+
+class Capture:
+    """One request's sampling window and folded stack counts."""
+
+    def __init__(self, forced: bool, start_delay: float):
+        self.forced = forced
+        self.started = time.perf_counter()
+        self.sample_from = self.started if forced else self.started + start_delay
+        self.ended = None
+        self.overlapping = 0
+        self.folded = Counter()  # folded stack -> samples
+
+class StackSampler:
+    """Samples all thread stacks into every registered capture that is due."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._labels = {}  # code object -> frame label, so samples share strings
+        self._captures = set()
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def add(self, capture: Capture):
+        with self._cond:
+            self._captures.add(capture)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="stack-sampler", daemon=True)
+                self._thread.start()
+            else:
+                self._cond.notify()
+
+    def remove(self, capture: Capture):
+        with self._cond:
+            self._captures.discard(capture)
+            self._cond.notify()
+
+    def _loop(self):
+        own = threading.get_ident()
+        while True:
+            with self._cond:
+                while True:
+                    if not self._captures:
+                        self._thread = None
+                        return
+                    now = time.perf_counter()
+                    due = [c for c in self._captures if c.sample_from <= now]
+                    if due:
+                        break
+                    # Nothing has run long enough yet: sleep until the first capture is due
+                    self._cond.wait(min(c.sample_from for c in self._captures) - now)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = [
+                ";".join((names.get(ident, str(ident)),) + self._stack(frame))
+                for ident, frame in sys._current_frames().items() if ident != own
+            ]
+            with self._cond:
+                for capture in due:
+                    if capture in self._captures:
+                        capture.folded.update(stacks)
+            time.sleep(self.interval)
+
+    def _stack(self, frame) -> tuple:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            labels.append(label)
+            frame = frame.f_back
+        return tuple(reversed(labels))
+
+class RequestProfiler:
+    def __init__(self, profile_dir: Path, slow_seconds: float, header_enabled: bool,
+                 interval: float, max_files: int, start_delay: float = 0.0, access_token: str = ""):
+        self.profile_dir = profile_dir
+        self.slow_seconds = slow_seconds
+        self.header_enabled = header_enabled
+        self.max_files = max_files
+        self.start_delay = min(start_delay, slow_seconds) if slow_seconds > 0 else 0.0
+        self.access_token = access_token
+        self.sampler = StackSampler(interval)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.header_enabled or self.slow_seconds > 0
+
+    def wants(self, profile_header: str = None) -> bool:
+        """Whether to sample this request at all (forced by header, or threshold mode on)."""
+        return self.slow_seconds > 0 or (self.header_enabled and profile_header == "1")
+
+    def allows(self, token: str = None) -> bool:
+        """Whether the /debug/profiles endpoints may be served for this request."""
+        if not self.header_enabled:
+            return False
+        return not self.access_token or hmac.compare_digest(token or "", self.access_token)
+
+    def begin(self, forced: bool) -> Capture:
+        capture = Capture(forced, self.start_delay)
+        with self._lock:
+            self._in_flight += 1
+        self.sampler.add(capture)
+        return capture
+
+    def end(self, capture: Capture) -> bool:
+        """Stops sampling the request. True if its profile should be kept (see save)."""
+        capture.ended = time.perf_counter()
+        self.sampler.remove(capture)
+        with self._lock:
+            capture.overlapping = self._in_flight - 1
+            self._in_flight -= 1
+        return capture.forced or capture.ended - capture.started >= self.slow_seconds
+
+    def save(self, capture: Capture, request_id: str, meta: dict) -> dict:
+        """Writes the profile (blocking) and returns its summary."""
+        profile_id = f"{request_id}.{uuid.uuid4().hex[:8]}"
+        return self._save(profile_id, capture.folded, dict(
+            meta,
+            profile_id=profile_id,
+            request_id=request_id,
+            duration_seconds=round(capture.ended - capture.started, 4),
+            sampled_from_seconds=round(capture.sample_from - capture.started, 4),
+            forced=capture.forced,
+            overlapping_requests=capture.overlapping,
+        ))
+
+    def list_profiles(self):
+        profiles = []
+        for path in sorted(self.profile_dir.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True):
+            try:
+                summary = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            summary.pop("top_frames", None)
+            profiles.append(summary)
+        return profiles
+
+    def get_summary(self, profile_id: str):
+        path = self._path(profile_id, ".json")
+        if not path or not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def folded_path(self, profile_id: str):
+        path = self._path(profile_id, ".folded")
+        return path if path and path.exists() else None
+
+    def _path(self, profile_id: str, suffix: str):
+        if not _PROFILE_ID_RE.match(profile_id or ""):
+            return None
+        return self.profile_dir / f"{profile_id}{suffix}"
+
+    def _save(self, profile_id, folded: Counter, meta: dict):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        # Self time per frame, ignoring threads parked in waits
+        leaves = Counter()
+        for stack, count in folded.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            if not leaf.split("(")[-1].startswith(_IDLE_FILES):
+                leaves[leaf] += count
+        summary = dict(
+            meta,
+            captured_at=datetime.now().isoformat(),
+            samples=sum(folded.values()),
+            interval_ms=round(self.sampler.interval * 1000, 2),
+            top_frames=[{"frame": f, "samples": n} for f, n in leaves.most_common(25)],
+        )
+        with open(self._path(profile_id, ".folded"), "w", encoding="utf-8") as f:
+            for stack, count in folded.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(self._path(profile_id, ".json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        self._prune()
+        print(f"[PROFILE] {meta.get('method')} {meta.get('path')} took {meta['duration_seconds']}s; saved profile {profile_id}")
+        return summary
+
+    def _prune(self):
+        summaries = sorted(self.profile_dir.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for path in summaries[:max(0, len(summaries) - self.max_files)]:
+            for stale in (path, path.with_suffix(".folded")):
+                try:
+                    stale.unlink()
+                except OSError:
+                    pass
+
+request_profiler = RequestProfiler(
+    profile_dir=PROFILE_DIR,
+    slow_seconds=PROFILE_SLOW_SECONDS,
+    header_enabled=PROFILING_ENABLED,
+    interval=PROFILE_SAMPLE_INTERVAL_MS / 1000,
+    max_files=PROFILE_MAX_FILES,
+    start_delay=PROFILE_START_DELAY_SECONDS,
+    access_token=PROFILE_ACCESS_TOKEN,
+)
@@ -1,14 +1,25 @@
 import os
 import io
+import json
+import uuid
+import zipfile
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
 from PIL import Image
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # PyHanko imports for digital signing
 from pyhanko.sign import signers, fields
 from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
 from pyhanko.sign.fields import SigSeedValueSpec
 from pyhanko.sign.signers import PdfSignatureMetadata
+from pyhanko import stamp
+from pyhanko.pdf_utils import images
 
 # Cryptography for self-signing
 from cryptography.hazmat.primitives import serialization
@@ -17,6 +28,9 @@ from cryptography import x509
 from cryptography.x509.oid import NameOID
 from cryptography.hazmat.primitives import hashes
 
+from metrics import stage
+from loop_guard import blocking
+
 def generate_self_signed_cert():
     """Generates a self-signed certificate and private key."""
     key = rsa.generate_private_key(
@@ -49,6 +63,126 @@ def generate_self_signed_cert():
 
     return key, cert
 
+# ── Signer identity store ────────────────────────────────────────────────────
+# Generating a 2048-bit RSA key per request dominated signing time. The service
+# identity is now created once, persisted under SIGNING_IDENTITY_DIR and reused
+# until it nears expiry; uploaded P12s are parsed once and kept in a small LRU.
+# Several server processes may share the directory, so creating, rotating and
+# loading the identity happen under a lock file, and each file is replaced
+# atomically: a worker never pairs one process's key with another's cert.
+
+class SignerIdentityStore:
+    def __init__(self, identity_dir: str, p12_cache_size: int = 32):
+        self.identity_dir = Path(identity_dir)
+        self.p12_cache_size = p12_cache_size
+        self._lock = threading.Lock()
+        self._service_signer = None
+        self._service_not_after = None
+        self._p12_signers = OrderedDict()  # sha256(p12 + password) -> P12Signer
+        self.p12_hits = 0
+        self.p12_misses = 0
+
+    def service_signer(self):
+        """The persistent self-signed identity, loaded or generated on first use."""
+        with self._lock:
+            if self._service_signer is None or datetime.utcnow() >= self._service_not_after:
+                self._service_signer, cert = self._load_or_create_identity()
+                if self._service_signer is None:
+                    raise ValueError("Could not load the service signing identity")
+                # Rotate a day early so no signature is made with a nearly-expired cert
+                self._service_not_after = cert.not_valid_after - timedelta(days=1)
+            return self._service_signer
+
+    def p12_signer(self, p12_bytes: bytes, p12_password: str):
+        """Returns a parsed P12Signer, reusing one already built for the same file and password."""
+        digest = hashlib.sha256(p12_bytes + b"\x00" + p12_password.encode("utf-8")).hexdigest()
+        with self._lock:
+            signer = self._p12_signers.get(digest)
+            if signer is not None:
+                self._p12_signers.move_to_end(digest)
+                self.p12_hits += 1
+                return signer
+            self.p12_misses += 1
+
+        signer = signers.P12Signer(
+            pfx_pkcs12=io.BytesIO(p12_bytes),
+            passphrase=p12_password.encode('utf-8')
+        )
+
+        with self._lock:
+            self._p12_signers[digest] = signer
+            while len(self._p12_signers) > self.p12_cache_size:
+                self._p12_signers.popitem(last=False)
+        return signer
+
+    def _load_or_create_identity(self):
+        """(SimpleSigner, cert) for the persisted identity, created or rotated if needed."""
+        key_path = self.identity_dir / "service_key.pem"
+        cert_path = self.identity_dir / "service_cert.pem"
+        self.identity_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with _file_lock(self.identity_dir / ".lock"):
+            # Checked under the lock: another process may have just rotated the pair
+            cert = None
+            if key_path.exists() and cert_path.exists():
+                cert = x509.load_pem_x509_certificate(cert_path.read_bytes())
+                if cert.not_valid_after - timedelta(days=1) <= datetime.utcnow():
+                    cert = None
+
+            if cert is None:
+                key, cert = generate_self_signed_cert()
+                _write_atomic(key_path, key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption(),
+                ), mode=0o600)
+                _write_atomic(cert_path, cert.public_bytes(serialization.Encoding.PEM))
+
+            signer = signers.SimpleSigner.load(key_file=str(key_path), cert_file=str(cert_path))
+        return signer, cert
+
+@contextmanager
+def _file_lock(path: Path):
+    """Exclusive lock on `path` across processes (flock on POSIX, msvcrt on Windows)."""
+    with open(path, "a+b") as handle:
+        if os.name == "nt":
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+def _write_atomic(path: Path, data: bytes, mode: int = 0o644):
+    """Writes to a temp file created with `mode` and renames it over `path`."""
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
+signer_store = SignerIdentityStore(
+    identity_dir=os.environ.get("SIGNING_IDENTITY_DIR", "signing_identity"),
+    p12_cache_size=int(os.environ.get("P12_SIGNER_CACHE_SIZE", "32")),
+)
+
+@stage("sign")
+@blocking
 def apply_signature_to_pdf(
     pdf_bytes: bytes,
     signature_bytes: bytes,
@@ -95,19 +229,7 @@ def apply_signature_to_pdf(
 
         # 2. Apply Digital Signature using PyHanko
         # We need a signer.
-        if p12_bytes and p12_password:
-             signer = signers.P12Signer(
-                pfx_pkcs12=io.BytesIO(p12_bytes),
-                passphrase=p12_password.encode('utf-8')
-            )
-        else:
-            # Generate temporary self-signed identity
-            key, cert = generate_self_signed_cert()
-            signer = signers.SimpleSigner(
-                signing_cert=cert,
-                signing_key=key,
-                cert_registry=None
-            )
+        signer = _resolve_signer(p12_bytes, p12_password)
 
         # Prepare for signing
         w = IncrementalPdfFileWriter(io.BytesIO(visual_pdf_bytes))
@@ -145,3 +267,216 @@ def apply_signature_to_pdf(
         import traceback
         traceback.print_exc()
         raise ValueError(f"Failed to sign PDF: {str(e)}")
+
+def _resolve_signer(p12_bytes: bytes = None, p12_password: str = None):
+    if p12_bytes and p12_password:
+        return signer_store.p12_signer(p12_bytes, p12_password)
+    # Reuse the persistent self-signed service identity
+    return signer_store.service_signer()
+
+def _signature_metadata():
+    return PdfSignatureMetadata(
+        field_name='Signature1',
+        reason='Digital Signature by ConverterTool',
+        location='Web',
+        contact_info='support@convertertool.com'
+    )
+
+def load_signature_image(signature_bytes: bytes) -> Image.Image:
+    """Decodes the signature image once; the result can be reused across documents."""
+    img = Image.open(io.BytesIO(signature_bytes))
+    img.load()
+    return img
+
+@stage("sign")
+@blocking
+def sign_pdf_file(
+    input_path: str,
+    output_path: str,
+    signature_image: Image.Image,
+    page_number: int,
+    x: float,
+    y: float,
+    width: float,
+    height: float,
+    p12_bytes: bytes = None,
+    p12_password: str = None,
+    stamp_style=None
+):
+    """
+    Incremental signing: the signature image becomes the appearance stream of the
+    signature field and pyHanko appends one incremental update, so the original
+    document bytes are copied through untouched instead of being cleaned,
+    recompressed and rewritten twice. Works file-to-file, so peak memory does
+    not scale with the PDF size.
+
+    x, y, width, height use the same top-left origin as apply_signature_to_pdf.
+    `stamp_style` may be passed in to reuse a prebuilt appearance across documents.
+
+    Files pyHanko can't open for an incremental update (broken or hybrid xref
+    tables, which MuPDF tolerates) are first rewritten with the same garbage=4
+    repair apply_signature_to_pdf uses, then signed.
+    """
+    repaired_path = None
+    try:
+        with fitz.open(input_path) as doc:
+            page_idx = min(max(page_number, 1), len(doc)) - 1
+            page = doc[page_idx]
+            # MuPDF coordinates are top-left based; pyHanko wants PDF user space
+            box = fitz.Rect(x, y, x + width, y + height) * ~page.transformation_matrix
+            box.normalize()
+
+        if stamp_style is None:
+            stamp_style = build_stamp_style(signature_image)
+
+        signer = _resolve_signer(p12_bytes, p12_password)
+        pdf_signer = signers.PdfSigner(
+            _signature_metadata(),
+            signer=signer,
+            stamp_style=stamp_style,
+            new_field_spec=fields.SigFieldSpec(
+                sig_field_name='Signature1',
+                on_page=page_idx,
+                box=(box.x0, box.y0, box.x1, box.y1)
+            )
+        )
+
+        inf = open(input_path, "rb")
+        try:
+            try:
+                w = IncrementalPdfFileWriter(inf)
+            except Exception as e:
+                print(f"[SIGN] Incremental open failed ({e}); rewriting {os.path.basename(input_path)} first")
+                inf.close()
+                repaired_path = f"{output_path}.{uuid.uuid4().hex}.repaired.pdf"
+                _rewrite_pdf(input_path, repaired_path)
+                inf = open(repaired_path, "rb")
+                w = IncrementalPdfFileWriter(inf)
+            with open(output_path, "wb") as outf:
+                pdf_signer.sign_pdf(w, output=outf)
+        finally:
+            inf.close()
+
+        return output_path
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise ValueError(f"Failed to sign PDF: {str(e)}")
+    finally:
+        if repaired_path and os.path.exists(repaired_path):
+            os.remove(repaired_path)
+
+def _rewrite_pdf(input_path: str, output_path: str):
+    """Rebuilds the xref table and object streams from scratch (MuPDF repairs what it can on open)."""
+    with fitz.open(input_path) as doc:
+        doc.save(output_path, clean=True, garbage=4, deflate=True)
+
+def build_stamp_style(signature_image: Image.Image):
+    """A borderless stamp that renders just the signature image."""
+    return stamp.StaticStampStyle(
+        background=images.PdfImage(signature_image),
+        background_opacity=1.0,
+        border_width=0
+    )
+
+# ── Batch signing ────────────────────────────────────────────────────────────
+# Many PDFs, one signature image and identity. Batches share one process pool of
+# SIGN_BATCH_WORKERS, created on first use, so concurrent batches queue for the
+# same workers instead of each forking a pool of its own. Each worker decodes
+# the image, builds the stamp appearance and loads the signer once per batch
+# (cached by content) and then signs its share of the documents file-to-file.
+
+SIGN_BATCH_WORKERS = int(os.environ.get("SIGN_BATCH_WORKERS", str(os.cpu_count() or 2)))
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def get_batch_executor() -> ProcessPoolExecutor:
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ProcessPoolExecutor(max_workers=SIGN_BATCH_WORKERS)
+        return _batch_executor
+
+_batch_worker_state = OrderedDict()  # sha256(signature + identity) -> (image, stamp_style)
+
+def _batch_worker_assets(signature_bytes: bytes, p12_bytes: bytes, p12_password: str):
+    digest = hashlib.sha256(
+        signature_bytes + b"\x00" + (p12_bytes or b"") + b"\x00" + (p12_password or "").encode("utf-8")
+    ).hexdigest()
+    assets = _batch_worker_state.get(digest)
+    if assets is None:
+        image = load_signature_image(signature_bytes)
+        assets = _batch_worker_state[digest] = (image, build_stamp_style(image))
+        while len(_batch_worker_state) > 8:
+            _batch_worker_state.popitem(last=False)
+    _batch_worker_state.move_to_end(digest)
+    return assets
+
+def _sign_batch_item(input_path: str, output_path: str, placement: dict,
+                     signature_bytes: bytes, p12_bytes: bytes, p12_password: str):
+    image, stamp_style = _batch_worker_assets(signature_bytes, p12_bytes, p12_password)
+    return sign_pdf_file(
+        input_path=input_path,
+        output_path=output_path,
+        signature_image=image,
+        stamp_style=stamp_style,
+        p12_bytes=p12_bytes,
+        p12_password=p12_password,
+        **placement
+    )
+
+def _unique_name(name: str, used: set) -> str:
+    """`name`, or `name (2).pdf`, `name (3).pdf`... if already taken."""
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate.lower() in used:
+        n += 1
+        candidate = f"{stem} ({n}){ext}"
+    used.add(candidate.lower())
+    return candidate
+
+@stage("sign_batch")
+@blocking
+def sign_pdf_batch(
+    items,
+    signature_bytes: bytes,
+    zip_path: str,
+    p12_bytes: bytes = None,
+    p12_password: str = None
+):
+    """
+    Signs many PDFs on the shared batch pool and packs them into `zip_path`.
+    items: list of dicts with input_path, output_path, name and placement
+           (page_number, x, y, width, height).
+    Returns a per-document report; failures are listed in the archive's report.json.
+    """
+    if not (p12_bytes and p12_password):
+        # Create the persistent identity up front so workers don't race to generate it
+        signer_store.service_signer()
+
+    pool = get_batch_executor()
+    futures = [
+        (item, pool.submit(_sign_batch_item, item["input_path"], item["output_path"], item["placement"],
+                           signature_bytes, p12_bytes, p12_password))
+        for item in items
+    ]
+    report = []
+    used_names = set()
+    for item, future in futures:
+        try:
+            future.result()
+            report.append({"name": item["name"], "status": "signed",
+                           "output": _unique_name(f"signed_{item['name']}", used_names)})
+        except Exception as e:
+            report.append({"name": item["name"], "status": "failed", "error": str(e)})
+
+    # Signed PDFs are already deflated internally; storing them is much faster
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zf:
+        for item, entry in zip(items, report):
+            if entry["status"] == "signed":
+                zf.write(item["output_path"], entry["output"])
+        zf.writestr("report.json", json.dumps(report, indent=2))
+
+    return report
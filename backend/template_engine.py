@@ -0,0 +1,124 @@
+import re
+import html
+import uuid
+from email.base64mime import body_encode
+from email.header import Header
+from email.utils import formataddr, formatdate, make_msgid
+
+# ── Notification templates ───────────────────────────────────────────────────
+# Templates are compiled once per job into a list of literal chunks and field
+# lookups, so rendering a recipient is a single join. Any recipient column can
+# be referenced as {{column}}, with an optional fallback: {{name|Friend}}.
+#
+# MessageSkeleton pre-renders everything in an email that doesn't depend on the
+# recipient (headers, MIME boundaries, part headers) and only fills in the
+# per-recipient fields, instead of building a full MIMEMultipart per message.
+# Header values come from recipient data, so they are checked for line breaks
+# (which would inject extra headers) and always emitted as encoded ASCII.
+
+_FIELD_RE = re.compile(r"\{\{\s*([\w\- ]+?)\s*(?:\|([^}]*))?\}\}")
+
+# Fallbacks that applied before templates supported arbitrary columns
+DEFAULT_VALUES = {"name": "Friend"}
+
+class CompiledTemplate:
+    def __init__(self, source: str, escape_html: bool = False):
+        self.source = source or ""
+        self.escape_html = escape_html
+        self.literals = []  # literal text before each field, plus the trailing text
+        self.fields = []    # (column, default) per placeholder
+        pos = 0
+        for match in _FIELD_RE.finditer(self.source):
+            self.literals.append(self.source[pos:match.start()])
+            column = match.group(1).strip().lower()
+            default = match.group(2)
+            if default is None:
+                default = DEFAULT_VALUES.get(column, "")
+            self.fields.append((column, default))
+            pos = match.end()
+        self.literals.append(self.source[pos:])
+
+    @property
+    def is_static(self) -> bool:
+        return not self.fields
+
+    def render(self, recipient: dict) -> str:
+        if not self.fields:
+            return self.source
+        parts = []
+        for literal, (column, default) in zip(self.literals, self.fields):
+            parts.append(literal)
+            value = recipient.get(column)
+            if value is None or value == "" or value != value:  # value != value catches NaN
+                value = default
+            value = str(value)
+            parts.append(html.escape(value) if self.escape_html else value)
+        parts.append(self.literals[-1])
+        return "".join(parts)
+
+class MessageSkeleton:
+    """
+    A reusable email layout: plain text, optionally with an HTML alternative.
+    render() returns the complete RFC 5322 message as a string.
+    """
+
+    def __init__(self, from_addr: str, subject: str, text_template: str, html_template: str = None):
+        self.from_addr = from_addr
+        self._from_header = encode_address(from_addr)
+        self.subject = CompiledTemplate(subject or "Notification")
+        self.text = CompiledTemplate(text_template)
+        self.html = CompiledTemplate(html_template, escape_html=True) if html_template else None
+        self._static_subject = self._encode_subject(self.subject.source) if self.subject.is_static else None
+        # make_msgid() looks up the host name on every call unless given a domain
+        self._msgid_domain = from_addr.rpartition("@")[2] or "localhost"
+
+        # Every constant line is rendered once here
+        self.boundary = f"=={uuid.uuid4().hex}=="
+        self._head = f"From: {self._from_header}\r\nMIME-Version: 1.0\r\n"
+        self._text_part_head = 'Content-Type: text/plain; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+        self._html_part_head = 'Content-Type: text/html; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+        if self.html:
+            self._content_head = f'Content-Type: multipart/alternative; boundary="{self.boundary}"\r\n\r\n'
+        else:
+            self._content_head = self._text_part_head
+
+    def render(self, to_addr: str, recipient: dict) -> str:
+        subject = self._static_subject or self._encode_subject(self.subject.render(recipient))
+        head = (
+            f"{self._head}To: {encode_address(to_addr)}\r\nSubject: {subject}\r\n"
+            f"Date: {formatdate(localtime=True)}\r\nMessage-ID: {make_msgid(domain=self._msgid_domain)}\r\n"
+            f"{self._content_head}"
+        )
+        text_body = body_encode(self.text.render(recipient).encode("utf-8"))
+        if not self.html:
+            return head + text_body
+
+        html_body = body_encode(self.html.render(recipient).encode("utf-8"))
+        return (
+            f"{head}--{self.boundary}\r\n{self._text_part_head}{text_body}\r\n"
+            f"--{self.boundary}\r\n{self._html_part_head}{html_body}\r\n"
+            f"--{self.boundary}--\r\n"
+        )
+
+    @staticmethod
+    def _encode_subject(subject: str) -> str:
+        # Line breaks in a templated subject are content, not structure: flatten them
+        subject = " ".join(subject.splitlines())
+        charset = "us-ascii" if subject.isascii() else "utf-8"
+        # Header folds long values; header_name leaves room for "Subject: " on the first line
+        return Header(subject, charset, header_name="Subject").encode(linesep="\r\n")
+
+def encode_address(addr: str) -> str:
+    """
+    A bare address as an ASCII header value. Raises ValueError on line breaks
+    (header injection) and on non-ASCII local parts; non-ASCII domains are IDNA-encoded.
+    """
+    addr = (addr or "").strip()
+    if "\r" in addr or "\n" in addr:
+        raise ValueError(f"Invalid address (line break): {addr!r}")
+    local, at, domain = addr.rpartition("@")
+    if not local.isascii():
+        raise ValueError(f"Non-ASCII address not supported: {addr!r}")
+    if not domain.isascii():
+        domain = domain.encode("idna").decode("ascii")
+    return formataddr(("", f"{local}{at}{domain}"))
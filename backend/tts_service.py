@@ -1,69 +1,544 @@
+import io
 import os
+import re
+import time
 import uuid
+import shutil
+import weakref
+import hashlib
+import zipfile
+import threading
 import asyncio
+from datetime import datetime
+from pathlib import Path
 import edge_tts
 from gtts import gTTS
+from pydub import AudioSegment
+from pydub.generators import Sine
 
-async def generate_speech(
-    text: str,
-    language: str = "en",
-    voice: str = None,
-    speed: float = 1.0,
-    pitch: float = 1.0
-) -> str:
-    """
-    Generates speech audio from text.
-    Returns the path to the generated audio file.
-    """
-    
+from metrics import stage
+
+# Default voices mapping
+VOICE_MAPPING = {
+    "en": "en-US-AriaNeural",
+    "hi": "hi-IN-SwaraNeural",
+    # Add more logic or voices as needed
+}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+TTS_BITRATE = os.environ.get("TTS_BITRATE", "48k")
+TTS_TEMP_MAX_AGE_SECONDS = 3600  # temp files older than this were abandoned by a crash
+
+# ── Speech cache ─────────────────────────────────────────────────────────────
+# Synthesized audio is stored content-addressed under TTS_CACHE_DIR, keyed by
+# (text, voice, rate, pitch). UI phrases and notification templates are then
+# synthesized once; the directory is trimmed least-recently-used first once it
+# grows past TTS_CACHE_MAX_MB. Readers open entries through open(), under the
+# same lock eviction takes, so an entry can't vanish between lookup and read
+# (on POSIX an open file survives its unlink; on Windows eviction skips it).
+
+class SpeechCache:
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, text: str, voice: str, rate: str, pitch: str, variant: str = "") -> str:
+        raw = "\x1f".join([text, voice, rate, pitch] + ([variant] if variant else []))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mp3"
+
+    def get(self, key: str):
+        """Returns the cached file path or None, refreshing its LRU position on a hit."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)  # mtime doubles as last-access time
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def open(self, *keys: str):
+        """
+        Opens the first of `keys` that is cached for reading, or returns None
+        (one hit or miss either way). The caller closes the file.
+        """
+        with self._lock:
+            for key in keys:
+                path = self.path_for(key)
+                try:
+                    os.utime(path)  # mtime doubles as last-access time
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    continue
+                self.hits += 1
+                return f
+            self.misses += 1
+            return None
+
+    def temp_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.{uuid.uuid4().hex}.tmp"
+
+    def commit(self, temp_path: Path, key: str) -> Path:
+        """Atomically publishes a finished temp file under its key."""
+        path = self.path_for(key)
+        os.replace(temp_path, path)
+        self._evict()
+        return path
+
+    def stats(self) -> dict:
+        with self._lock:
+            files = list(self.cache_dir.glob("*.mp3"))
+            return {
+                "entries": len(files),
+                "bytes": sum(f.stat().st_size for f in files),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict(self):
+        with self._lock:
+            stale = time.time() - TTS_TEMP_MAX_AGE_SECONDS
+            files = []
+            for f in self.cache_dir.iterdir():
+                try:
+                    st = f.stat()
+                    if f.suffix == ".tmp":
+                        if st.st_mtime < stale:
+                            f.unlink()
+                    elif f.suffix == ".mp3":
+                        files.append((st.st_mtime, st.st_size, f))
+                except OSError:
+                    pass  # removed meanwhile, or (Windows) still open
+            files.sort(key=lambda entry: entry[0])
+            total = sum(size for _, size, _ in files)
+            for _, size, f in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    f.unlink()
+                    total -= size
+                except OSError:
+                    pass
+
+speech_cache = SpeechCache(
+    cache_dir=os.environ.get("TTS_CACHE_DIR", "tts_cache"),
+    max_bytes=int(os.environ.get("TTS_CACHE_MAX_MB", "512")) * 1024 * 1024,
+)
+
+def _speech_params(language: str, voice: str, speed: float, pitch: float):
+    """Resolves the voice and formats speed/pitch for edge-tts."""
     # 1. Determine Voice
-    # Default voices mapping
-    VOICE_MAPPING = {
-        "en": "en-US-AriaNeural",
-        "hi": "hi-IN-SwaraNeural",
-        # Add more logic or voices as needed
-    }
-    
     if not voice:
         voice = VOICE_MAPPING.get(language, "en-US-AriaNeural")
 
     # 2. Format Speed/Pitch for edge-tts
     # edge-tts expects strings like "+10%", "-50%"
-    # Base is 0% (speed=1.0). 
+    # Base is 0% (speed=1.0).
     # speed=1.5 -> +50%. speed=0.5 -> -50%.
-    
+
     rate_str = "+0%"
     if speed != 1.0:
         val = int((speed - 1.0) * 100)
         sign = "+" if val >= 0 else "" # negative numbers have sign built-in
         rate_str = f"{sign}{val}%"
-        
+
     pitch_str = "+0Hz"
     if pitch != 1.0:
         # Heuristic: 1.0 = 0Hz. 1.2 = +20Hz (rough approximation for simple control)
-        # Actually edge-tts pitch takes Hz or st (semitones). 
+        # Actually edge-tts pitch takes Hz or st (semitones).
         # Let's use Hz for relative change.
-        # pitch=1.5 is high, pitch=0.5 is low. 
-        # Let's say range is +/- 50Hz for typical usage? 
-        val = int((pitch - 1.0) * 50) 
+        # pitch=1.5 is high, pitch=0.5 is low.
+        # Let's say range is +/- 50Hz for typical usage?
+        val = int((pitch - 1.0) * 50)
         sign = "+" if val >= 0 else ""
         pitch_str = f"{sign}{val}Hz"
 
-    output_file = f"speech_{uuid.uuid4()}.mp3"
-    
+    return voice, rate_str, pitch_str
+
+# ── Synthesis backends ───────────────────────────────────────────────────────
+# Each backend exposes `stream(...)`, an async generator of MP3 bytes. gTTS and
+# the local stand-in are synchronous, so they run in a worker thread instead of
+# stalling the event loop. TTS_BACKEND=local swaps in an offline tone generator
+# for tests and benchmarks.
+
+class EdgeTTSBackend:
+    name = "edge"
+
+    async def stream(self, text, voice, rate, pitch, language, speed):
+        communicate = edge_tts.Communicate(text, voice, rate=rate, pitch=pitch)
+        async for message in communicate.stream():
+            if message["type"] == "audio":
+                yield message["data"]
+
+class GTTSBackend:
+    name = "gtts"
+
+    async def stream(self, text, voice, rate, pitch, language, speed):
+        yield await asyncio.to_thread(self._synthesize, text, language, speed)
+
+    def _synthesize(self, text, language, speed) -> bytes:
+        buffer = io.BytesIO()
+        # gTTS doesn't support fine-grained speed/pitch easily without other tools
+        gTTS(text=text, lang=language, slow=(speed < 0.8)).write_to_fp(buffer)
+        return buffer.getvalue()
+
+class LocalToneBackend:
+    """Offline stand-in: a tone whose length tracks the text, encoded as MP3."""
+    name = "local"
+    ms_per_char = 60
+
+    async def stream(self, text, voice, rate, pitch, language, speed):
+        yield await asyncio.to_thread(self._synthesize, text, speed)
+
+    def _synthesize(self, text, speed) -> bytes:
+        duration = max(100, int(len(text) * self.ms_per_char / max(speed, 0.1)))
+        tone = Sine(440).to_audio_segment(duration=duration).apply_gain(-20)
+        buffer = io.BytesIO()
+        tone.set_frame_rate(24000).set_channels(1).export(buffer, format="mp3", bitrate=TTS_BITRATE)
+        return buffer.getvalue()
+
+_BACKENDS = {
+    "edge": EdgeTTSBackend,
+    "gtts": GTTSBackend,
+    "local": LocalToneBackend,
+}
+
+tts_backend = _BACKENDS[os.environ.get("TTS_BACKEND", "edge")]()
+fallback_backend = GTTSBackend()
+
+# ── Long-text chunking ───────────────────────────────────────────────────────
+# Texts longer than TTS_CHUNK_CHARS are split on sentence boundaries, the chunks
+# are synthesized concurrently and then decoded and re-encoded as one stream so
+# there are no gaps between them. At most TTS_MAX_CONCURRENCY synthesis calls
+# are in flight per process, across all requests and batch jobs.
+
+TTS_CHUNK_CHARS = int(os.environ.get("TTS_CHUNK_CHARS", "1500"))
+TTS_MAX_CONCURRENCY = int(os.environ.get("TTS_MAX_CONCURRENCY", "4"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?।])\s+")
+
+_synthesis_slots = weakref.WeakKeyDictionary()  # event loop -> Semaphore
+
+def _synthesis_semaphore() -> asyncio.Semaphore:
+    """The process-wide limit on concurrent synthesis calls (one per event loop)."""
+    loop = asyncio.get_running_loop()
+    semaphore = _synthesis_slots.get(loop)
+    if semaphore is None:
+        semaphore = _synthesis_slots[loop] = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
+    return semaphore
+
+def split_text(text: str, max_chars: int = None):
+    """Splits text into chunks of at most `max_chars`, breaking between sentences where possible."""
+    max_chars = max_chars or TTS_CHUNK_CHARS
+    if len(text) <= max_chars:
+        return [text]
+
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text.strip()):
+        # A single over-long sentence is split on whitespace instead
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return [c for c in chunks if c]
+
+async def _synthesize_bytes(text, voice, rate, pitch, language, speed) -> bytes:
+    """Synthesizes one chunk with the configured backend, falling back to gTTS."""
     try:
-        # Use edge-tts (async)
-        communicate = edge_tts.Communicate(text, voice, rate=rate_str, pitch=pitch_str)
-        await communicate.save(output_file)
-        return output_file
-        
+        async with _synthesis_semaphore():
+            with stage(f"tts_{tts_backend.name}"):
+                return b"".join([c async for c in tts_backend.stream(text, voice, rate, pitch, language, speed)])
     except Exception as e:
+        if tts_backend.name != "edge":
+            raise ValueError(f"TTS Generation failed: {str(e)}")
         print(f"Edge TTS failed: {e}. Falling back to gTTS.")
-        # Fallback to gTTS (sync, basic)
+    return await _synthesize_bytes_fallback(text, voice, rate, pitch, language, speed)
+
+def _start_chunk_tasks(chunks, voice, rate, pitch, language, speed):
+    """Schedules every chunk at once; the shared semaphore bounds how many hit the service together."""
+    return [
+        asyncio.create_task(_synthesize_bytes(chunk, voice, rate, pitch, language, speed))
+        for chunk in chunks
+    ]
+
+def _concat_gapless(parts, output_path: Path):
+    """Decodes the MP3 parts and re-encodes them as one continuous stream."""
+    segments = [AudioSegment.from_file(io.BytesIO(p), format="mp3") for p in parts]
+    combined = segments[0]
+    for segment in segments[1:]:
+        combined += segment
+    combined.export(str(output_path), format="mp3", bitrate=TTS_BITRATE)
+
+async def generate_speech(
+    text: str,
+    language: str = "en",
+    voice: str = None,
+    speed: float = 1.0,
+    pitch: float = 1.0
+) -> str:
+    """
+    Generates speech audio from text.
+    Returns the path to the generated audio file. The file lives in the speech
+    cache and must not be deleted by the caller.
+    """
+    voice, rate_str, pitch_str = _speech_params(language, voice, speed, pitch)
+    key = speech_cache.key_for(text, voice, rate_str, pitch_str)
+
+    cached = speech_cache.get(key)
+    if cached:
+        return str(cached)
+
+    output_file = speech_cache.temp_path(key)
+    chunks = split_text(text)
+    tasks = _start_chunk_tasks(chunks, voice, rate_str, pitch_str, language, speed)
+    try:
+        parts = await asyncio.gather(*tasks)
+        if len(parts) == 1:
+            with open(output_file, "wb") as f:
+                f.write(parts[0])
+        else:
+            await asyncio.to_thread(_concat_gapless, parts, output_file)
+        return str(speech_cache.commit(output_file, key))
+    finally:
+        for task in tasks:
+            task.cancel()
+        if output_file.exists():
+            output_file.unlink()
+
+async def stream_speech(
+    text: str,
+    language: str = "en",
+    voice: str = None,
+    speed: float = 1.0,
+    pitch: float = 1.0
+):
+    """
+    Async generator of MP3 bytes. Cache hits are read from disk; on a miss the
+    audio is forwarded as it arrives (and teed into the cache), so the client
+    hears audio after the first chunk rather than the whole file. Long texts
+    stream chunk by chunk, in order, while later chunks are still synthesizing.
+
+    A streamed long text is the per-chunk MP3s back to back, not the gapless
+    re-encode generate_speech() produces, so there may be short gaps at chunk
+    joins. Those exact bytes are what get cached, under their own "stream"
+    key; the gapless file is still preferred when it's already cached.
+    """
+    voice, rate_str, pitch_str = _speech_params(language, voice, speed, pitch)
+    key = speech_cache.key_for(text, voice, rate_str, pitch_str)
+
+    stream_key = speech_cache.key_for(text, voice, rate_str, pitch_str, "stream")
+    cached = speech_cache.open(key, stream_key)
+    if cached:
+        async for chunk in read_file_chunks(cached):
+            yield chunk
+        return
+
+    chunks = split_text(text)
+    if len(chunks) > 1:
+        tasks = _start_chunk_tasks(chunks, voice, rate_str, pitch_str, language, speed)
+        temp_path = speech_cache.temp_path(stream_key)
+        try:
+            with open(temp_path, "wb") as f:
+                for task in tasks:
+                    part = await task
+                    f.write(part)
+                    yield part
+            speech_cache.commit(temp_path, stream_key)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if temp_path.exists():
+                temp_path.unlink()
+        return
+
+    temp_path = speech_cache.temp_path(key)
+    try:
+        sent_any = False
         try:
-            # gTTS doesn't support fine-grained speed/pitch easily without other tools
-            tts = gTTS(text=text, lang=language, slow=(speed < 0.8))
-            tts.save(output_file)
-            return output_file
-        except Exception as e2:
-            raise ValueError(f"TTS Generation failed: {str(e2)}")
+            async with _synthesis_semaphore():
+                with open(temp_path, "wb") as f:
+                    async for data in tts_backend.stream(text, voice, rate_str, pitch_str, language, speed):
+                        f.write(data)
+                        sent_any = True
+                        yield data
+            speech_cache.commit(temp_path, key)
+            return
+        except Exception as e:
+            if sent_any or tts_backend.name != "edge":
+                # Part of the audio may already be on the wire; can't switch engines now
+                raise ValueError(f"TTS stream interrupted: {str(e)}")
+            print(f"Edge TTS failed: {e}. Falling back to gTTS.")
+
+        # Fallback: synthesize the whole chunk with gTTS off the event loop
+        data = await _synthesize_bytes_fallback(text, voice, rate_str, pitch_str, language, speed)
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        speech_cache.commit(temp_path, key)
+        yield data
+    finally:
+        # Also runs on GeneratorExit / cancellation when the client disconnects mid-stream
+        if temp_path.exists():
+            temp_path.unlink()
+
+async def _synthesize_bytes_fallback(text, voice, rate, pitch, language, speed) -> bytes:
+    try:
+        async with _synthesis_semaphore():
+            with stage(f"tts_{fallback_backend.name}"):
+                return b"".join([c async for c in fallback_backend.stream(text, voice, rate, pitch, language, speed)])
+    except Exception as e2:
+        raise ValueError(f"TTS Generation failed: {str(e2)}")
+
+async def read_file_chunks(f):
+    """Streams an open file (e.g. from SpeechCache.open) and closes it."""
+    with f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+            await asyncio.sleep(0)
+
+# ── Batch jobs ───────────────────────────────────────────────────────────────
+# Many texts in one request: items go through generate_speech (and so the speech
+# cache) with at most TTS_BATCH_CONCURRENCY in flight. Each result is copied out
+# of the cache into the job's own directory as soon as it is ready, so cache
+# eviction can't take it away; the job then delivers a zip of that directory or
+# a manifest of per-item URLs served from it. Finished jobs and their files are
+# dropped after TTS_JOB_TTL_SECONDS, and at most TTS_MAX_JOBS are kept.
+
+TTS_BATCH_CONCURRENCY = int(os.environ.get("TTS_BATCH_CONCURRENCY", "4"))
+TTS_JOB_TTL_SECONDS = int(os.environ.get("TTS_JOB_TTL_SECONDS", "3600"))
+TTS_MAX_JOBS = int(os.environ.get("TTS_MAX_JOBS", "100"))
+
+# Structure: { job_id: { status, progress, total, completed, failed, items: [...], item_dir, zip_path } }
+TTS_JOBS_STORE = {}
+
+class TTSBatchService:
+    def __init__(self):
+        self._tasks = set()  # keeps running job tasks referenced until they finish
+
+    def item_path(self, job_id: str, index: int):
+        """Path of a finished item's MP3, or None."""
+        job = TTS_JOBS_STORE.get(job_id)
+        if not job or not 0 <= index < len(job['items']) or job['items'][index]['status'] != 'completed':
+            return None
+        path = Path(job['item_dir']) / _item_name(index)
+        return path if path.exists() else None
+
+    async def start_job(self, items, delivery: str, output_dir: str) -> str:
+        """
+        items: list of dicts with text, language, voice, speed, pitch.
+        delivery: 'zip' (one archive) or 'manifest' (per-item cache keys).
+        """
+        self._prune()
+        job_id = str(uuid.uuid4())
+        item_dir = Path(output_dir) / f"tts_batch_{job_id}"
+        item_dir.mkdir(parents=True)
+        TTS_JOBS_STORE[job_id] = {
+            'id': job_id,
+            'status': 'processing',
+            'progress': 0,
+            'total': len(items),
+            'completed': 0,
+            'failed': 0,
+            'delivery': delivery,
+            'started_at': datetime.now().isoformat(),
+            'items': [{'index': i, 'status': 'pending'} for i in range(len(items))],
+            'item_dir': str(item_dir),
+            'zip_path': None,
+        }
+        task = asyncio.create_task(self._run_job(job_id, items, delivery, output_dir))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job_id
+
+    async def _run_job(self, job_id, items, delivery, output_dir):
+        job = TTS_JOBS_STORE[job_id]
+        semaphore = asyncio.Semaphore(TTS_BATCH_CONCURRENCY)
+
+        async def run(index, item):
+            async with semaphore:
+                entry = job['items'][index]
+                try:
+                    path = await generate_speech(
+                        text=item['text'],
+                        language=item.get('language', 'en'),
+                        voice=item.get('voice'),
+                        speed=item.get('speed', 1.0),
+                        pitch=item.get('pitch', 1.0),
+                    )
+                    target = Path(job['item_dir']) / _item_name(index)
+                    try:
+                        await asyncio.to_thread(shutil.copyfile, path, target)
+                    except FileNotFoundError:
+                        raise ValueError("Audio was evicted from the speech cache before it could be saved")
+                    entry['status'] = 'completed'
+                    entry['key'] = Path(path).stem
+                    job['completed'] += 1
+                except Exception as e:
+                    entry['status'] = 'failed'
+                    entry['error'] = str(e)
+                    job['failed'] += 1
+                job['progress'] = int((job['completed'] + job['failed']) / max(job['total'], 1) * 100)
+
+        await asyncio.gather(*(run(i, item) for i, item in enumerate(items)))
+
+        if delivery == 'zip' and job['completed']:
+            zip_path = Path(output_dir) / f"tts_batch_{job_id}.zip"
+            await asyncio.to_thread(self._write_zip, job['items'], zip_path, Path(job['item_dir']))
+            job['zip_path'] = str(zip_path)
+
+        job['status'] = 'completed'
+        job['progress'] = 100
+        job['finished_at'] = datetime.now().isoformat()
+        job['finished_ts'] = time.time()
+
+    def _write_zip(self, items, zip_path: Path, item_dir: Path):
+        # MP3 is already compressed; storing avoids burning CPU on deflate
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zf:
+            for entry in items:
+                if entry['status'] == 'completed':
+                    zf.write(item_dir / _item_name(entry['index']), _item_name(entry['index']))
+
+    def _prune(self):
+        """Drops expired finished jobs, then the oldest finished ones beyond TTS_MAX_JOBS."""
+        finished = sorted(
+            (job for job in TTS_JOBS_STORE.values() if job.get('finished_ts')),
+            key=lambda job: job['finished_ts'],
+        )
+        cutoff = time.time() - TTS_JOB_TTL_SECONDS
+        excess = len(TTS_JOBS_STORE) - TTS_MAX_JOBS + 1
+        for i, job in enumerate(finished):
+            if job['finished_ts'] >= cutoff and i >= excess:
+                break
+            TTS_JOBS_STORE.pop(job['id'], None)
+            shutil.rmtree(job['item_dir'], ignore_errors=True)
+            if job['zip_path'] and os.path.exists(job['zip_path']):
+                os.remove(job['zip_path'])
+
+def _item_name(index: int) -> str:
+    return f"{index + 1:05d}.mp3"
+
+tts_batch_service = TTSBatchService()
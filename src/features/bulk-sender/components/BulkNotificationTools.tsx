@@ -7,11 +7,9 @@ import { API_BASE_URL } from '../../../config';
 import { useBackendStatus } from '../../../hooks/useBackendStatus';
 import { BackendRequired } from '../../../components/common/BackendRequired';
 
-interface Recipient {
-    name?: string;
-    email?: string;
-    phone?: string;
-    [key: string]: any;
+interface RecipientSet {
+    id: string;
+    total: number;
 }
 
 const BulkNotificationTools: React.FC = () => {
@@ -20,7 +18,7 @@ const BulkNotificationTools: React.FC = () => {
     const { status, retry } = useBackendStatus();
 
     // Data
-    const [recipients, setRecipients] = useState<Recipient[]>([]);
+    const [recipientSet, setRecipientSet] = useState<RecipientSet | null>(null);
     const [file, setFile] = useState<File | null>(null);
 
     // Config
@@ -56,7 +54,8 @@ const BulkNotificationTools: React.FC = () => {
             const data = await res.json();
             if (!res.ok) throw new Error(data.detail);
 
-            setRecipients(data.recipients); // Store all data in memory for this session
+            // The list stays on the server; we only keep its id and size
+            setRecipientSet({ id: data.recipient_set_id, total: data.total });
             setStep('compose');
         } catch (e: any) {
             alert(e.message);
@@ -79,7 +78,7 @@ const BulkNotificationTools: React.FC = () => {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
-                    recipients,
+                    recipient_set_id: recipientSet?.id,
                     channel: activeChannels.join(','), // simple comma sep
                     template: message,
                     subject,
@@ -100,7 +99,7 @@ const BulkNotificationTools: React.FC = () => {
 
         const interval = setInterval(async () => {
             try {
-                const res = await fetch(`${API_BASE_URL}/bulk/status/${jobId}`);
+                const res = await fetch(`${API_BASE_URL}/bulk/status/${jobId}?logs_limit=10`);
                 if (res.ok) {
                     const job = await res.json();
                     setProgress(job.progress);
@@ -230,7 +229,7 @@ const BulkNotificationTools: React.FC = () => {
                                 <div className="mt-6 pt-6 border-t border-gray-100">
                                     <div className="flex justify-between text-sm mb-2">
                                         <span className="text-gray-500">Recipients:</span>
-                                        <span className="font-bold text-gray-900">{recipients.length}</span>
+                                        <span className="font-bold text-gray-900">{recipientSet?.total ?? 0}</span>
                                     </div>
                                     <Button onClick={handleSend} className="w-full bg-cyan-600 hover:bg-cyan-700 text-white">
                                         <Send className="w-4 h-4 mr-2" />
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# The backend modules import each other as top-level modules (uvicorn runs from backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# Module-level singletons (job store, speech cache) are created on import; keep
+# them out of the working tree, and keep speech synthesis offline.
+_scratch = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(_scratch, "jobs.sqlite3"))
+os.environ.setdefault("TTS_CACHE_DIR", os.path.join(_scratch, "tts_cache"))
+os.environ.setdefault("TTS_BACKEND", "local")
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+
+notification_service = pytest.importorskip("notification_service")
+from benchmarks.smtp_stub import SMTPStub
+
+MESSAGE = "Subject: Test\r\n\r\nHello from the pool test.\r\n"
+
+
+@pytest.fixture
+def smtp():
+    stub = SMTPStub().start()
+    yield stub
+    stub.stop()
+
+
+def _pool(smtp, size=1):
+    return notification_service.SMTPConnectionPool(
+        "127.0.0.1", smtp.port, user="test", password="secret", size=size, use_tls=False, timeout=5
+    )
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+async def _send(pool, count, concurrent=False):
+    sends = [pool.send("sender@example.com", f"user{i}@example.com", MESSAGE) for i in range(count)]
+    if concurrent:
+        await asyncio.gather(*sends)
+    else:
+        for send in sends:
+            await send
+
+
+# ── SMTPConnectionPool ───────────────────────────────────────────────────────
+
+def test_pool_reuses_connection(smtp):
+    async def run():
+        pool = _pool(smtp)
+        await _send(pool, 5)
+        await pool.close()
+
+    asyncio.run(run())
+    assert smtp.messages == 5
+    assert smtp.connections == 1
+
+
+def test_pool_opens_at_most_size_connections(smtp):
+    async def run():
+        pool = _pool(smtp, size=2)
+        await _send(pool, 8, concurrent=True)
+        await pool.close()
+
+    asyncio.run(run())
+    assert smtp.messages == 8
+    assert 1 <= smtp.connections <= 2
+
+
+def test_pool_recycles_connection_after_message_limit(smtp, monkeypatch):
+    monkeypatch.setattr(notification_service, "SMTP_MAX_MESSAGES_PER_CONNECTION", 2)
+
+    async def run():
+        pool = _pool(smtp)
+        await _send(pool, 5)
+        await pool.close()
+
+    asyncio.run(run())
+    assert smtp.messages == 5
+    assert smtp.connections == 3
+
+
+def test_pool_reconnects_after_server_drops_connection(smtp):
+    async def run():
+        pool = _pool(smtp)
+        await _send(pool, 1)
+        smtp.drop_connections()
+        await asyncio.to_thread(_wait_for, lambda: smtp.open_connections == 0)
+        await _send(pool, 1)
+        await pool.close()
+
+    asyncio.run(run())
+    assert smtp.messages == 2
+    assert smtp.connections == 2
+
+
+def test_pool_close_quits_idle_connections(smtp):
+    async def run():
+        pool = _pool(smtp, size=2)
+        await _send(pool, 4, concurrent=True)
+        await pool.close()
+
+    asyncio.run(run())
+    _wait_for(lambda: smtp.open_connections == 0)
+
+
+# ── TokenBucket ──────────────────────────────────────────────────────────────
+
+def _time_acquires(rate, capacity, count) -> list:
+    """Seconds from the start at which each of `count` acquisitions returned."""
+    async def run():
+        bucket = notification_service.TokenBucket(rate, capacity)
+        start = time.monotonic()
+        times = []
+        for _ in range(count):
+            await bucket.acquire()
+            times.append(time.monotonic() - start)
+        return times
+
+    return asyncio.run(run())
+
+
+def test_token_bucket_holds_rate():
+    times = _time_acquires(rate=20, capacity=1, count=11)
+    # The first token is available at once, then one every 50 ms
+    assert times[0] < 0.02
+    assert 0.45 <= times[-1] < 0.9
+
+
+def test_token_bucket_allows_burst_up_to_capacity():
+    times = _time_acquires(rate=10, capacity=5, count=6)
+    assert times[4] < 0.05
+    assert times[5] >= 0.08
+
+
+def test_token_bucket_rate_is_shared_by_concurrent_senders():
+    async def run():
+        bucket = notification_service.TokenBucket(20, 1)
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(11)))
+        return time.monotonic() - start
+
+    assert 0.45 <= asyncio.run(run()) < 0.9
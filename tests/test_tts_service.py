@@ -0,0 +1,193 @@
+import asyncio
+import io
+import shutil
+
+import pytest
+
+tts_service = pytest.importorskip("tts_service")
+
+
+def _collect(agen) -> bytes:
+    async def run():
+        return b"".join([chunk async for chunk in agen])
+    return asyncio.run(run())
+
+
+class RecordingBackend:
+    """Deterministic stand-in for a synthesis service: two parts per call, optionally failing."""
+    name = "local"
+
+    def __init__(self, fail_on=(), fail_after_first=False):
+        self.calls = []
+        self.fail_on = set(fail_on)
+        self.fail_after_first = fail_after_first
+
+    async def stream(self, text, voice, rate, pitch, language, speed):
+        self.calls.append(text)
+        if text in self.fail_on:
+            raise RuntimeError("synthesis failed")
+        yield b"audio:"
+        if self.fail_after_first:
+            raise RuntimeError("connection dropped")
+        yield text.encode("utf-8")
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = tts_service.SpeechCache(str(tmp_path / "speech"), max_bytes=10 * 1024 * 1024)
+    monkeypatch.setattr(tts_service, "speech_cache", cache)
+    return cache
+
+
+def _use_backend(monkeypatch, backend):
+    monkeypatch.setattr(tts_service, "tts_backend", backend)
+    return backend
+
+
+def _files(cache):
+    return sorted(p.name for p in cache.cache_dir.iterdir())
+
+
+# ── split_text ───────────────────────────────────────────────────────────────
+
+def test_split_text_short_text_is_one_chunk():
+    assert tts_service.split_text("Hello there. How are you?", max_chars=100) == ["Hello there. How are you?"]
+
+
+def test_split_text_breaks_between_sentences():
+    text = " ".join(f"Sentence number {i} ends here." for i in range(40))
+    chunks = tts_service.split_text(text, max_chars=100)
+
+    assert len(chunks) > 1
+    assert all(len(c) <= 100 for c in chunks)
+    assert all(c.endswith(".") for c in chunks)
+    assert " ".join(chunks) == text
+
+
+def test_split_text_splits_long_sentence_on_whitespace():
+    text = " ".join(f"word{i}" for i in range(60))
+    chunks = tts_service.split_text(text, max_chars=50)
+
+    assert all(len(c) <= 50 for c in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_split_text_hard_cuts_unbroken_text():
+    assert tts_service.split_text("x" * 120, max_chars=50) == ["x" * 50, "x" * 50, "x" * 20]
+
+
+def test_split_text_keeps_sentence_after_long_one_separate():
+    text = "Short one. " + " ".join(["long"] * 30) + ". Tail."
+    chunks = tts_service.split_text(text, max_chars=40)
+
+    assert chunks[0] == "Short one."
+    assert chunks[-1].endswith("Tail.")
+    assert all(len(c) <= 40 for c in chunks)
+
+
+def test_split_text_defaults_to_tts_chunk_chars(monkeypatch):
+    monkeypatch.setattr(tts_service, "TTS_CHUNK_CHARS", 30)
+    chunks = tts_service.split_text("First sentence here. Second sentence here.")
+    assert chunks == ["First sentence here.", "Second sentence here."]
+
+
+# ── LocalToneBackend ─────────────────────────────────────────────────────────
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is required to encode MP3")
+
+
+def _tone_duration_ms(text, speed=1.0) -> int:
+    backend = tts_service.LocalToneBackend()
+    data = _collect(backend.stream(text, "voice", "+0%", "+0Hz", "en", speed))
+    return len(tts_service.AudioSegment.from_file(io.BytesIO(data), format="mp3"))
+
+
+@needs_ffmpeg
+def test_local_tone_backend_yields_mp3():
+    backend = tts_service.LocalToneBackend()
+    data = _collect(backend.stream("Hello", "voice", "+0%", "+0Hz", "en", 1.0))
+    assert data[:3] == b"ID3" or data[0] == 0xFF
+
+
+@needs_ffmpeg
+def test_local_tone_backend_length_tracks_text_and_speed():
+    text = "x" * 50  # 3 s at 60 ms per character
+    assert _tone_duration_ms(text) == pytest.approx(3000, abs=200)
+    assert _tone_duration_ms(text, speed=2.0) == pytest.approx(1500, abs=200)
+
+
+# ── Streaming cache ──────────────────────────────────────────────────────────
+
+def test_stream_speech_miss_then_hit(cache, monkeypatch):
+    backend = _use_backend(monkeypatch, RecordingBackend())
+
+    first = _collect(tts_service.stream_speech("Hello there."))
+    second = _collect(tts_service.stream_speech("Hello there."))
+
+    assert first == second == b"audio:Hello there."
+    assert backend.calls == ["Hello there."]
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert [name.endswith(".mp3") for name in _files(cache)] == [True]
+
+
+def test_stream_speech_cache_key_includes_voice_settings(cache, monkeypatch):
+    backend = _use_backend(monkeypatch, RecordingBackend())
+
+    _collect(tts_service.stream_speech("Hello there."))
+    _collect(tts_service.stream_speech("Hello there.", speed=1.5))
+
+    assert backend.calls == ["Hello there.", "Hello there."]
+    assert cache.misses == 2
+
+
+def test_stream_speech_long_text_streams_chunks_in_order_and_caches(cache, monkeypatch):
+    monkeypatch.setattr(tts_service, "TTS_CHUNK_CHARS", 40)
+    backend = _use_backend(monkeypatch, RecordingBackend())
+    text = "The first sentence is here. The second one follows. And a third closes it."
+    chunks = tts_service.split_text(text)
+    assert len(chunks) > 1
+
+    first = _collect(tts_service.stream_speech(text))
+    second = _collect(tts_service.stream_speech(text))
+
+    assert first == second == b"".join(b"audio:" + c.encode("utf-8") for c in chunks)
+    assert sorted(backend.calls) == sorted(chunks)
+    voice, rate, pitch = tts_service._speech_params("en", None, 1.0, 1.0)
+    stream_key = cache.key_for(text, voice, rate, pitch, "stream")
+    assert cache.path_for(stream_key).exists()
+
+
+def test_stream_speech_discards_partial_write(cache, monkeypatch):
+    _use_backend(monkeypatch, RecordingBackend(fail_after_first=True))
+
+    with pytest.raises(ValueError, match="interrupted"):
+        _collect(tts_service.stream_speech("Hello there."))
+    assert _files(cache) == []
+
+    backend = _use_backend(monkeypatch, RecordingBackend())
+    assert _collect(tts_service.stream_speech("Hello there.")) == b"audio:Hello there."
+    assert backend.calls == ["Hello there."]
+
+
+def test_stream_speech_discards_partial_long_text(cache, monkeypatch):
+    monkeypatch.setattr(tts_service, "TTS_CHUNK_CHARS", 40)
+    text = "The first sentence is here. The second one follows. And a third closes it."
+    chunks = tts_service.split_text(text)
+    _use_backend(monkeypatch, RecordingBackend(fail_on=[chunks[-1]]))
+
+    with pytest.raises(ValueError):
+        _collect(tts_service.stream_speech(text))
+    assert _files(cache) == []
+
+
+def test_stream_speech_discards_write_when_client_disconnects(cache, monkeypatch):
+    _use_backend(monkeypatch, RecordingBackend())
+
+    async def read_first_chunk():
+        stream = tts_service.stream_speech("Hello there.")
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(read_first_chunk()) == b"audio:"
+    assert _files(cache) == []